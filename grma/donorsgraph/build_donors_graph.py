@@ -1,169 +1,590 @@
 from __future__ import annotations
 
+import multiprocessing as mp
 import os
 import pickle
-from typing import Union, List
+from collections import OrderedDict
+from functools import partial
+from typing import Union, List, Iterable, Iterator, Dict, Set, Tuple
 
+import numpy as np
 from tqdm import tqdm
 
 from grma.donorsgraph import Edge
 from grma.donorsgraph.create_lol import LolBuilder
-from grma.match.graph_wrapper import Graph
+from grma.match.graph_wrapper import (
+    Graph,
+    compute_alleles_postings,
+    compute_donors_summary,
+    compute_subclasses_genotypes,
+    save_lol_directory,
+)
 from grma.utilities.geno_representation import HashableArray
-from grma.utilities.utils import gl_string_to_integers, tuple_geno_to_int, print_time
+from grma.utilities.node_index import NodeIndex
+from grma.utilities.utils import (
+    GrowingArray,
+    iter_gl_lines,
+    pack_genos,
+    print_time,
+    prune_genotypes,
+    quantize_weights as quantize,
+    subclasses_of_classes,
+    words_to_ints,
+)
 
 CLASS_I_END = 6
 
 
+def _donor_genotypes_weights(
+    probability_dict: Dict[HashableArray, float],
+    total_probability: float,
+    min_genotype_probability: float = 0.0,
+    genotypes_mass: float = 1.0,
+) -> Dict[HashableArray, float]:
+    """
+    Get the normalized probabilities of a donor's genotypes, which are the weights of its edges.
+    The genotypes are pruned first (if asked), and the kept probabilities are renormalized.
+    """
+    genotypes = list(probability_dict)
+    if min_genotype_probability > 0 or genotypes_mass < 1:
+        probabilities = np.array(list(probability_dict.values())) / total_probability
+        kept = prune_genotypes(
+            probabilities,
+            genotypes_mass=genotypes_mass,
+            min_probability=min_genotype_probability,
+        )
+        genotypes = [genotypes[i] for i in kept]
+        total_probability = sum(probability_dict[geno] for geno in genotypes)
+
+    return {HLA: probability_dict[HLA] / total_probability for HLA in genotypes}
+
+
 class BuildMatchingGraph:
     """
     This class responsible for building the graph with the genotypes, classes and subclasses of the donors.
     It gets a path to directory with the donors' file, builds the graph and saved it as LOL graph using Cython.
     """
 
-    __slots__ = "_verbose", "_graph", "_edges"
-
-    def __init__(self, path_to_donors_directory: str, verbose: bool = False):
+    __slots__ = (
+        "_verbose",
+        "_graph",
+        "_edges",
+        "_min_genotype_probability",
+        "_genotypes_mass",
+    )
+
+    def __init__(
+        self,
+        path_to_donors_directory: str,
+        verbose: bool = False,
+        streaming: bool = False,
+        donors_summary: bool = False,
+        min_genotype_probability: float = 0.0,
+        genotypes_mass: float = 1.0,
+        quantize_weights: bool = False,
+        n_workers: int = 1,
+        subclasses_genotypes: bool = False,
+        alleles_postings: bool = False,
+    ):
         """
         Build a donor's graph from the donor's genotypes.
         Args:
             path_to_donors_directory: The path to the donors files directory
             verbose: A boolean flag for whether to print the documentation. default is False
+            streaming: A boolean flag for whether to build the graph in a single pass over the donors files
+                that writes the donors' edges straight into the LOL arrays and builds the rest of the graph
+                in place, instead of keeping an edge-list in memory.
+                The nodes are mapped to their numbers with a compact `NodeIndex`. default is False
+            donors_summary: A boolean flag for whether to precompute and store with the graph
+                each donor's most probable genotype and alleles' probabilities,
+                which are used to decorate the matching results. default is False
+            min_genotype_probability: Drop the genotypes of a donor with a lower (normalized) probability.
+                default is 0 (keep all of them)
+            genotypes_mass: Keep the most probable genotypes of a donor only until their cumulative
+                probability reaches this mass. default is 1 (keep all of them)
+                The most probable genotype of a donor is always kept,
+                and the probabilities of the kept genotypes are renormalized.
+            quantize_weights: A boolean flag for whether to store the weights as uint16 fixed-point numbers
+                instead of float32, which halves the size of the weights list (with a precision of 1/65535).
+                default is False
+            n_workers: The number of processes to parse the donors' files in, when it is bigger than 1.
+                Each file is parsed to arrays in a separate process, and the arrays are merged and built
+                into the graph as array operations (streaming is then ignored).
+                The lines of each donor must be in a single file. default is 1 (no parallelism).
+            subclasses_genotypes: A boolean flag for whether to precompute and store with the graph
+                the genotypes of each subclass (its second degree neighbors) as one contiguous segment,
+                so the candidates of a subclass are a slice instead of a walk over its classes. default is False
+            alleles_postings: A boolean flag for whether to precompute and store with the graph
+                the inverted index of the genotypes by their alleles, which is used by the "alleles"
+                matching engine (otherwise, it is computed on the engine's first search). default is False
         """
         self._verbose = verbose
+        self._min_genotype_probability = min_genotype_probability
+        self._genotypes_mass = genotypes_mass
         self._graph = None  # LOL dict-representation
         self._edges: List[Edge] = []  # edge-list
-        self._save_graph_as_edges(path_to_donors_directory)
-
-    def _create_classes_edges(self, geno, class_, layers):
-        int_class = tuple_geno_to_int(class_)
-
-        self._edges.append(Edge(int_class, geno, 0))
-
-        # check if the class node was created
-        if int_class not in layers["CLASS"]:
-            layers["CLASS"].add(int_class)
-            self._create_subclass_edges(class_, int_class, layers)
+        if n_workers > 1:
+            self._save_graph_parallel(path_to_donors_directory, n_workers)
+        elif streaming:
+            self._save_graph_streaming(path_to_donors_directory)
+        else:
+            self._save_graph_as_edges(path_to_donors_directory)
+        if quantize_weights:
+            self._graph["weights_list"] = quantize(self._graph["weights_list"])
+        if donors_summary:
+            self._graph.update(compute_donors_summary(self._graph))
+        if subclasses_genotypes:
+            self._graph.update(compute_subclasses_genotypes(self._graph))
+        if alleles_postings:
+            self._graph.update(compute_alleles_postings(self._graph))
+
+    @staticmethod
+    def _new_layers() -> Dict[str, Set]:
+        """dict of sets of nodes in each layer"""
+        return {
+            "ID": set(),
+            "GENOTYPE": set(),
+            "CLASS": set(),  # map classes to mp.uint32 objects
+            "SUBCLASS": set(),
+        }
 
-    def _create_subclass_edges(self, class_, int_class, layers):
+    def _classes_edges(self, layers: Dict[str, Set]) -> Iterator[Edge]:
+        """
+        Generate the class->genotype and subclass->class edges of all the genotypes in the graph.
+        The classes and subclasses of all the genotypes are encoded at once, as array operations.
+        """
+        genotypes = list(layers["GENOTYPE"])
+        genotypes_alleles = np.array([geno.np() for geno in genotypes], dtype=np.uint16)
+        genotypes_alleles = genotypes_alleles.reshape(len(genotypes), 10)
+
+        for classes_alleles in (
+            genotypes_alleles[:, :CLASS_I_END],
+            genotypes_alleles[:, CLASS_I_END:],
+        ):
+            int_classes = words_to_ints(pack_genos(classes_alleles))
+
+            new_classes = {}  # {class: the index of its first genotype}
+            for i, (geno, int_class) in enumerate(zip(genotypes, int_classes)):
+                yield Edge(int_class, geno, 0)
+
+                # check if the class node was created
+                if int_class not in layers["CLASS"]:
+                    layers["CLASS"].add(int_class)
+                    new_classes[int_class] = i
+
+            yield from self._subclass_edges(
+                list(new_classes.keys()),
+                classes_alleles[list(new_classes.values())],
+                layers,
+            )
+
+    @staticmethod
+    def _subclass_edges(
+        int_classes: List[int], classes_alleles: np.ndarray, layers: Dict[str, Set]
+    ) -> Iterator[Edge]:
         """
         subclasses edges are created by dropping an allele from a class.
         each allele we drop, will be replaced with zero,
         and will be shifted to the second place in the locus.
         """
-        # create subclasses from class
-        num_of_alleles = len(class_)
+        num_of_alleles = classes_alleles.shape[1]
+        subclasses = subclasses_of_classes(classes_alleles)
+        int_subclasses = words_to_ints(
+            pack_genos(subclasses.reshape(-1, num_of_alleles))
+        )
 
-        subclass_alleles = set()
-        # set the missing allele to always be the second allele in the locus
-        for i in range(num_of_alleles):
-            if i % 2 == 0:
-                subclass_alleles.add(
-                    tuple_geno_to_int(tuple(class_[0:i] + (0,) + class_[i + 1 :]))
+        # add subclass->class edges
+        for i, int_class in enumerate(int_classes):
+            subclass_alleles = set(
+                int_subclasses[i * num_of_alleles : (i + 1) * num_of_alleles]
+            )
+            for sub in subclass_alleles:
+                yield Edge(sub, int_class, 0)
+                if sub not in layers["SUBCLASS"]:
+                    layers["SUBCLASS"].add(sub)
+
+    def _donor_edges(
+        self,
+        donor_id: int,
+        probability_dict: Dict[HashableArray, float],
+        total_probability: float,
+        layers: Dict[str, Set],
+    ) -> Iterator[Edge]:
+        """
+        Generate the id<->genotype edges of a donor, weighted by the normalized probabilities.
+        The donor's genotypes are pruned first (if asked), and the kept probabilities are renormalized.
+        The kept genotypes are added to the genotypes layer. The classes and subclasses are created
+        after all the genotypes are known.
+        """
+        for HLA, weight in _donor_genotypes_weights(
+            probability_dict,
+            total_probability,
+            self._min_genotype_probability,
+            self._genotypes_mass,
+        ).items():
+            layers["GENOTYPE"].add(HLA)
+            yield Edge(HLA, donor_id, weight)
+            yield Edge(donor_id, HLA, weight)
+
+    @staticmethod
+    def _classes_of_genotypes(
+        genotypes: np.ndarray,
+    ) -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray], List[tuple]]:
+        """
+        Create the classes and the subclasses of the genotypes as array operations,
+        for each part of the genotypes (class I and class II).
+        The classes and the subclasses of the parts are numbered consecutively (from 0).
+        :param genotypes: An (N, 10) array of unique genotypes.
+        :return: (classes, subclasses, class_genotype_edges, subclass_class_edges) - for each part,
+            the classes' and the subclasses' arrays, the class (number) of each genotype
+            and the (subclass, class) numbers of the subclass->class edges, sorted.
+        """
+        classes, subclasses = [], []
+        class_genotype_edges, subclass_class_edges = [], []
+        num_of_classes = num_of_subclasses = 0
+        for genotypes_part in (genotypes[:, :CLASS_I_END], genotypes[:, CLASS_I_END:]):
+            part_classes, part_classes_inverse = np.unique(
+                genotypes_part, axis=0, return_inverse=True
+            )
+            class_genotype_edges.append(
+                part_classes_inverse.reshape(-1) + num_of_classes
+            )
+
+            # each subclass is connected once to each of its classes
+            num_of_alleles = part_classes.shape[1]
+            part_subclasses, part_subclasses_inverse = np.unique(
+                subclasses_of_classes(part_classes).reshape(-1, num_of_alleles),
+                axis=0,
+                return_inverse=True,
+            )
+            pairs = np.unique(
+                part_subclasses_inverse.reshape(-1).astype(np.int64) * len(part_classes)
+                + np.repeat(np.arange(len(part_classes)), num_of_alleles)
+            )
+            subclass_class_edges.append(
+                (
+                    pairs // len(part_classes) + num_of_subclasses,
+                    pairs % len(part_classes) + num_of_classes,
                 )
-            else:
-                subclass_alleles.add(
-                    tuple_geno_to_int(
-                        tuple(class_[0 : i - 1] + (0, class_[i - 1]) + class_[i + 1 :])
-                    )
+            )
+
+            classes.append(part_classes)
+            subclasses.append(part_subclasses)
+            num_of_classes += len(part_classes)
+            num_of_subclasses += len(part_subclasses)
+
+        return classes, subclasses, class_genotype_edges, subclass_class_edges
+
+    def _build_from_arrays(
+        self,
+        edges_donors: np.ndarray,
+        edges_genotypes: np.ndarray,
+        edges_weights: np.ndarray,
+        genotypes: np.ndarray,
+    ) -> dict:
+        """
+        Build the LOL dict-representation of the graph from the donor->genotype edges, given as arrays.
+        The genotypes and the donors are deduplicated, and the classes and subclasses are created
+        as array operations. The nodes of each layer are numbered in their sorted order.
+        :param edges_donors: The donor's ID of each edge.
+        :param edges_genotypes: The index of the genotype (in `genotypes`) of each edge.
+        :param edges_weights: The weight of each edge.
+        :param genotypes: An (N, 10) array of genotypes, which may contain duplicates.
+        """
+        genotypes, genotypes_inverse = np.unique(genotypes, axis=0, return_inverse=True)
+        edges_genotypes = genotypes_inverse.reshape(-1)[edges_genotypes]
+        donors, edges_donors = np.unique(edges_donors, return_inverse=True)
+
+        print_time("(2/6) Create the classes and the subclasses")
+        classes, subclasses, class_genotype_edges, subclass_class_edges = (
+            self._classes_of_genotypes(genotypes)
+        )
+        num_of_subclasses = sum(len(part) for part in subclasses)
+
+        # number the nodes according to the donors' graph architecture
+        subclasses_start = len(donors)
+        arrays_start = subclasses_start + num_of_subclasses
+        classes_start = arrays_start + len(genotypes)
+
+        map_node_to_number = OrderedDict()
+        for i, donor_id in enumerate(donors.tolist()):
+            map_node_to_number[donor_id] = i
+        nodes_keys = [words_to_ints(pack_genos(part)) for part in subclasses]
+        nodes_keys.append(words_to_ints(pack_genos(genotypes)))
+        nodes_keys.extend(words_to_ints(pack_genos(part)) for part in classes)
+        for i, key in enumerate(
+            (key for keys in nodes_keys for key in keys), start=subclasses_start
+        ):
+            map_node_to_number[key] = i
+
+        genotypes_numbers = np.arange(arrays_start, classes_start, dtype=np.int64)
+        edges_genotypes = edges_genotypes + arrays_start
+        sources = np.concatenate(
+            [edges_donors, edges_genotypes]
+            + [edges + classes_start for edges in class_genotype_edges]
+            + [subs + subclasses_start for subs, _ in subclass_class_edges]
+        )
+        destinations = np.concatenate(
+            [edges_genotypes, edges_donors]
+            + [genotypes_numbers] * len(class_genotype_edges)
+            + [clss + classes_start for _, clss in subclass_class_edges]
+        )
+        weights = np.zeros(len(sources), dtype=np.float32)
+        weights[: 2 * len(edges_weights)] = np.tile(edges_weights, 2)
+
+        return LolBuilder(
+            directed=True, weighted=True, verbose=self._verbose
+        ).build_from_arrays(
+            sources.astype(np.uint32),
+            destinations.astype(np.uint32),
+            weights,
+            map_node_to_number,
+            donors.astype(np.uint32),
+            genotypes,
+            arrays_start,
+        )
+
+    def _iter_donors_lines(
+        self, path_to_donors_directory: str | os.PathLike
+    ) -> Iterator[str]:
+        """generate the lines of all the donors' imputation files, in the order of the files' names"""
+        for filename in sorted(list(os.listdir(path_to_donors_directory))):
+            with open(os.path.join(path_to_donors_directory, filename)) as f:
+                yield from tqdm(
+                    f,
+                    desc=f"Processing {filename}",
+                    disable=not self._verbose,
                 )
 
-        # add subclass->class edges
-        for sub in subclass_alleles:
-            self._edges.append(Edge(sub, int_class, 0))
-            if sub not in layers["SUBCLASS"]:
-                layers["SUBCLASS"].add(sub)
-
-    def _save_graph_as_edges(self, path_to_donors_directory: str | os.PathLike):
+    @staticmethod
+    def _iter_donors(
+        lines: Iterable[str],
+    ) -> Iterator[Tuple[int, Dict[HashableArray, float], float]]:
         """
-        Process donors imputation files and save them to self._graph as an edgelist
+        Group the imputation lines of each donor (a donor's first line has the index 0).
+        The lines are parsed in chunks to arrays of integers with sorted alleles in each locus (`iter_gl_lines`).
+        :return: A generator of (donor's ID, {genotype: probability}, total probability).
         """
-        print_time("(0/6) donorsgraph edgelist")
-        files = sorted(list(os.listdir(path_to_donors_directory)))
+        probability_dict = {}  # {genotype: probability} for each donor
+        total_probability = 0
+        last_id = None
 
-        # dict of sets of nodes in each layer
-        layers = {
-            "ID": set(),
-            "GENOTYPE": set(),
-            "CLASS": set(),  # map classes to mp.uint32 objects
-            "SUBCLASS": set(),
-        }
+        for donor_id, geno, probability, index in iter_gl_lines(lines):
+            geno = HashableArray(geno)
+
+            # handle new donor appearance in file
+            if index == 0:
+                if last_id is not None:
+                    yield last_id, probability_dict, total_probability
+
+                # initialize parameters
+                total_probability = 0
+                last_id = donor_id
+                probability_dict = {}
+
+            # add probabilities to probability dict
+            total_probability += probability
+            if geno in probability_dict:
+                probability_dict[geno] += probability
+            else:
+                probability_dict[geno] = probability
+
+        # the last donor
+        if last_id is not None:
+            yield last_id, probability_dict, total_probability
+
+    def _iter_edges(
+        self, path_to_donors_directory: str | os.PathLike, layers: Dict[str, Set]
+    ) -> Iterator[Edge]:
+        """
+        Process donors imputation files and generate the graph's edges.
+        The nodes are added to the given layers while generating.
+        The genotypes, classes and subclasses are encoded as integers with `pack_geno`.
+        """
         count_donors = 0
+        for donor_id, probability_dict, total_probability in self._iter_donors(
+            self._iter_donors_lines(path_to_donors_directory)
+        ):
+            count_donors += 1
+            layers["ID"].add(donor_id)
 
-        probability_dict = {}  # {genotype: probability} for each patient
-        total_probability = 0
-        last_id = 0
+            # add id<->geno nodes to edgelist
+            yield from self._donor_edges(
+                donor_id, probability_dict, total_probability, layers
+            )
 
-        for filename in files:
-            with open(os.path.join(path_to_donors_directory, filename)) as f:
-                for line in tqdm(
-                    f.readlines(),
-                    desc=f"Processing {filename}",
-                    disable=not self._verbose,
-                ):
-                    # retrieve all line's parameters
-                    donor_id, geno, probability, index = line.strip().split(",")
-
-                    donor_id = int(donor_id)
-                    index = int(index)
-                    probability = float(probability)
-
-                    # convert geno to list of integers
-                    geno = gl_string_to_integers(geno)
-
-                    # sort alleles for each HLA-X
-                    for x in range(0, 10, 2):
-                        geno[x : x + 2] = sorted(geno[x : x + 2])
-                    geno = HashableArray(geno)
-
-                    # handle new donor appearance in file
-                    if index == 0:
-                        count_donors += 1
-
-                        # add id<->geno nodes to edgelist
-                        for HLA, geno_probability in probability_dict.items():
-                            self._edges.append(
-                                Edge(HLA, last_id, geno_probability / total_probability)
-                            )
-                            self._edges.append(
-                                Edge(last_id, HLA, geno_probability / total_probability)
-                            )
-
-                        # initialize parameters
-                        total_probability = 0
-                        last_id = donor_id
-                        probability_dict = {}
-                        layers["ID"].add(last_id)
-
-                    # continue creation of classes and subclasses
-                    if geno not in layers["GENOTYPE"]:
-                        layers["GENOTYPE"].add(geno)
-                        geno_class1 = tuple(geno[:CLASS_I_END])
-                        geno_class2 = tuple(geno[CLASS_I_END:])
-                        self._create_classes_edges(geno, geno_class1, layers)
-                        self._create_classes_edges(geno, geno_class2, layers)
-
-                    # add probabilities to probability dict
-                    total_probability += probability
-                    if geno in probability_dict:
-                        probability_dict[geno] += probability
-                    else:
-                        probability_dict[geno] = probability
-
-        # add the last donor to edgelist
-        for HLA, probability in probability_dict.items():
-            self._edges.append(Edge(HLA, last_id, probability / total_probability))
-            self._edges.append(Edge(last_id, HLA, probability / total_probability))
-
-        count_donors += 1
         if self._verbose:
             print(f"Total number of donors:{count_donors}")
 
+        yield from self._classes_edges(layers)
+
+    def _save_graph_as_edges(self, path_to_donors_directory: str | os.PathLike):
+        """
+        Process donors imputation files and save them to self._graph as an edgelist
+        """
+        print_time("(0/6) donorsgraph edgelist")
+        layers = self._new_layers()
+        self._edges = list(self._iter_edges(path_to_donors_directory, layers))
+
         # create graph's dict-representation of LOL
         self._graph = LolBuilder(
             directed=True, weighted=True, verbose=self._verbose
         ).build(self._edges, layers)
 
+    def _save_graph_streaming(self, path_to_donors_directory: str | os.PathLike):
+        """
+        Process donors imputation files in a single pass without keeping an edge-list.
+        The donors' rows of the LOL arrays (their genotypes and weights) are appended to arrays
+        while reading, and only the distinct genotypes are kept besides them. These arrays are then
+        extended in place to the graph's arrays (see `LolBuilder.build_from_rows`),
+        and the nodes are mapped to their numbers with a `NodeIndex`.
+        """
+        print_time("(0/6) donorsgraph streaming")
+        donors_ids = GrowingArray(np.int64)
+        donors_degrees = GrowingArray(np.uint32)
+        donors_neighbors = GrowingArray(np.uint32)
+        donors_weights = GrowingArray(np.float32)
+        genotypes = GrowingArray(np.uint16)
+        genotypes_indices: Dict[bytes, int] = {}  # {genotype's alleles: index}
+        genotypes_degrees: List[int] = []
+
+        for donor_id, probability_dict, total_probability in self._iter_donors(
+            self._iter_donors_lines(path_to_donors_directory)
+        ):
+            genotypes_weights = _donor_genotypes_weights(
+                probability_dict,
+                total_probability,
+                self._min_genotype_probability,
+                self._genotypes_mass,
+            )
+            neighbors = []
+            for HLA in genotypes_weights:
+                alleles = HLA.np()
+                index = genotypes_indices.setdefault(
+                    alleles.tobytes(), len(genotypes_indices)
+                )
+                if index == len(genotypes_degrees):
+                    genotypes.extend(alleles)
+                    genotypes_degrees.append(0)
+                genotypes_degrees[index] += 1
+                neighbors.append(index)
+
+            donors_ids.extend([donor_id])
+            donors_degrees.extend([len(neighbors)])
+            donors_neighbors.extend(neighbors)
+            donors_weights.extend(list(genotypes_weights.values()))
+
+        del genotypes_indices
+        donors_ids = donors_ids.finish()
+        donors_degrees = donors_degrees.finish()
+        genotypes = genotypes.finish().reshape(-1, 10)
+        if self._verbose:
+            print(f"Total number of donors:{len(donors_ids)}")
+
+        if len(np.unique(donors_ids)) < len(donors_ids):
+            # the lines of a donor are split between files, so its rows are merged
+            self._graph = self._build_from_arrays(
+                np.repeat(donors_ids, donors_degrees),
+                donors_neighbors.finish(),
+                donors_weights.finish(),
+                genotypes,
+            )
+            return
+
+        print_time("(2/6) Create the classes and the subclasses")
+        classes, subclasses, class_genotype_edges, subclass_class_edges = (
+            self._classes_of_genotypes(genotypes)
+        )
+        num_of_donors = len(donors_ids)
+        num_of_subclasses = sum(len(part) for part in subclasses)
+        num_of_classes = sum(len(part) for part in classes)
+        arrays_start = num_of_donors + num_of_subclasses
+        classes_start = arrays_start + len(genotypes)
+
+        # the rows of the subclasses and the classes
+        subclasses_sources = np.concatenate([subs for subs, _ in subclass_class_edges])
+        subclasses_neighbors = np.concatenate(
+            [clss + classes_start for _, clss in subclass_class_edges]
+        )
+        classes_sources = np.concatenate(class_genotype_edges)
+        classes_neighbors = np.argsort(classes_sources, kind="stable")
+        classes_neighbors = classes_neighbors % len(genotypes) + arrays_start
+
+        num_of_neighbors = np.concatenate(
+            [
+                donors_degrees,
+                np.bincount(subclasses_sources, minlength=num_of_subclasses),
+                genotypes_degrees,
+                np.bincount(classes_sources, minlength=num_of_classes),
+            ]
+        ).astype(np.uint32)
+
+        map_node_to_number = NodeIndex.from_arrays(
+            [
+                donors_ids.astype(np.uint64).reshape(-1, 1),
+                _concatenate_keys([pack_genos(part) for part in subclasses]),
+                pack_genos(genotypes),
+                _concatenate_keys([pack_genos(part) for part in classes]),
+            ],
+            [0, num_of_donors, arrays_start, classes_start],
+        )
+
+        self._graph = LolBuilder(
+            directed=True, weighted=True, verbose=self._verbose
+        ).build_from_rows(
+            num_of_neighbors,
+            donors_neighbors,
+            donors_weights,
+            subclasses_neighbors,
+            classes_neighbors,
+            map_node_to_number,
+            donors_ids.astype(np.uint32),
+            genotypes,
+            arrays_start,
+        )
+
+    def _save_graph_parallel(
+        self, path_to_donors_directory: str | os.PathLike, n_workers: int
+    ):
+        """
+        Parse the donors imputation files in a pool of processes, each file to arrays of its donors' edges,
+        then merge the files' arrays (in the order of the files' names) and build the graph from them.
+        """
+        print_time("(0/6) donorsgraph parallel parsing")
+        files = [
+            os.path.join(path_to_donors_directory, filename)
+            for filename in sorted(list(os.listdir(path_to_donors_directory)))
+        ]
+        parse_file = partial(
+            _parse_donors_file,
+            min_genotype_probability=self._min_genotype_probability,
+            genotypes_mass=self._genotypes_mass,
+        )
+        with mp.get_context("fork").Pool(min(n_workers, max(len(files), 1))) as pool:
+            shards = list(
+                tqdm(
+                    pool.imap(parse_file, files),
+                    desc="Processing the donors' files",
+                    total=len(files),
+                    disable=not self._verbose,
+                )
+            )
+
+        # the genotypes' indices of each file are shifted to the merged genotypes
+        offsets = np.cumsum([0] + [len(shard[3]) for shard in shards])
+        self._graph = self._build_from_arrays(
+            np.concatenate([shard[0] for shard in shards]),
+            np.concatenate(
+                [shard[1] + offset for shard, offset in zip(shards, offsets)]
+            ),
+            np.concatenate([shard[2] for shard in shards]),
+            np.concatenate([shard[3] for shard in shards]),
+        )
+        if self._verbose:
+            print(
+                f"Total number of donors:{len(self._graph['map_number_to_num_node'])}"
+            )
+
     @property
     def graph(self):
         return Graph(self._graph)
@@ -179,3 +600,63 @@ class BuildMatchingGraph:
         :param path: A path to save the pickled object
         """
         pickle.dump(self._graph, open(path, "wb"))
+
+    def to_directory(self, path: Union[str, os.PathLike]):
+        """
+        Save the graph as a directory of raw .npy arrays.
+        To get the graph (memory-mapped) use:
+
+        >>> from grma.match.graph_wrapper import Graph
+        >>> Graph.from_directory(path)
+
+        :param path: A path to the directory. It is created if it does not exist.
+        """
+        save_lol_directory(self._graph, path)
+
+
+def _concatenate_keys(keys: List[np.ndarray]) -> np.ndarray:
+    """concatenate (N, words) arrays of keys, padding the narrower keys with leading zero words"""
+    num_of_words = max(part.shape[1] for part in keys)
+    return np.concatenate(
+        [np.pad(part, ((0, 0), (num_of_words - part.shape[1], 0))) for part in keys]
+    )
+
+
+def _parse_donors_file(
+    path: str | os.PathLike,
+    min_genotype_probability: float = 0.0,
+    genotypes_mass: float = 1.0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse a donors' imputation file to arrays of its donor->genotype edges.
+    :return: The donor's ID, the index of the genotype and the weight of each edge,
+    and an (N, 10) array of the file's genotypes.
+    """
+    edges_donors: List[int] = []
+    edges_genotypes: List[int] = []
+    edges_weights: List[float] = []
+    genotypes: Dict[HashableArray, int] = {}  # {genotype: index}
+    with open(path) as f:
+        for (
+            donor_id,
+            probability_dict,
+            total_probability,
+        ) in BuildMatchingGraph._iter_donors(f):
+            for HLA, weight in _donor_genotypes_weights(
+                probability_dict,
+                total_probability,
+                min_genotype_probability,
+                genotypes_mass,
+            ).items():
+                edges_donors.append(donor_id)
+                edges_genotypes.append(genotypes.setdefault(HLA, len(genotypes)))
+                edges_weights.append(weight)
+
+    return (
+        np.array(edges_donors, dtype=np.int64),
+        np.array(edges_genotypes, dtype=np.int64),
+        np.array(edges_weights, dtype=np.float32),
+        np.array([geno.np() for geno in genotypes], dtype=np.uint16).reshape(
+            len(genotypes), 10
+        ),
+    )
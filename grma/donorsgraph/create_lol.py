@@ -6,7 +6,16 @@ import gc
 from collections import OrderedDict
 
 from grma.donorsgraph import Edge
-from grma.utilities.utils import print_time, tuple_geno_to_int
+from grma.utilities.node_index import NodeIndex
+from grma.utilities.utils import (
+    DEFAULT_KEY_ENCODING,
+    GrowingArray,
+    fill_transposed_rows,
+    pack_genos,
+    print_time,
+    sort_rows,
+    words_to_ints,
+)
 
 
 class LolBuilder:
@@ -16,18 +25,23 @@ class LolBuilder:
         self._directed = directed
         self._weighted = weighted
         self._verbose = verbose
-        self._properties = {"weighted": self._weighted, "directed": self._directed}
+        self._properties = {
+            "weighted": self._weighted,
+            "directed": self._directed,
+            "key_encoding": DEFAULT_KEY_ENCODING,
+        }
         self._graph: List[Edge] = []
 
     def build(self, edge_list: List[Edge], layers: Dict[str, Set]):
         self._graph: List[Edge] = edge_list
         subclasses_start = self._convert(layers)
+        # the edges are already sorted by the conversion
+        return self._finish(subclasses_start)
 
-        neighbors_list, weights_list = self._sort_all(
-            index_list=self._properties["index_list"],
-            neighbors_list=self._properties["neighbors_list"],
-            weights_list=self._properties["weights_list"],
-        )
+    def _finish(self, subclasses_start: int):
+        """add the second degree weights (the neighbors lists are already sorted)"""
+        neighbors_list = self._properties["neighbors_list"]
+        weights_list = self._properties["weights_list"]
         if self._weighted:
             weights_list = self._dist_2nd_weights(
                 subclasses_start,
@@ -43,10 +57,11 @@ class LolBuilder:
         print_time("Finished creating the lol-matching graph")
         return self._properties
 
-    def _convert(self, layers: Dict[str, Set]):
+    def _map_nodes(self, layers: Dict[str, Set]):
         """
-        convert edgelist to LOL dict-representation according to the donors' graph architecture.
+        map the nodes to internal numbers according to the donors' graph architecture.
         :param layers: a dictionary of the graph's layers. each layer is a set of all the nodes it contains.
+        :return: the map from the nodes to their numbers, and where the subclasses mapping starts.
         """
         free = 0
         print_time("(1/6) Convert edgelist to maps from nodes to internal numbers")
@@ -113,84 +128,50 @@ class LolBuilder:
             dtype=np.uint32,
         )
 
-        print_time("(3/6) Create the index list")
-        num_of_neighbors = np.zeros(
-            len(map_node_to_number)
-        )  # set the number of neighbors for every node in
-
-        for edge in tqdm(
-            self._graph, desc="(3.1) Create the index list", disable=not self._verbose
-        ):
-            num_of_neighbors[map_node_to_number[edge.node1]] += 1
-
-            if not self._directed:
-                if edge.node1 != edge.node2:
-                    num_of_neighbors[map_node_to_number[edge.node2]] += 1
+        self._properties["map_number_to_num_node"] = map_number_to_num_node
+        self._properties["map_number_to_arr_node"] = map_number_to_arr_node
+        self._properties["arrays_start"] = arrays_start
 
-        index_list = np.zeros(len(num_of_neighbors) + 1, dtype=np.uint32)
-        for j in tqdm(
-            range(1, len(num_of_neighbors) + 1),
-            desc="(3.2) Create the index list",
-            disable=not self._verbose,
-        ):
-            index_list[j] = index_list[j - 1] + num_of_neighbors[j - 1]
+        return map_node_to_number, subclasses_start
 
-        del num_of_neighbors
-        gc.collect()
+    def _convert(self, layers: Dict[str, Set]):
+        """
+        convert edgelist to LOL dict-representation according to the donors' graph architecture.
+        :param layers: a dictionary of the graph's layers. each layer is a set of all the nodes it contains.
+        """
+        map_node_to_number, subclasses_start = self._map_nodes(layers)
 
-        print_time("(4/6) Create the neighbors list")
-        if self._directed:
-            neighbors_list = -np.ones(len(self._graph))
-            if self._weighted:
-                weights_list = np.zeros(len(self._graph))
+        print_time("(3/6) Create the index list")
+        # edge-list as (source, destination, weight) arrays of internal numbers
+        num_of_edges = len(self._graph)
+        sources = np.fromiter(
+            (map_node_to_number[edge.node1] for edge in self._graph),
+            dtype=np.uint32,
+            count=num_of_edges,
+        )
+        destinations = np.fromiter(
+            (map_node_to_number[edge.node2] for edge in self._graph),
+            dtype=np.uint32,
+            count=num_of_edges,
+        )
+        if self._weighted:
+            weights = np.fromiter(
+                (edge.weight for edge in self._graph),
+                dtype=np.float32,
+                count=num_of_edges,
+            )
         else:
-            neighbors_list = -np.ones(2 * len(self._graph))
-            if self._weighted:
-                weights_list = np.zeros(2 * len(self._graph))
-
-        space = -np.ones(free, dtype=np.int32)
+            weights = np.zeros(num_of_edges, dtype=np.float32)
 
-        for edge in tqdm(
-            self._graph,
-            desc="(4/6) Create the neighbors list",
-            disable=not self._verbose,
-        ):
-            left = map_node_to_number[edge.node1]
-            right = map_node_to_number[edge.node2]
-            if self._weighted:
-                try:
-                    weight = float(edge.weight)
-                except [IndexError, TypeError]:
-                    weight = None
-
-            self._add_weights_and_neighbors(
-                left,
-                right,
-                space,
-                neighbors_list,
-                index_list,
-                weight=weight,
-                weights_list=weights_list,
-            )
+        del self._graph
+        gc.collect()
 
-            if not self._directed and left != right:
-                self._add_weights_and_neighbors(
-                    right,
-                    left,
-                    space,
-                    neighbors_list,
-                    index_list,
-                    weight=weight,
-                    weights_list=weights_list,
-                )
+        index_list, neighbors_list, weights_list = self._edges_to_lol(
+            sources, destinations, weights, len(map_node_to_number)
+        )
 
-        # replace geno hashable array to more efficient representation.
-        for array_geno in layers["GENOTYPE"]:
-            int_geno = tuple_geno_to_int(array_geno)
-            map_node_to_number[int_geno] = map_node_to_number[array_geno]
-            del map_node_to_number[array_geno]
+        self._replace_genotypes_keys(map_node_to_number, layers)
 
-        del self._graph
         del layers
         gc.collect()
 
@@ -199,32 +180,155 @@ class LolBuilder:
         self._properties["neighbors_list"] = neighbors_list
         self._properties["weights_list"] = weights_list
         self._properties["map_node_to_number"] = map_node_to_number
+
+        return subclasses_start
+
+    def build_from_arrays(
+        self,
+        sources: np.ndarray,
+        destinations: np.ndarray,
+        weights: np.ndarray,
+        map_node_to_number: OrderedDict,
+        map_number_to_num_node: np.ndarray,
+        map_number_to_arr_node: np.ndarray,
+        arrays_start: int,
+    ):
+        """
+        Build the graph from an edge-list of internal numbers, given as (source, destination, weight) arrays.
+        The nodes are already mapped to their numbers according to the donors' graph architecture
+        (the donors' IDs are numbered first, and then the subclasses, genotypes and classes),
+        and the genotypes are keyed by their integer representation.
+        :param map_node_to_number: The map from the nodes to their numbers.
+        :param map_number_to_num_node: The donors' IDs, ordered by their numbers.
+        :param map_number_to_arr_node: The genotypes' arrays, ordered by their numbers.
+        :param arrays_start: The number of the first genotype.
+        """
         self._properties["map_number_to_num_node"] = map_number_to_num_node
         self._properties["map_number_to_arr_node"] = map_number_to_arr_node
         self._properties["arrays_start"] = arrays_start
 
-        return subclasses_start
+        print_time("(3/6) Create the index list")
+        index_list, neighbors_list, weights_list = self._edges_to_lol(
+            sources, destinations, weights, len(map_node_to_number)
+        )
+
+        self._properties["index_list"] = index_list
+        self._properties["neighbors_list"] = neighbors_list
+        self._properties["weights_list"] = weights_list
+        self._properties["map_node_to_number"] = map_node_to_number
+
+        # the subclasses are numbered right after the donors
+        return self._finish(len(map_number_to_num_node))
 
-    def _add_weights_and_neighbors(
+    def build_from_rows(
         self,
-        node1,
-        node2,
-        space,
-        neighbors_list,
-        index_list,
-        *,
-        weight=None,
-        weights_list=None
+        num_of_neighbors: np.ndarray,
+        donors_neighbors: GrowingArray,
+        donors_weights: GrowingArray,
+        subclasses_neighbors: np.ndarray,
+        classes_neighbors: np.ndarray,
+        map_node_to_number: NodeIndex,
+        map_number_to_num_node: np.ndarray,
+        map_number_to_arr_node: np.ndarray,
+        arrays_start: int,
     ):
-        if space[node1] != -1:
-            space[node1] += 1
-            i = space[node1]
-        else:
-            i = index_list[node1]
-            space[node1] = i
-        neighbors_list[i] = node2
-        if self._weighted:
-            weights_list[i] = weight
+        """
+        Build the graph in place from the donors' rows, without an edge-list.
+        The donors' rows are extended in place to the neighbors and the weights lists. Then the genotypes' rows
+        are filled with the reversed edges of the donors at their offsets in the index list,
+        and the rows of the subclasses and the classes (whose sizes depend only on the genotypes) are copied.
+        The nodes are numbered according to the donors' graph architecture
+        (the donors' IDs are numbered first, and then the subclasses, genotypes and classes).
+        :param num_of_neighbors: The number of neighbors of each node.
+        :param donors_neighbors: The genotypes of the donors (their indices in map_number_to_arr_node), row by row.
+        :param donors_weights: The weights of the donors' edges, in the same order.
+        :param subclasses_neighbors: The classes (numbers) of the subclasses, row by row.
+        :param classes_neighbors: The genotypes (numbers) of the classes, row by row.
+        :param map_node_to_number: The map from the nodes to their numbers.
+        :param map_number_to_num_node: The donors' IDs, ordered by their numbers.
+        :param map_number_to_arr_node: The genotypes' arrays, ordered by their numbers.
+        :param arrays_start: The number of the first genotype.
+        """
+        subclasses_start = len(map_number_to_num_node)
+        classes_start = arrays_start + len(map_number_to_arr_node)
+
+        print_time("(3/6) Create the index list")
+        index_list = self._create_index_list(num_of_neighbors)
+
+        print_time("(4/6) Create the neighbors list")
+        donors_end = index_list[subclasses_start]
+        neighbors_list = donors_neighbors.finish(index_list[-1])
+        weights_list = donors_weights.finish(index_list[-1])
+        neighbors_list[:donors_end] += np.uint32(arrays_start)
+
+        print_time("(5/6) Sort")
+        sort_rows(index_list, neighbors_list, weights_list, 0, subclasses_start)
+        fill_transposed_rows(
+            index_list,
+            neighbors_list,
+            weights_list,
+            rows=(0, subclasses_start),
+            targets=(arrays_start, classes_start),
+        )
+        neighbors_list[donors_end : index_list[arrays_start]] = subclasses_neighbors
+        neighbors_list[index_list[classes_start] :] = classes_neighbors
+
+        self._properties["map_number_to_num_node"] = map_number_to_num_node
+        self._properties["map_number_to_arr_node"] = map_number_to_arr_node
+        self._properties["arrays_start"] = arrays_start
+        self._properties["index_list"] = index_list
+        self._properties["neighbors_list"] = neighbors_list
+        self._properties["weights_list"] = weights_list
+        self._properties["map_node_to_number"] = map_node_to_number
+
+        return self._finish(subclasses_start)
+
+    def _edges_to_lol(
+        self,
+        sources: np.ndarray,
+        destinations: np.ndarray,
+        weights: np.ndarray,
+        num_of_nodes: int,
+    ):
+        """
+        convert an edge-list of internal numbers to LOL arrays.
+        :return: the index list, the neighbors list and the weights list.
+        """
+        if not self._directed:
+            not_loop = sources != destinations
+            sources, destinations = (
+                np.concatenate([sources, destinations[not_loop]]),
+                np.concatenate([destinations, sources[not_loop]]),
+            )
+            weights = np.concatenate([weights, weights[not_loop]])
+
+        num_of_neighbors = np.bincount(sources, minlength=num_of_nodes)
+        index_list = self._create_index_list(num_of_neighbors)
+
+        del num_of_neighbors
+        gc.collect()
+
+        print_time("(4/6) Create the neighbors list")
+        neighbors_list, weights_list = self._sort_edges(sources, destinations, weights)
+        return index_list, neighbors_list, weights_list
+
+    @staticmethod
+    def _create_index_list(num_of_neighbors: np.ndarray) -> np.ndarray:
+        index_list = np.zeros(len(num_of_neighbors) + 1, dtype=np.uint32)
+        np.cumsum(num_of_neighbors, out=index_list[1:])
+        return index_list
+
+    def _replace_genotypes_keys(
+        self, map_node_to_number: OrderedDict, layers: Dict[str, Set]
+    ):
+        """replace geno hashable array to more efficient representation."""
+        # the genotypes are in the same order as in the map to arrays
+        int_genos = words_to_ints(
+            pack_genos(self._properties["map_number_to_arr_node"])
+        )
+        for array_geno, int_geno in zip(layers["GENOTYPE"], int_genos):
+            map_node_to_number[int_geno] = map_node_to_number[array_geno]
+            del map_node_to_number[array_geno]
 
     def _dist_2nd_weights(
         self, subs_start, subs_end, index_list, neighbors_list, weights_list
@@ -234,43 +338,35 @@ class LolBuilder:
         this information is written only in the first node in order that is connected to the subclass.
         """
         print_time("(6/6) Add weights")
-        for i in tqdm(
-            range(subs_start, subs_end),
-            desc="(6/6) Add weights",
-            disable=not self._verbose,
-        ):
-            neigh_2nd_total = 0
-            start = index_list[i]
-            end = index_list[i + 1]
+        num_of_neighbors = np.diff(index_list).astype(np.int64)
+        subclasses_neighbors = np.arange(subs_end - subs_start)
+        subclasses_neighbors = np.repeat(
+            subclasses_neighbors, num_of_neighbors[subs_start:subs_end]
+        )
 
-            for n in neighbors_list[start:end]:
-                start_n = index_list[n]
-                end_n = index_list[n + 1]
-                neigh_2nd_total += end_n - start_n
+        # the classes of each subclass and the number of genotypes of each class
+        start = index_list[subs_start]
+        end = index_list[subs_end]
+        neigh_2nd = num_of_neighbors[neighbors_list[start:end]]
+        neigh_2nd_total = np.bincount(
+            subclasses_neighbors,
+            weights=neigh_2nd,
+            minlength=subs_end - subs_start,
+        )
 
-            weights_list[start] = neigh_2nd_total
+        has_neighbors = num_of_neighbors[subs_start:subs_end] > 0
+        weights_list[index_list[subs_start:subs_end][has_neighbors]] = neigh_2nd_total[
+            has_neighbors
+        ]
         return weights_list
 
-    def _sort_all(self, index_list=None, neighbors_list=None, weights_list=None):
-        """sort the neighbors for each node"""
-        print_time("(5/6) Sort")
-        neighbors_list = np.array(neighbors_list, dtype=np.uint32)
-        weights_list = np.array(weights_list, dtype=np.float32)
-
-        for number in tqdm(
-            range(len(index_list) - 1), desc="(5/6) Sort", disable=not self._verbose
-        ):
-            start = index_list[number]
-            end = index_list[number + 1]
-            neighbors_list[start:end], weights_list[start:end] = self._sort_neighbors(
-                neighbors_list[start:end], weights_list[start:end]
-            )
+    @staticmethod
+    def _sort_edges(sources, destinations, weights):
+        """
+        group the edges by their source and sort each group by the destinations - in a single global sort.
+        :return: the neighbors list and the weights list.
+        """
+        order = np.lexsort((destinations, sources))
+        neighbors_list = np.asarray(destinations, dtype=np.uint32)[order]
+        weights_list = np.asarray(weights, dtype=np.float32)[order]
         return neighbors_list, weights_list
-
-    def _sort_neighbors(self, neighbors_list=None, weights_list=None):
-        if self._weighted:
-            # sort both neighbors_list and weights_list according to the neighbors_list
-            index = neighbors_list.argsort()
-            return neighbors_list[index], weights_list[index]
-        else:
-            return sorted(neighbors_list), weights_list
@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import os
+import pickle
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+import numpy as np
+
+from grma.donorsgraph.build_donors_graph import BuildMatchingGraph
+from grma.match.graph_wrapper import (
+    ALLELES_POSTINGS_ARRAYS,
+    DONORS_SUMMARY_ARRAYS,
+    SUBCLASSES_GENOTYPES_ARRAYS,
+    Graph,
+    MergedGraph,
+    compute_alleles_postings,
+    compute_donors_summary,
+    compute_subclasses_genotypes,
+    load_lol_directory,
+)
+from grma.utilities.geno_representation import HashableArray
+from grma.utilities.utils import (
+    dequantize_weights,
+    print_time,
+    quantize_weights as quantize,
+)
+
+
+class UpdateMatchingGraph(BuildMatchingGraph):
+    """
+    This class updates a donors' graph with delta files of added, updated and removed donors,
+    without processing all the donors' files again.
+
+    A delta file has the format of the donors' imputation files for the added and the updated donors
+    (an updated donor's genotypes replace all its genotypes in the base graph),
+    and a line with only a donor's ID removes the donor.
+    In each delta file the removals are applied before the added and updated donors,
+    and the delta files are applied in their order.
+
+    The base graph is not changed. The added and updated donors are built into a small graph of their own
+    (the delta segment), and the removed and updated donors of the base graph are tombstoned.
+    The two are merged at query time by `MergedGraph` (the `graph` property), so the time and memory
+    of an update grow with the size of the delta, not of the whole graph.
+    More delta files can be applied with `update`, and `compact` folds the delta segment
+    and the tombstones back into the base graph.
+    """
+
+    __slots__ = (
+        "_delta",
+        "_delta_donors",
+        "_removed",
+        "_donors_summary",
+        "_quantize_weights",
+        "_subclasses_genotypes",
+        "_alleles_postings",
+    )
+
+    def __init__(
+        self,
+        base_graph: Union[dict, str, os.PathLike],
+        delta_paths: Union[str, os.PathLike, Iterable[Union[str, os.PathLike]]],
+        verbose: bool = False,
+        donors_summary: bool | None = None,
+        min_genotype_probability: float = 0.0,
+        genotypes_mass: float = 1.0,
+        quantize_weights: bool | None = None,
+        subclasses_genotypes: bool | None = None,
+        alleles_postings: bool | None = None,
+    ):
+        """
+        Update a donors' graph with delta files.
+
+        Parameters:
+            base_graph: The LOL dict-representation of the base graph,
+                or a path to its pickle (`to_pickle`) or to its directory (`to_directory`).
+                The base graph is not changed.
+            delta_paths: A path to a delta file, or a list of paths to delta files.
+            verbose: A boolean flag for whether to print the documentation. default is False
+            donors_summary: A boolean flag for whether to precompute the donors' summary arrays
+                (see `BuildMatchingGraph`). default is to precompute them only if the base graph has them.
+            min_genotype_probability: Drop the genotypes of the delta donors with a lower probability.
+                default is 0 (keep all of them)
+            genotypes_mass: Keep the most probable genotypes of the delta donors only until their cumulative
+                probability reaches this mass. default is 1 (keep all of them)
+            quantize_weights: A boolean flag for whether to store the weights as uint16 fixed-point numbers.
+                default is to quantize them only if the weights of the base graph are quantized.
+            subclasses_genotypes: A boolean flag for whether to precompute the genotypes of each subclass
+                (see `BuildMatchingGraph`). default is to precompute them only if the base graph has them.
+            alleles_postings: A boolean flag for whether to precompute the alleles' inverted index of the genotypes
+                (see `BuildMatchingGraph`). default is to precompute it only if the base graph has it.
+        """
+        self._verbose = verbose
+        self._min_genotype_probability = min_genotype_probability
+        self._genotypes_mass = genotypes_mass
+        self._edges = []
+
+        self._graph = self._load_base_graph(base_graph)
+        self._delta_donors: Dict[int, Tuple[Dict[HashableArray, float], float]] = {}
+        self._removed: Set[int] = set()
+
+        if quantize_weights is None:
+            quantize_weights = (
+                np.asarray(self._graph["weights_list"]).dtype == np.uint16
+            )
+        if donors_summary is None:
+            donors_summary = all(name in self._graph for name in DONORS_SUMMARY_ARRAYS)
+        if subclasses_genotypes is None:
+            subclasses_genotypes = all(
+                name in self._graph for name in SUBCLASSES_GENOTYPES_ARRAYS
+            )
+        if alleles_postings is None:
+            alleles_postings = all(
+                name in self._graph for name in ALLELES_POSTINGS_ARRAYS
+            )
+        self._quantize_weights = quantize_weights
+        self._donors_summary = donors_summary
+        self._subclasses_genotypes = subclasses_genotypes
+        self._alleles_postings = alleles_postings
+
+        self.update(delta_paths)
+
+    @property
+    def graph(self):
+        """the graph - the base graph and the delta segment, merged at query time"""
+        if not self._delta_donors and not self._removed:
+            return Graph(self._graph)
+        return MergedGraph(
+            self._graph, self._delta, self._removed | self._delta_donors.keys()
+        )
+
+    def update(
+        self, delta_paths: Union[str, os.PathLike, Iterable[Union[str, os.PathLike]]]
+    ):
+        """
+        Apply delta files. Only the delta segment is rebuilt, from all the delta donors since the last `compact`.
+        A base graph with the decimal key encoding (built before the packed encoding) is compacted
+        on its first update, since its keys do not match the delta segment's keys.
+        :param delta_paths: A path to a delta file, or a list of paths to delta files.
+        """
+        if isinstance(delta_paths, (str, os.PathLike)):
+            delta_paths = [delta_paths]
+
+        print_time("(0/6) donorsgraph delta")
+        removed, delta_donors = self._read_deltas(delta_paths)
+        for donor_id in removed:
+            self._delta_donors.pop(donor_id, None)
+        self._removed |= removed
+        self._delta_donors.update(delta_donors)
+
+        if self._graph.get("key_encoding", "decimal") != "packed":
+            self.compact()
+        else:
+            self._delta = self._delta_segment()
+
+    def compact(self):
+        """
+        Fold the delta segment and the tombstones into the base graph.
+        This is a full rebuild from arrays: the kept base donors' edges are taken as they are
+        from the base graph's arrays, and all the nodes are renumbered and all the graph's arrays are recreated
+        (like the parallel build), so its time and memory grow with the size of the whole graph.
+        The result is a compact graph, like a graph built from all the donors' files.
+        """
+        self._graph = self._with_options(
+            self._rebuild(self._graph, self._removed, self._delta_donors)
+        )
+        self._removed = set()
+        self._delta_donors = {}
+        self._delta = self._delta_segment()
+
+    def to_pickle(self, path: Union[str, os.PathLike]):
+        """
+        Save a pickle of the graph, after folding the delta segment into the base graph (see `compact`).
+        :param path: A path to save the pickled object
+        """
+        if self._delta_donors or self._removed:
+            self.compact()
+        super().to_pickle(path)
+
+    def to_directory(self, path: Union[str, os.PathLike]):
+        """
+        Save the graph to a directory, after folding the delta segment into the base graph (see `compact`).
+        :param path: A path to the graph's directory.
+        """
+        if self._delta_donors or self._removed:
+            self.compact()
+        super().to_directory(path)
+
+    def _with_options(self, lol_properties: dict) -> dict:
+        """quantize the weights and add the optional arrays of the graph, like the base graph's"""
+        if self._quantize_weights:
+            lol_properties["weights_list"] = quantize(lol_properties["weights_list"])
+        if self._donors_summary:
+            lol_properties.update(compute_donors_summary(lol_properties))
+        if self._subclasses_genotypes:
+            lol_properties.update(compute_subclasses_genotypes(lol_properties))
+        if self._alleles_postings:
+            lol_properties.update(compute_alleles_postings(lol_properties))
+        return lol_properties
+
+    def _delta_segment(self) -> dict:
+        """build the LOL dict-representation of the delta segment - a graph of only the delta donors"""
+        donors_ids, genotypes, weights = self._delta_edges(self._delta_donors)
+        return self._with_options(
+            self._build_from_arrays(
+                donors_ids, np.arange(len(genotypes)), weights, genotypes
+            )
+        )
+
+    @staticmethod
+    def _load_base_graph(base_graph: Union[dict, str, os.PathLike]) -> dict:
+        if isinstance(base_graph, dict):
+            return base_graph
+        if os.path.isdir(base_graph):
+            return load_lol_directory(base_graph)
+        with open(base_graph, "rb") as f:
+            return pickle.load(f)
+
+    def _read_deltas(
+        self, delta_paths: Iterable[Union[str, os.PathLike]]
+    ) -> Tuple[Set[int], Dict[int, Tuple[Dict[HashableArray, float], float]]]:
+        """
+        Read the delta files.
+        :return: The IDs of the removed donors,
+        and {donor's ID: ({genotype: probability}, total probability)} of the added and updated donors.
+        """
+        removed = set()
+        delta_donors = {}
+        for path in delta_paths:
+            with open(path) as f:
+                lines = [line for line in f if line.strip()]
+
+            for line in lines:
+                if "," not in line:
+                    donor_id = int(line)
+                    removed.add(donor_id)
+                    delta_donors.pop(donor_id, None)
+
+            for donor_id, probability_dict, total_probability in self._iter_donors(
+                line for line in lines if "," in line
+            ):
+                delta_donors[donor_id] = (probability_dict, total_probability)
+
+        if self._verbose:
+            print(
+                f"Removed donors: {len(removed)}, added or updated donors: {len(delta_donors)}"
+            )
+        return removed, delta_donors
+
+    def _delta_edges(
+        self, delta_donors: Dict[int, Tuple[Dict[HashableArray, float], float]]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The donor->genotype edges of the delta donors.
+        :return: The donors' IDs, the genotypes (an (N, 10) array) and the weights of the edges.
+        """
+        donors_ids: List[int] = []
+        genotypes: List[np.ndarray] = []
+        weights: List[float] = []
+        layers = {"GENOTYPE": set()}
+        for donor_id, (probability_dict, total_probability) in delta_donors.items():
+            for edge in self._donor_edges(
+                donor_id, probability_dict, total_probability, layers
+            ):
+                # every edge comes with its opposite edge
+                if isinstance(edge.node1, HashableArray):
+                    continue
+                donors_ids.append(edge.node1)
+                genotypes.append(edge.node2.np())
+                weights.append(edge.weight)
+
+        return (
+            np.array(donors_ids, dtype=np.int64),
+            np.array(genotypes, dtype=np.uint16).reshape(len(genotypes), 10),
+            np.array(weights, dtype=np.float32),
+        )
+
+    def _rebuild(
+        self,
+        base_graph: dict,
+        removed: Set[int],
+        delta_donors: Dict[int, Tuple[Dict[HashableArray, float], float]],
+    ) -> dict:
+        """
+        Rebuild the LOL dict-representation of the whole graph from the kept donor->genotype edges
+        of the base graph and the edges of the delta donors (see `BuildMatchingGraph._build_from_arrays`).
+        """
+        print_time("(1/6) Merge the base donors with the delta donors")
+        index_list = np.asarray(base_graph["index_list"])
+        base_donors = np.asarray(base_graph["map_number_to_num_node"]).astype(np.int64)
+        arrays_start = int(base_graph["arrays_start"])
+
+        # the donor->genotype edges of the base donors that are not removed or updated
+        donors_edges_end = int(index_list[len(base_donors)])
+        edges_donors = np.repeat(
+            np.arange(len(base_donors)), np.diff(index_list[: len(base_donors) + 1])
+        )
+        kept = ~np.isin(base_donors, list(removed | delta_donors.keys()))[edges_donors]
+        base_edges_donors = base_donors[edges_donors[kept]]
+        base_edges_genotypes = (
+            np.asarray(base_graph["neighbors_list"][:donors_edges_end])[kept].astype(
+                np.int64
+            )
+            - arrays_start
+        )
+        base_edges_weights = dequantize_weights(
+            base_graph["weights_list"][:donors_edges_end]
+        )[kept]
+
+        delta_edges_donors, delta_genotypes, delta_edges_weights = self._delta_edges(
+            delta_donors
+        )
+
+        # the base genotypes that are left, together with the new genotypes
+        used_genotypes, base_edges_genotypes = np.unique(
+            base_edges_genotypes, return_inverse=True
+        )
+        return self._build_from_arrays(
+            np.concatenate([base_edges_donors, delta_edges_donors]),
+            np.concatenate(
+                [
+                    base_edges_genotypes,
+                    np.arange(len(delta_genotypes)) + len(used_genotypes),
+                ]
+            ),
+            np.concatenate([base_edges_weights, delta_edges_weights]),
+            np.concatenate(
+                [
+                    np.asarray(base_graph["map_number_to_arr_node"])[used_genotypes],
+                    delta_genotypes,
+                ]
+            ),
+        )
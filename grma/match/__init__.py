@@ -1,3 +1,3 @@
 from grma.match.graph_wrapper import Graph
 from grma.match.donors_matching import set_Database
-from grma.match.match import matching, find_matches
+from grma.match.match import matching, find_matches, iter_matches
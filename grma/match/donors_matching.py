@@ -1,24 +1,28 @@
-from collections.abc import Iterator, Sequence
+from __future__ import annotations
+
+from collections.abc import Sequence
 from typing import List, Tuple, Set, Iterable, Dict
 
-import networkx as nx
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
 from grma.match.graph_wrapper import Graph
+from grma.match.matching_results import MatchingResults
+from grma.match.patients_index import PatientsIndex
 from grma.utilities.geno_representation import HashableArray, ClassMinusOne
 from grma.utilities.utils import (
     donor_mismatch_format,
-    drop_less_than_7_matches,
-    check_similarity,
-    gl_string_to_integers,
-    tuple_geno_to_int,
+    iter_gl_lines,
+    match_genotypes,
     print_time,
+    prune_genotypes,
+    subclasses_of_classes,
+    sum_scores_by_donor,
+    top_k_scores,
 )
 
 DONORS_DB: pd.DataFrame = pd.DataFrame()
-ZEROS: HashableArray = HashableArray([0])
 ALLELES_IN_CLASS_I: int = 6
 ALLELES_IN_CLASS_II: int = 4
 
@@ -32,37 +36,18 @@ def set_Database(donors_db: pd.DataFrame = pd.DataFrame()):
     DONORS_DB = donors_db
 
 
-def _init_results_df(donors_info):
-    """Initialize matching donors' df"""
+def _init_results(donors_info: Iterable[str], capacity: int = 64) -> MatchingResults:
+    """Initialize a matching results' accumulator with the given fields that are in the database"""
     global DONORS_DB
-    fields_in_results = {
-        "Patient_ID": [],
-        "Donor_ID": [],
-        "Number_Of_Mismatches": [],
-        "Matching_Probability": [],
-        "Match_Probability_A_1": [],
-        "Match_Probability_A_2": [],
-        "Match_Probability_B_1": [],
-        "Match_Probability_B_2": [],
-        "Match_Probability_C_1": [],
-        "Match_Probability_C_2": [],
-        "Match_Probability_DQB1_1": [],
-        "Match_Probability_DQB1_2": [],
-        "Match_Probability_DRB1_1": [],
-        "Match_Probability_DRB1_2": [],
-        "Permissive/Non-Permissive": [],
-        "Match_Between_Most_Commons_A": [],
-        "Match_Between_Most_Commons_B": [],
-        "Match_Between_Most_Commons_C": [],
-        "Match_Between_Most_Commons_DQB": [],
-        "Match_Between_Most_Commons_DRB": [],
-    }
-
     donors_db_fields = DONORS_DB.columns.values.tolist()
-    for di in donors_info:
-        if di in donors_db_fields:
-            fields_in_results[di] = []
-    return pd.DataFrame(fields_in_results)
+    return MatchingResults(
+        [di for di in donors_info if di in donors_db_fields], capacity
+    )
+
+
+def _can_reach(bound: float, threshold: float) -> bool:
+    """whether a score bound can reach the threshold (with a margin for the float32 weights' rounding)"""
+    return threshold <= 0 or bound * (1 + 1e-6) >= threshold
 
 
 def locuses_match_between_genos(geno1, geno2):
@@ -78,15 +63,49 @@ def locuses_match_between_genos(geno1, geno2):
     return matches
 
 
+def locuses_matches(geno: Sequence[int], genos: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `locuses_match_between_genos` of a genotype and an (N, 10) array of genotypes.
+    :return: An (N, 5) array of the number of matching alleles in each locus.
+    """
+    geno = np.asarray(geno).reshape(1, 5, 2)
+    genos = np.asarray(genos).reshape(-1, 5, 2)
+    straight = (geno[..., 0] == genos[..., 0]).astype(np.uint8) + (
+        geno[..., 1] == genos[..., 1]
+    )
+    crossed = (geno[..., 0] == genos[..., 1]).astype(np.uint8) + (
+        geno[..., 1] == genos[..., 0]
+    )
+    return np.maximum(straight, crossed)
+
+
 class DonorsMatching(object):
     """DonorsMatching class is in charge of the matching process"""
 
-    __slots__ = "_graph", "_patients_graph", "patients", "verbose"
+    __slots__ = (
+        "_graph",
+        "_patients_index",
+        "_donors_db",
+        "_donors_db_columns",
+        "_scanned_classes",
+        "_scanned_subclasses",
+        "patients",
+        "dropped_probabilities",
+        "verbose",
+    )
 
     def __init__(self, graph: Graph, verbose: bool = False):
         self._graph: Graph = graph
-        self._patients_graph: nx.DiGraph = nx.DiGraph()
+        self._patients_index: PatientsIndex = PatientsIndex()
+        # the fields of the donors' database, aligned to the graph's donors (by LOL ID)
+        self._donors_db: pd.DataFrame | None = None
+        self._donors_db_columns: Dict[str, pd.Series] = {}
+        # the results of the batch search - {class/subclass: {patient's genotype: candidates}}
+        self._scanned_classes: Dict[int, Dict[int, np.ndarray]] = {}
+        self._scanned_subclasses: Dict[int, Dict[int, np.ndarray]] = {}
         self.patients: dict[int, Sequence[int]] = {}
+        # {patient ID: the probability of the genotypes that were pruned}, see `load_patients`
+        self.dropped_probabilities: dict[int, float] = {}
         self.verbose = verbose
 
     def get_most_common_genotype(self, donor_id):
@@ -140,78 +159,82 @@ class DonorsMatching(object):
         Returns the genotypes (ids and values) which are connected to it in the graph"""
         return self._graph.class_neighbors(clss)
 
-    def __find_donor_from_geno(self, geno_id: int) -> Sequence[int]:
-        """Gets the LOL ID of a genotype.
-        Return its neighbors - all the donors that has this genotype."""
-        ids, _ = zip(*self._graph.neighbors(geno_id, search_lol_id=True))
-        return list(ids)
-
-    def __add_matched_genos_to_graph(
+    def __match_genos(
         self,
-        genos: Iterator,
+        genos: np.ndarray,
         genotypes_ids: np.ndarray,
         genotypes_values: np.ndarray,
         allele_range_to_check: np.ndarray,
         matched_alleles: int,
-    ):
-        for geno in genos:
-            # check similarity between geno and all the candidates
-            similarities = check_similarity(
-                geno.np(), genotypes_values, allele_range_to_check, matched_alleles
-            )
+    ) -> List[Tuple[int, np.ndarray]]:
+        """
+        Compare the patients' genotypes to the candidates.
+        Returns a list of (patient's genotype, candidates) - an array of (candidate id, similarity) rows.
+        """
+        if not len(genos):
+            return []
+
+        # compare all the patient's genotypes with all the candidates at once
+        triples = match_genotypes(
+            self._patients_index.genotype(genos),
+            genotypes_values,
+            genotypes_ids,
+            allele_range_to_check,
+            matched_alleles,
+        )
 
-            candidates_to_iterate = drop_less_than_7_matches(
-                genotypes_ids, similarities
-            )
+        # split the (candidate id, patient's genotype index, similarity) rows by the patient's genotypes
+        bounds = np.searchsorted(triples[:, 1], np.arange(len(genos) + 1))
+        matches = []
+        for i, geno in enumerate(genos):
+            if bounds[i] < bounds[i + 1]:
+                matches.append((geno, triples[bounds[i] : bounds[i + 1]][:, [0, 2]]))
+        return matches
 
-            for geno_candidate_id, similarity in candidates_to_iterate:
-                # iterate over all the patients with the genotype
-                for patient_id in self._patients_graph.neighbors(geno):
-                    # patient's geno index (the number of the geno in the imputation file)
-                    geno_num = self._patients_graph[geno][patient_id]["geno_num"]
-                    probability = self._patients_graph[geno][patient_id][
-                        "probability"
-                    ]  # patient's geno probability
-
-                    # add the genotype id as a neighbor to the patient
-                    if geno_candidate_id in self._patients_graph.adj[patient_id]:
-                        self._patients_graph[patient_id][geno_candidate_id]["weight"][
-                            geno_num
-                        ] = [probability, similarity]
-                    else:
-                        self._patients_graph.add_edge(
-                            patient_id,
-                            geno_candidate_id,
-                            weight={geno_num: [probability, similarity]},
-                        )
+    def __add_matched_genos_to_patients(
+        self, matches: List[Tuple[int, np.ndarray]], patient_id: int | None = None
+    ):
+        patient_idx = (
+            self._patients_index.patient_index(patient_id)
+            if patient_id is not None
+            else None
+        )
+        for geno, candidates in matches:
+            # add the candidates to all the patients with the genotype (or only to the given patient)
+            for geno_patient_idx, geno_num, probability in zip(
+                *self._patients_index.genotype_patients(geno)
+            ):
+                if patient_idx is not None and geno_patient_idx != patient_idx:
+                    continue
+                self._patients_index.add_candidates(
+                    geno_patient_idx,
+                    candidates[:, 0],
+                    int(geno_num),
+                    float(probability),
+                    candidates[:, 1],
+                )
 
     def __classes_and_subclasses_from_genotype(self, genotype: HashableArray):
         subclasses = []
-        classes = [genotype[:ALLELES_IN_CLASS_I], genotype[ALLELES_IN_CLASS_I:]]
-        num_of_alleles_in_class = [ALLELES_IN_CLASS_I, ALLELES_IN_CLASS_II]
-
-        int_classes = [tuple_geno_to_int(tuple(clss)) for clss in classes]
-        for clss in int_classes:
-            self._patients_graph.add_edge(clss, genotype)
+        alleles = genotype.np()
+        classes = [alleles[:ALLELES_IN_CLASS_I], alleles[ALLELES_IN_CLASS_I:]]
+        geno_idx = self._patients_index.add_genotype(genotype)
 
+        int_classes = []
         # class one is considered as 0.
         # class two is considered as 1.
-        class_options = [0, 1]
-        for class_num in class_options:
-            for k in range(0, num_of_alleles_in_class[class_num]):
-                # set the missing allele to always be the second allele in the locus
-                if k % 2 == 0:
-                    sub = tuple_geno_to_int(
-                        classes[class_num][0:k] + ZEROS + classes[class_num][k + 1 :]
-                    )
-                else:
-                    sub = tuple_geno_to_int(
-                        classes[class_num][0 : k - 1]
-                        + ZEROS
-                        + classes[class_num][k - 1 : k]
-                        + classes[class_num][k + 1 :]
-                    )
+        for class_num, clss in enumerate(classes):
+            # encode the class and all its subclasses at once.
+            # the missing allele of a subclass is always the second allele in the locus
+            class_and_subclasses = np.concatenate(
+                [clss[np.newaxis, :], subclasses_of_classes(clss[np.newaxis, :])[0]]
+            )
+            int_class, *int_subclasses = self._graph.genos_to_ints(class_and_subclasses)
+
+            int_classes.append(int_class)
+            self._patients_index.add_class(int_class, class_num, geno_idx)
 
+            for k, sub in enumerate(int_subclasses):
                 # missing allele number is the index of the first allele of the locus the missing allele belongs to.
                 # Could be [0, 2, 4, 6, 8]
                 missing_allele_num = ALLELES_IN_CLASS_I * class_num + 2 * (k // 2)
@@ -219,319 +242,500 @@ class DonorsMatching(object):
                     subclass=sub, class_num=class_num, allele_num=missing_allele_num
                 )
 
-                # add subclass -> genotype edge to patients graph
+                # add subclass -> genotype to the patients index
                 subclasses.append(subclass)
 
-                self._patients_graph.add_edge(subclass, genotype)
+                self._patients_index.add_subclass(sub, geno_idx)
 
         return int_classes, subclasses
 
-    def create_patients_graph(self, f_patients: str):
+    def __add_patient(
+        self,
+        patient_id: int,
+        prob_dict: dict,
+        total_prob: float,
+        max_genotypes: int = 0,
+        genotypes_mass: float = 1.0,
+    ) -> Tuple[set, set]:
         """
-        create patients graph. \n
+        Add a patient's genotypes with their normalized probabilities to the patients index.
+        The genotypes can be pruned first (see `load_patients`), and then the probabilities
+        are normalized by the kept probability.
+        :return: The classes and subclasses of the patient's (kept) genotypes.
+        """
+        kept = list(prob_dict)
+        if max_genotypes or genotypes_mass < 1:
+            probs = np.array([prob_dict[geno][1] for geno in kept]) / total_prob
+            kept = [
+                kept[i] for i in prune_genotypes(probs, max_genotypes, genotypes_mass)
+            ]
+        if len(kept) < len(prob_dict):
+            kept_prob = sum(prob_dict[geno][1] for geno in kept)
+            self.dropped_probabilities[patient_id] = 1 - kept_prob / total_prob
+            total_prob = kept_prob
+        elif max_genotypes or genotypes_mass < 1:
+            self.dropped_probabilities[patient_id] = 0.0
+
+        classes, subclasses = set(), set()
+        genos_idx, geno_nums, probabilities = [], [], []
+        for geno in kept:
+            geno_num, probability = prob_dict[geno]
+            geno_classes, geno_subclasses = self.__classes_and_subclasses_from_genotype(
+                geno
+            )
+            classes = classes.union(geno_classes)
+            subclasses = subclasses.union(geno_subclasses)
+
+            genos_idx.append(self._patients_index.add_genotype(geno))
+            geno_nums.append(geno_num)
+            probabilities.append(probability / total_prob)
+        self._patients_index.add_patient(
+            patient_id, genos_idx, geno_nums, probabilities
+        )
+        return classes, subclasses
+
+    def create_patients_graph(
+        self, f_patients: str, max_genotypes: int = 0, genotypes_mass: float = 1.0
+    ):
+        """
+        create the patients index (the patients' genotypes, classes and subclasses). \n
         *takes in consideration that grimm outputs for each patient different genotypes*
+        The patients' genotypes can be pruned with max_genotypes and genotypes_mass (see `load_patients`).
         """
-        self._patients_graph: nx.DiGraph = nx.DiGraph()
-        prob_dict: dict = {}  # {geno: [i, prob]}
+        with open(f_patients) as lines:
+            return self.load_patients(lines, max_genotypes, genotypes_mass)
+
+    def load_patients(
+        self,
+        lines: Iterable[str],
+        max_genotypes: int = 0,
+        genotypes_mass: float = 1.0,
+    ):
+        """
+        Create the patients index from lines of grimm's output, instead of the previous patients.
+        :param lines: The lines of the patients, grouped by patient (index 0 marks a new patient).
+        :param max_genotypes: The maximal number of (most probable) genotypes to keep for each patient.
+        default is 0 (all of them).
+        :param genotypes_mass: Keep the most probable genotypes of each patient until their cumulative
+        probability reaches this mass. default is 1 (all of them).
+        The probabilities of the kept genotypes are renormalized, and the dropped probability
+        of each patient is kept in `dropped_probabilities`.
+        :return: The subclasses and classes of each patient.
+        """
+        self._patients_index = PatientsIndex()
+        self.patients = {}
+        self.dropped_probabilities = {}
+        prob_dict: dict = {}  # {geno: [geno_num, prob]}
         total_prob: float = 0
         last_patient: int = -1
-        # subclasses: list[ClassMinusOne] = []
         subclasses_by_patient = {}
         classes_by_patient = {}
 
-        for line in open(f_patients).readlines():
-            # retrieve all line's parameters
-            patient_id, geno, prob, index = line.strip().split(",")
-
-            geno = gl_string_to_integers(geno)
-            patient_id = int(patient_id)
-            index = int(index)
-            prob = float(prob)
-
+        # the alleles of each locus are sorted by the parser
+        for patient_id, geno, prob, index in iter_gl_lines(lines):
             # handle new patient appearance in file
             if index == 0:
-                # set normalized probabilities
-                for HLA, (_, probability) in prob_dict.items():
-                    self._patients_graph.edges[HLA, last_patient]["probability"] = (
-                        probability / total_prob
+                # add the last patient with normalized probabilities
+                if prob_dict:
+                    (
+                        classes_by_patient[last_patient],
+                        subclasses_by_patient[last_patient],
+                    ) = self.__add_patient(
+                        last_patient,
+                        prob_dict,
+                        total_prob,
+                        max_genotypes,
+                        genotypes_mass,
                     )
 
                 # initialize parameters
                 prob_dict = {}
                 total_prob = 0
-                self.patients[patient_id] = geno
+                self.patients[patient_id] = geno.tolist()
                 last_patient = patient_id
 
-                subclasses_by_patient[patient_id] = set()
-                classes_by_patient[patient_id] = set()
-
-            # sort alleles for each HLA-X
-            for x in range(0, 10, 2):
-                geno[x : x + 2] = sorted(geno[x : x + 2])
-
             geno = HashableArray(geno)
 
-            # add probabilities to probability dict
+            # add probabilities to probability dict.
+            # the geno_num of a genotype that appears more than once is its last index.
             total_prob += prob
             if geno not in prob_dict:
                 prob_dict[geno] = [index, prob]
             else:
+                prob_dict[geno][0] = index
                 prob_dict[geno][1] += prob
 
-            # add genotype->ID edge
-            self._patients_graph.add_edge(
-                geno, patient_id, probability=0, geno_num=index
+        # add the last patient in the file
+        if prob_dict:
+            (
+                classes_by_patient[last_patient],
+                subclasses_by_patient[last_patient],
+            ) = self.__add_patient(
+                last_patient, prob_dict, total_prob, max_genotypes, genotypes_mass
             )
+        self._patients_index.finalize()
 
-            # add subclasses alleles
-            classes, subclasses = self.__classes_and_subclasses_from_genotype(geno)
+        return subclasses_by_patient, classes_by_patient
 
-            subclasses_by_patient[patient_id] = subclasses_by_patient[patient_id].union(
-                subclasses
+    def __subclass_matches(
+        self, subclass: ClassMinusOne, patient_genos: np.ndarray
+    ) -> List[Tuple[int, np.ndarray]]:
+        """the candidates of the patients' genotypes that hold the subclass"""
+        if subclass.subclass in self._scanned_subclasses:
+            scanned = self._scanned_subclasses[subclass.subclass]
+            return [(geno, scanned[geno]) for geno in patient_genos if geno in scanned]
+
+        (
+            genotypes_id,
+            genotypes_value,
+        ) = self.__find_genotype_candidates_from_subclass(subclass.subclass)
+
+        # Checks only the locuses that are not certain to match
+        if subclass.class_num == 0:
+            allele_range_to_check = np.array(
+                [6, 8, subclass.allele_num], dtype=np.uint8
             )
-            classes_by_patient[patient_id] = classes_by_patient[patient_id].union(
-                classes
+        else:
+            allele_range_to_check = np.array(
+                [0, 2, 4, subclass.allele_num], dtype=np.uint8
             )
 
-        # set normalized probabilities to the last patient in the file
-        for g, (_, probability) in prob_dict.items():
-            self._patients_graph.edges[g, last_patient]["probability"] = (
-                probability / total_prob
-            )
+        # number of alleles that already match due to match in subclass
+        matched_alleles: int = (
+            ALLELES_IN_CLASS_II if subclass.class_num == 1 else ALLELES_IN_CLASS_I
+        ) - 2
+
+        # Compares the candidate to the patient's genotypes
+        return self.__match_genos(
+            patient_genos,
+            genotypes_id,
+            genotypes_value,
+            allele_range_to_check,
+            matched_alleles,
+        )
 
-        # return subclasses_by_patient
-        return subclasses_by_patient, classes_by_patient
+    def __class_matches(
+        self, clss: int, patient_genos: np.ndarray
+    ) -> List[Tuple[int, np.ndarray]]:
+        """the candidates of the patients' genotypes that hold the class"""
+        if clss in self._scanned_classes:
+            scanned = self._scanned_classes[clss]
+            return [(geno, scanned[geno]) for geno in patient_genos if geno in scanned]
+
+        (
+            genotypes_ids,
+            genotypes_values,
+        ) = self.__find_genotype_candidates_from_class(clss)
+
+        # Checks only the locuses that are not certain to match (the locuses of the other class)
+        # Class I appearances: 3 locuses = 6 alleles
+        # Class II appearances: 2 locuses = 4 alleles
+        if self._patients_index.class_num(clss) == 0:
+            allele_range_to_check = np.array([6, 8], dtype=np.uint8)
+            matched_alleles: int = 6
+        else:
+            allele_range_to_check = np.array([0, 2, 4], dtype=np.uint8)
+            matched_alleles: int = 4
+
+        # Compares the candidate to the patient's genotypes
+        return self.__match_genos(
+            patient_genos,
+            genotypes_ids,
+            genotypes_values,
+            allele_range_to_check,
+            matched_alleles,
+        )
 
-    def find_geno_candidates_by_subclasses(self, subclasses):
+    def scan_candidates(self, classes: Iterable[int], subclasses: Iterable):
+        """
+        Batch search: compare each of the given classes and subclasses to all the patients' genotypes
+        that hold it, once. The results are kept, and the later searches of the classes and subclasses
+        (`find_geno_candidates_by_classes` and `find_geno_candidates_by_subclasses`) take them from here
+        instead of fetching the candidates from the donors' graph and comparing them again.
+        :param classes: The distinct classes of all the patients.
+        :param subclasses: The distinct subclasses (ClassMinusOne) of all the patients.
+        """
+        for clss in tqdm(
+            classes, desc="scanning classes candidates", disable=not self.verbose
+        ):
+            if self._graph.in_nodes(clss) and clss not in self._scanned_classes:
+                patient_genos = self._patients_index.class_genotypes(clss)
+                self._scanned_classes[clss] = dict(
+                    self.__class_matches(clss, patient_genos)
+                )
+
+        for subclass in tqdm(
+            subclasses, desc="scanning subclasses candidates", disable=not self.verbose
+        ):
+            if (
+                self._graph.in_nodes(subclass.subclass)
+                and subclass.subclass not in self._scanned_subclasses
+            ):
+                patient_genos = self._patients_index.subclass_genotypes(
+                    subclass.subclass
+                )
+                self._scanned_subclasses[subclass.subclass] = dict(
+                    self.__subclass_matches(subclass, patient_genos)
+                )
+
+    def clear_scanned_candidates(self):
+        """drop the results of `scan_candidates`"""
+        self._scanned_classes = {}
+        self._scanned_subclasses = {}
+
+    def find_geno_candidates_by_subclasses(
+        self, subclasses, patient_id: int | None = None
+    ):
+        """
+        Find the genotypes candidates of the subclasses (7-8 matches).
+        :param subclasses: An iterable of the subclasses (ClassMinusOne) to search.
+        :param patient_id: If given, the candidates are added only to this patient.
+        Otherwise, they are added to all the patients with genotypes that hold the subclasses.
+        """
         for subclass in tqdm(
             subclasses,
             desc="finding subclasses matching candidates",
             disable=not self.verbose,
         ):
             if self._graph.in_nodes(subclass.subclass):
-                patient_genos = self._patients_graph.neighbors(
-                    subclass
+                patient_genos = self._patients_index.subclass_genotypes(
+                    subclass.subclass, patient_id
                 )  # The patient's genotypes which might be match
-                (
-                    genotypes_id,
-                    genotypes_value,
-                ) = self.__find_genotype_candidates_from_subclass(subclass.subclass)
-
-                # Checks only the locuses that are not certain to match
-                if subclass.class_num == 0:
-                    allele_range_to_check = np.array(
-                        [6, 8, subclass.allele_num], dtype=np.uint8
-                    )
-                else:
-                    allele_range_to_check = np.array(
-                        [0, 2, 4, subclass.allele_num], dtype=np.uint8
-                    )
 
-                # number of alleles that already match due to match in subclass
-                matched_alleles: int = (
-                    ALLELES_IN_CLASS_II
-                    if subclass.class_num == 1
-                    else ALLELES_IN_CLASS_I
-                ) - 2
-
-                # Compares the candidate to the patient's genotypes, and adds the match geno candidates to the graph.
-                self.__add_matched_genos_to_graph(
-                    patient_genos,
-                    genotypes_id,
-                    genotypes_value,
-                    allele_range_to_check,
-                    matched_alleles,
+                # adds the match geno candidates to the patients.
+                self.__add_matched_genos_to_patients(
+                    self.__subclass_matches(subclass, patient_genos), patient_id
                 )
 
-    def find_geno_candidates_by_classes(self, classes):
+    def find_geno_candidates_by_classes(self, classes, patient_id: int | None = None):
+        """
+        Find the genotypes candidates of the classes (9 matches).
+        :param classes: An iterable of the classes to search.
+        :param patient_id: If given, the candidates are added only to this patient.
+        Otherwise, they are added to all the patients with genotypes that hold the classes.
+        """
         for clss in tqdm(
             classes,
             desc="finding classes matching candidates",
             disable=not self.verbose,
         ):
             if self._graph.in_nodes(clss):
-                patient_genos = self._patients_graph.neighbors(
-                    clss
+                patient_genos = self._patients_index.class_genotypes(
+                    clss, patient_id
                 )  # The patient's genotypes which might be match
-                (
-                    genotypes_ids,
-                    genotypes_values,
-                ) = self.__find_genotype_candidates_from_class(clss)
-
-                # Checks only the locuses that are not certain to match (the locuses of the other class)
-                # Class I appearances: 3 locuses = 6 alleles = 23/24 digits
-                # Class II appearances: 2 locuses = 4 alleles = 15/16 digits
-                if len(str(clss)) > 20:
-                    allele_range_to_check = np.array([6, 8], dtype=np.uint8)
-                    matched_alleles: int = 6
-                else:
-                    allele_range_to_check = np.array([0, 2, 4], dtype=np.uint8)
-                    matched_alleles: int = 4
-
-                # Compares the candidate to the patient's genotypes, and adds the match geno candidates to the graph.
-                self.__add_matched_genos_to_graph(
-                    patient_genos,
-                    genotypes_ids,
-                    genotypes_values,
-                    allele_range_to_check,
-                    matched_alleles,
+
+                # adds the match geno candidates to the patients.
+                self.__add_matched_genos_to_patients(
+                    self.__class_matches(clss, patient_genos), patient_id
                 )
 
-                # Send the class and the genotypes of the patients that the class belong to
-                # self.__add_class_candidates(clss, self._patients_graph.neighbors(clss))
+    def find_geno_candidates_by_alleles(self, patient_id: int, min_matches: int = 7):
+        """
+        Find the genotypes candidates of a patient with min_matches-9 matches at once,
+        by counting the hits of each of the patient's genotypes in the alleles' inverted index of the graph
+        (instead of walking its classes and subclasses).
+        :param patient_id: The patient's ID.
+        :param min_matches: The minimal number of matches of a candidate.
+        """
+        genos, geno_nums, probabilities = self._patients_index.patient_genotypes(
+            patient_id
+        )
+        patient_idx = self._patients_index.patient_index(patient_id)
+
+        for geno, geno_num, probability in zip(
+            self._patients_index.genotype(genos), geno_nums, probabilities
+        ):
+            genos_ids, similarities = self._graph.alleles_candidates(geno, min_matches)
+            if len(genos_ids):
+                self._patients_index.add_candidates(
+                    patient_idx,
+                    genos_ids,
+                    int(geno_num),
+                    float(probability),
+                    similarities,
+                )
 
     def find_geno_candidates_by_genotypes(self, patient_id: int):
         """This function gets a patient id, and adds his genotypes as candidates to the graph.
         We know these candidates are "perfect" - 10 matches - because the user has exactly these genotypes.
         """
-        genos = self._patients_graph.predecessors(patient_id)
-        for geno in genos:
-            geno_num = self._patients_graph[geno][patient_id][
-                "geno_num"
-            ]  # patient's geno index
-            probability = self._patients_graph[geno][patient_id][
-                "probability"
-            ]  # patient's geno probability
-
-            int_geno = tuple_geno_to_int(geno)
-            geno_id = self._graph.get_node_id(int_geno)
-            if not geno_id:
+        genos, geno_nums, probabilities = self._patients_index.patient_genotypes(
+            patient_id
+        )
+        patient_idx = self._patients_index.patient_index(patient_id)
+        genos_ids = self._graph.get_node_ids(
+            self._graph.genos_to_ints(self._patients_index.genotype(genos))
+        )
+
+        for geno_id, geno_num, probability in zip(genos_ids, geno_nums, probabilities):
+            if geno_id <= 0:
                 continue
 
-            # This has to be a new edge, because this is the first level (searching by genos),
-            # and each patient connect only to his own genos, so we wouldn't override the weight dict.
-            self._patients_graph.add_edge(
-                patient_id, geno_id, weight={geno_num: [probability, 10]}
+            # This is the first level (searching by genos), and each patient connect only to his own genos,
+            # so the previous candidates with this genotype are dropped.
+            self._patients_index.add_candidates(
+                patient_idx,
+                np.array([geno_id], dtype=np.uint32),
+                int(geno_num),
+                float(probability),
+                np.array([10], dtype=np.uint32),
+                reset=True,
             )
 
+    def subclasses_bound(self, patient_id: int, subclasses: Iterable) -> float:
+        """
+        An upper bound of the score of any donor with 1-3 mismatches to the patient.
+        Each of the patient's genotypes contributes its probability times the total weight a donor can get
+        from its candidates (at most 1), and every candidate with 7-9 matches is a second degree neighbor
+        of one of the genotype's subclasses. So if the bound is below the threshold,
+        the classes and subclasses can be skipped without changing the results.
+        :param patient_id: The patient's ID.
+        :param subclasses: The patient's subclasses (ClassMinusOne).
+        """
+        genos, _, probabilities = self._patients_index.patient_genotypes(patient_id)
+        genos_positions = {geno: i for i, geno in enumerate(genos.tolist())}
+        subclasses = [subclass.subclass for subclass in subclasses]
+        bounds = self._graph.weight_bounds(self._graph.get_node_ids(subclasses))
+
+        genos_bounds = np.zeros(len(genos), dtype=np.float64)
+        for subclass, bound in zip(subclasses, bounds.tolist()):
+            if bound > 0:
+                for geno in self._patients_index.subclass_genotypes(
+                    subclass, patient_id
+                ).tolist():
+                    genos_bounds[genos_positions[geno]] += bound
+        return float(np.dot(probabilities, np.minimum(genos_bounds, 1.0)))
+
+    def clear_candidates(self, patient_id: int):
+        """drop the candidates that were found for a patient, after the search for it is done"""
+        self._patients_index.clear_candidates(patient_id)
+
     def score_matches(
         self,
         mismatch: int,
-        results_df: pd.DataFrame,
-        donors_info: Iterable[str],
+        results: MatchingResults,
         patient: int,
         threshold: float,
         cutof: int,
         matched: Set[int],
-    ) -> Tuple[Set[int], int, pd.DataFrame]:
+    ) -> Tuple[Set[int], int]:
         """
-        Given a number of mismatches and a patient, this function will return a dictionary
-        of all matching donors found in the data with the specific number of mismatches,
+        Given a number of mismatches and a patient, this function will add to the results
+        all matching donors found in the data with the specific number of mismatches,
         sorted by their probability for a match.
 
         :param mismatch: number of mismatch to search. could be 0, 1, 2, 3.
-        :param results_df: A df storing the matching results.
-        :param donors_info: a list of fields from Database to add to the matching results.
+        :param results: The accumulator of the matching results.
         :param patient: patient ID.
         :param threshold: Minimal score value for a valid match. default is 0.1.
         :param cutof: Maximum number of matches to return. default is 50.
         :param matched: A set of donors ID that have already matched for this patient.
-        :return: a dictionary of all matching donors and their matching properties.
+        :return: The matched donors and the number of matches found.
         """
         if len(matched) >= cutof:
-            return matched, 0, results_df
-
-        # a loop that set the scores for all the matching candidates.
-        patient_scores = {}
-        for hla_id in self._patients_graph.neighbors(patient):
-            for i, (prob, matches) in self._patients_graph.get_edge_data(
-                patient, hla_id
-            )["weight"].items():
-                # match_info = (probability of patient's genotype, number of matches to patient's genotype)
-                if matches != 10 - mismatch:
-                    continue
-
-                # add the probabilities multiplication of the patient and all the donors that has this genotype
-                # to their matching probabilities.
-                for donor in self.__find_donor_from_geno(hla_id):
-                    donor_prob = self._graph.get_edge_data(
-                        node1=hla_id, node2=donor, node1_id=True
-                    )
-                    if donor in patient_scores:
-                        patient_scores[donor][0] += prob * donor_prob
-                        if donor_prob > patient_scores[donor][2]:
-                            patient_scores[donor][1:] = [hla_id, donor_prob]
-
-                    else:
-                        patient_scores[donor] = [prob * donor_prob, hla_id, donor_prob]
-
-        ids_scores = []
-        count_matches = 0
+            return matched, 0
 
-        # sort matching according to their probability
-        for donor in patient_scores.keys():
-            # do not count or match to an already matched donors.
-            if donor in matched or patient_scores[donor][0] < threshold:
-                continue
+        # gather the patient's genotypes candidates with the right number of matches.
+        genos_ids, genos_probs, similarities = self._patients_index.candidates(patient)
+        with_matches = similarities == 10 - mismatch
+        genos_ids, genos_probs = genos_ids[with_matches], genos_probs[with_matches]
 
-            count_matches += 1
-            ids_scores.append((donor, patient_scores[donor][0]))
+        # no donor can reach the threshold - a donor gets at most the maximal weight of each candidate
+        if not _can_reach(
+            np.dot(genos_probs, self._graph.weight_bounds(genos_ids)), threshold
+        ):
+            return matched, 0
 
-        ids_scores.sort(reverse=True, key=lambda x: x[1])
+        # get all the donors that have these genotypes and their probabilities at once.
+        offsets, donors_ids, donors_probs = self._graph.genotype_donor_weights(
+            genos_ids
+        )
 
-        add_donors = {col: [] for col in results_df.columns.values.tolist()}
+        # the score of a donor is the sum of the probabilities multiplication of the patient's genotypes
+        # and the donor's genotypes.
+        contributions = np.repeat(genos_probs, np.diff(offsets)) * donors_probs.astype(
+            np.float64
+        )
+        donors_ids, scores = sum_scores_by_donor(donors_ids, contributions)
+        donors = self._graph.donors_from_ids(donors_ids)
+
+        # do not count or match to an already matched donors.
+        valid = scores >= threshold
+        if matched:
+            valid &= ~np.isin(donors, np.fromiter(matched, dtype=donors.dtype))
+        donors, scores, donors_ids = donors[valid], scores[valid], donors_ids[valid]
+        count_matches = len(donors)
+
+        # take the best matches, sorted according to their probability (and the donors' IDs in a tie)
+        best = top_k_scores(scores, donors, cutof - len(matched))
+        best_donors = donors[best].tolist()
+        most_commons, alleles_probs = self.__decorations(
+            patient, best_donors, donors_ids[best]
+        )
 
         # write matching donors to results.
-        for donor, score in ids_scores:
-            if len(matched) >= cutof:
-                break
-            matched.add(donor)
-            self.__append_matching_donor(
-                add_donors, donors_info, patient, donor, score * 100, mismatch
-            )
-
-        results_df = pd.concat(
-            [results_df, pd.DataFrame(add_donors)], ignore_index=True
+        matched.update(best_donors)
+        results.append(
+            patient,
+            best_donors,
+            mismatch,
+            scores[best] * 100,
+            alleles_probs,
+            locuses_matches(self.patients[patient], most_commons),
+            self.__donors_info(results.donors_info, donors_ids[best]),
         )
 
         if self.verbose:
             print_time(f"({mismatch} MMs) Found {count_matches} matches")
 
-        return matched, count_matches, results_df
+        return matched, count_matches
 
-    def __append_matching_donor(
-        self,
-        add_donors: Dict,
-        donors_info: Iterable[str],
-        patient: int,
-        donor: int,
-        match_prob: float,
-        mm_number: int,
-    ) -> None:
-        """add a donor to the matches dictionary"""
-
-        compare_commons = locuses_match_between_genos(
-            self.patients[patient], self.get_most_common_genotype(donor)
-        )
+    def __donors_info(
+        self, fields: List[str], donors_ids: np.ndarray
+    ) -> Dict[str, pd.api.extensions.ExtensionArray]:
+        """
+        Take the given fields of the donors (by their LOL IDs) from the donors' database.
+        Each field is aligned to the graph's donors once, so the lookups are `take` calls.
+        Donors that are not in the database get a missing value, and a donor that appears
+        more than once in the database gets the values of its first row.
+        The values keep the dtypes of the database's columns (as `reindex` does).
+        """
+        if not fields:
+            return {}
+        if self._donors_db is not DONORS_DB:
+            self._donors_db = DONORS_DB
+            self._donors_db_columns = {}
+
+        info = {}
+        for field in fields:
+            if field not in self._donors_db_columns:
+                column = DONORS_DB[field]
+                column = column[~column.index.duplicated(keep="first")]
+                self._donors_db_columns[field] = column.reindex(self._graph.donors())
+            info[field] = self._donors_db_columns[field].array.take(donors_ids)
+        return info
+
+    def __decorations(
+        self, patient: int, donors: List[int], donors_ids: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns an (N, 10) array of the most common genotype of each donor,
+        and an (N, 10) array of the probability of match for each of the patient's alleles (as percents).
+        Taken from the donors' summary arrays if the graph has them, otherwise from the donors' neighbors.
+        """
+        pat_geno = self.patients[patient]
+        if not self._graph.has_donors_summary():
+            return (
+                np.array(
+                    [self.get_most_common_genotype(donor) for donor in donors]
+                ).reshape(-1, 10),
+                np.array(
+                    [self.probability_to_allele(donor, pat_geno) for donor in donors]
+                ).reshape(-1, 10),
+            )
 
-        add_donors["Patient_ID"].append(patient)
-        add_donors["Donor_ID"].append(donor)
-        allele_prob = self.probability_to_allele(
-            don_id=donor, pat_geno=self.patients[patient]
+        most_commons = self._graph.donors_most_common_genotypes(donors_ids)
+        alleles_probs = self._graph.donors_alleles_probabilities(
+            donors_ids, np.broadcast_to(np.array(pat_geno), (len(donors), 10))
         )
-        add_donors["Match_Probability_A_1"].append(allele_prob[0])
-        add_donors["Match_Probability_A_2"].append(allele_prob[1])
-        add_donors["Match_Probability_B_1"].append(allele_prob[2])
-        add_donors["Match_Probability_B_2"].append(allele_prob[3])
-        add_donors["Match_Probability_C_1"].append(allele_prob[4])
-        add_donors["Match_Probability_C_2"].append(allele_prob[5])
-        add_donors["Match_Probability_DQB1_1"].append(allele_prob[6])
-        add_donors["Match_Probability_DQB1_2"].append(allele_prob[7])
-        add_donors["Match_Probability_DRB1_1"].append(allele_prob[8])
-        add_donors["Match_Probability_DRB1_2"].append(allele_prob[9])
-
-        add_donors["Match_Between_Most_Commons_A"].append(compare_commons[0])
-        add_donors["Match_Between_Most_Commons_B"].append(compare_commons[1])
-        add_donors["Match_Between_Most_Commons_C"].append(compare_commons[2])
-        add_donors["Match_Between_Most_Commons_DQB"].append(compare_commons[3])
-        add_donors["Match_Between_Most_Commons_DRB"].append(compare_commons[4])
-
-        add_donors["Matching_Probability"].append(match_prob)
-        add_donors["Number_Of_Mismatches"].append(mm_number)
-        add_donors["Permissive/Non-Permissive"].append(
-            "-"
-        )  # TODO: add permissiveness algorithm
-
-        # add the other given fields to the results
-        for field in donors_info:
-            add_donors[field].append(DONORS_DB.loc[donor, field])
+        return most_commons, np.round(alleles_probs * np.float32(100))
@@ -1,29 +1,379 @@
 from __future__ import annotations
 
+import json
+import os
 import pickle
+from collections import OrderedDict
 from os import PathLike
-from typing import Union
+from typing import Iterable, Sequence, Union
 
 import numpy as np
 
 from grma.utilities.geno_representation import HashableArray
+from grma.utilities.node_index import NodeIndex
+from grma.utilities.utils import (
+    ALLELES_KEYS,
+    KEY_ENCODINGS,
+    alleles_keys,
+    count_postings,
+    dequantize_weights,
+    pack_genos,
+    words_to_ints,
+)
 from grma.match.lol_graph import LolGraph
 
 NODES_TYPES = Union[int, HashableArray]
+LOL_ARRAYS = (
+    "index_list",
+    "neighbors_list",
+    "weights_list",
+    "map_number_to_num_node",
+    "map_number_to_arr_node",
+)
+LOL_ATTRIBUTES = ("arrays_start", "directed", "weighted", "key_encoding")
+LOL_ATTRIBUTES_FILE = "lol_properties.json"
+# optional arrays of per-donor precomputed values, see `compute_donors_summary`
+DONORS_SUMMARY_ARRAYS = (
+    "donors_most_common",
+    "donors_alleles_index",
+    "donors_alleles",
+    "donors_alleles_probs",
+)
+DONORS_SUMMARY_BLOCK: int = 1_000_000  # number of edges to process at once
+# optional CSR of the genotypes of each subclass, see `compute_subclasses_genotypes`
+SUBCLASSES_GENOTYPES_ARRAYS = ("subclasses_genotypes_index", "subclasses_genotypes")
+# optional inverted index of the genotypes by their alleles, see `compute_alleles_postings`
+ALLELES_POSTINGS_ARRAYS = ("alleles_postings_index", "alleles_postings")
+OPTIONAL_ARRAYS = (
+    DONORS_SUMMARY_ARRAYS + SUBCLASSES_GENOTYPES_ARRAYS + ALLELES_POSTINGS_ARRAYS
+)
+
+
+def save_lol_directory(lol_properties: dict, path: Union[str, PathLike]):
+    """
+    Save the LOL dict-representation of the graph as a directory of raw .npy arrays,
+    which can be memory-mapped by `Graph.from_directory`.
+    The map from the nodes to their numbers is saved as a `NodeIndex`.
+
+    :param lol_properties: The LOL dict-representation of the graph.
+    :param path: A path to the directory. It is created if it does not exist.
+    """
+    os.makedirs(path, exist_ok=True)
+    for name in LOL_ARRAYS:
+        np.save(os.path.join(path, f"{name}.npy"), lol_properties[name])
+    for name in OPTIONAL_ARRAYS:
+        if name in lol_properties:
+            np.save(os.path.join(path, f"{name}.npy"), lol_properties[name])
+
+    attributes = {
+        "arrays_start": int(lol_properties["arrays_start"]),
+        "directed": bool(lol_properties["directed"]),
+        "weighted": bool(lol_properties["weighted"]),
+        "key_encoding": lol_properties.get("key_encoding", "decimal"),
+    }
+    with open(os.path.join(path, LOL_ATTRIBUTES_FILE), "w") as f:
+        json.dump(attributes, f)
+
+    node_index = lol_properties["map_node_to_number"]
+    if not isinstance(node_index, NodeIndex):
+        node_index = NodeIndex.from_map(node_index, _layers_starts(lol_properties))
+    node_index.save(path)
+
+
+def load_lol_directory(path: Union[str, PathLike], mmap: bool = True) -> dict:
+    """
+    Load the LOL dict-representation of a graph saved with `save_lol_directory`.
+    :param path: A path to the graph's directory.
+    :param mmap: A boolean flag for whether to memory-map the arrays (read-only) instead of reading them.
+    """
+    mmap_mode = "r" if mmap else None
+    graph_dict = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in LOL_ARRAYS
+    }
+    for name in OPTIONAL_ARRAYS:
+        if os.path.exists(os.path.join(path, f"{name}.npy")):
+            graph_dict[name] = np.load(
+                os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode
+            )
+    with open(os.path.join(path, LOL_ATTRIBUTES_FILE)) as f:
+        graph_dict.update(json.load(f))
+    graph_dict["map_node_to_number"] = NodeIndex.load(path, mmap_mode=mmap_mode)
+    return graph_dict
+
+
+def compute_subclasses_genotypes(lol_properties: dict) -> dict:
+    """
+    Precompute the second degree neighbors of each subclass (the genotypes of its classes) as a CSR,
+    so the candidates of a subclass are a slice of it instead of a walk over its classes:
+    - subclasses_genotypes_index: (number of subclasses + 1) - the start of each subclass's genotypes.
+    - subclasses_genotypes: the LOL IDs of the genotypes, in the order of `LolGraph.neighbors_2nd`.
+    """
+    _, subclasses_start, arrays_start, _ = _layers_starts(lol_properties)
+    index_list = np.asarray(lol_properties["index_list"], dtype=np.int64)
+    neighbors_list = lol_properties["neighbors_list"]
+
+    # the classes of all the subclasses, and the range of the genotypes of each class
+    first, last = index_list[subclasses_start], index_list[arrays_start]
+    classes = np.asarray(neighbors_list[first:last], dtype=np.int64)
+    classes_starts = index_list[classes]
+    classes_sizes = index_list[classes + 1] - classes_starts
+    ends = np.concatenate([[0], np.cumsum(classes_sizes)])
+
+    # concatenate the ranges of the genotypes of the classes
+    positions = np.arange(ends[-1], dtype=np.int64) + np.repeat(
+        classes_starts - ends[:-1], classes_sizes
+    )
+    return {
+        "subclasses_genotypes_index": ends[
+            index_list[subclasses_start : arrays_start + 1] - first
+        ],
+        "subclasses_genotypes": np.asarray(neighbors_list)[positions].astype(np.uint32),
+    }
+
+
+def compute_alleles_postings(lol_properties: dict) -> dict:
+    """
+    Precompute an inverted index of the genotypes by their alleles (see `alleles_keys`) as a CSR,
+    so the genotypes with at least K matching alleles to a genotype are found by counting
+    the hits of its 10 postings lists (see `Graph.alleles_candidates`):
+    - alleles_postings_index: (ALLELES_KEYS + 1) - the start of the postings list of each key.
+    - alleles_postings: the genotypes (LOL ID - arrays_start) of each key, sorted.
+    """
+    genotypes = np.asarray(lol_properties["map_number_to_arr_node"])
+    keys = alleles_keys(genotypes).reshape(-1)
+    postings = np.repeat(np.arange(len(genotypes), dtype=np.uint32), 10)
+
+    index = np.zeros(ALLELES_KEYS + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=ALLELES_KEYS), out=index[1:])
+    return {
+        "alleles_postings_index": index,
+        # a stable sort keeps the postings of each key sorted
+        "alleles_postings": postings[np.argsort(keys, kind="stable")],
+    }
+
+
+def compute_donors_summary(lol_properties: dict) -> dict:
+    """
+    Precompute for each donor the values that are used to decorate the matching results:
+    - donors_most_common: (number of donors, 10) - the donor's most probable genotype.
+    - donors_alleles_index, donors_alleles, donors_alleles_probs: a CSR of the alleles in the donor's genotypes
+      (sorted), and for each allele the sum of the probabilities of the donor's genotypes that contain it.
+    The donors are ordered by their LOL IDs. The probabilities are summed as float32 in the neighbors' order,
+    so they are identical to summing them over the donor's neighbors.
+
+    :param lol_properties: The LOL dict-representation of the graph.
+    :return: A dict of the summary arrays, to add to the LOL dict-representation.
+    """
+    index_list = np.asarray(lol_properties["index_list"])
+    neighbors_list = np.asarray(lol_properties["neighbors_list"])
+    weights_list = dequantize_weights(lol_properties["weights_list"])
+    map_number_to_arr_node = np.asarray(lol_properties["map_number_to_arr_node"])
+    arrays_start = int(lol_properties["arrays_start"])
+    num_of_donors = len(lol_properties["map_number_to_num_node"])
+
+    degrees = np.diff(index_list[: num_of_donors + 1].astype(np.int64))
+    most_common = np.zeros((num_of_donors, 10), dtype=np.uint16)
+    alleles_counts = np.zeros(num_of_donors, dtype=np.int64)
+    alleles, alleles_probs = [], []
+
+    block_start = 0
+    while block_start < num_of_donors:
+        # a block of donors with about DONORS_SUMMARY_BLOCK edges
+        block_end = int(
+            np.searchsorted(
+                index_list[: num_of_donors + 1],
+                index_list[block_start] + DONORS_SUMMARY_BLOCK,
+                "right",
+            )
+        )
+        block_end = min(max(block_end - 1, block_start + 1), num_of_donors)
+        start, end = int(index_list[block_start]), int(index_list[block_end])
+        donors = np.repeat(
+            np.arange(block_start, block_end), degrees[block_start:block_end]
+        )
+        weights = weights_list[start:end]
+        genos = map_number_to_arr_node[neighbors_list[start:end] - arrays_start]
+
+        # the first genotype with the highest probability of each donor
+        has_neighbors = degrees[block_start:block_end] > 0
+        offsets = (index_list[block_start:block_end] - start)[has_neighbors]
+        max_weights = np.maximum.reduceat(weights, offsets)
+        is_max = weights == np.repeat(
+            max_weights, degrees[block_start:block_end][has_neighbors]
+        )
+        first_max = np.minimum.reduceat(
+            np.where(is_max, np.arange(len(weights)), len(weights)), offsets
+        )
+        most_common[block_start:block_end][has_neighbors] = genos[first_max]
+
+        # the distinct alleles of each genotype, with the genotype's donor and probability
+        sorted_genos = np.sort(genos, axis=1)
+        distinct = np.ones(sorted_genos.shape, dtype=bool)
+        distinct[:, 1:] = sorted_genos[:, 1:] != sorted_genos[:, :-1]
+        edges, positions = np.nonzero(distinct)
+        keys = (donors[edges].astype(np.int64) << 16) | sorted_genos[edges, positions]
+
+        # sum the probabilities of each (donor, allele) in the neighbors' order
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        sums = np.zeros(len(unique_keys), dtype=np.float32)
+        np.add.at(sums, inverse, weights[edges])
+
+        alleles_counts[block_start:block_end] = np.bincount(
+            (unique_keys >> 16) - block_start, minlength=block_end - block_start
+        )
+        alleles.append((unique_keys & 0xFFFF).astype(np.uint16))
+        alleles_probs.append(sums)
+        block_start = block_end
+
+    alleles_index = np.zeros(num_of_donors + 1, dtype=np.int64)
+    np.cumsum(alleles_counts, out=alleles_index[1:])
+    return {
+        "donors_most_common": most_common,
+        "donors_alleles_index": alleles_index,
+        "donors_alleles": np.concatenate(alleles + [np.zeros(0, dtype=np.uint16)]),
+        "donors_alleles_probs": np.concatenate(
+            alleles_probs + [np.zeros(0, dtype=np.float32)]
+        ),
+    }
+
+
+def _search_segments(
+    values: np.ndarray, starts: np.ndarray, ends: np.ndarray, keys: np.ndarray
+) -> np.ndarray:
+    """
+    A vectorized `np.searchsorted` of many keys, each in its own sorted segment of values.
+    All the keys are bisected together, so it takes log2(the longest segment) array operations.
+    :param starts: The start of the segment of each key.
+    :param ends: The end of the segment of each key.
+    :return: The position of each key in values[starts:ends] (its first position that is not smaller).
+    """
+    low = np.array(starts, dtype=np.int64)
+    high = np.array(ends, dtype=np.int64)
+    active = low < high
+    while active.any():
+        middle = (low + high) // 2
+        smaller = np.zeros(keys.shape, dtype=bool)
+        smaller[active] = values[middle[active]] < keys[active]
+        low[smaller] = middle[smaller] + 1
+        larger = active & ~smaller
+        high[larger] = middle[larger]
+        active = low < high
+    return low
+
+
+class BlocksCache(object):
+    """
+    A least-recently-used cache of candidates blocks - the (ids, values) arrays of the candidates
+    of a class or a subclass node - bounded by the total size of the cached arrays.
+    """
+
+    __slots__ = "max_bytes", "bytes", "hits", "misses", "_blocks"
+
+    def __init__(self, max_bytes: int):
+        """
+        :param max_bytes: The maximal total size (in bytes) of the cached blocks.
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+    def get(self, key):
+        """return the cached block of the key (and mark it as recently used), or None"""
+        block = self._blocks.get(key)
+        if block is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._blocks.move_to_end(key)
+        return block
+
+    def put(self, key, block: tuple):
+        """cache a block (of read-only arrays), dropping the least recently used blocks to make room for it"""
+        size = sum(arr.nbytes for arr in block)
+        if size > self.max_bytes:
+            return
+        for arr in block:
+            arr.setflags(write=False)
+        self._blocks[key] = block
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, dropped = self._blocks.popitem(last=False)
+            self.bytes -= sum(arr.nbytes for arr in dropped)
+
+    def info(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "blocks": len(self._blocks),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+def _layers_starts(lol_properties: dict):
+    """the first LOL ID of each layer of the graph - IDs, subclasses, genotypes and classes"""
+    arrays_start = int(lol_properties["arrays_start"])
+    return [
+        0,
+        len(lol_properties["map_number_to_num_node"]),
+        arrays_start,
+        arrays_start + len(lol_properties["map_number_to_arr_node"]),
+    ]
 
 
 class Graph(object):
     """Graph wrapper class for LOLGraph"""
 
-    __slots__ = "_map_node_to_number", "_graph"
+    __slots__ = (
+        "_map_node_to_number",
+        "_graph",
+        "_geno_to_int",
+        "_donors_summary",
+        "_blocks_cache",
+        "_layers_starts",
+        "_weight_bounds",
+        "_subclasses_genotypes",
+        "_genotypes",
+        "_alleles_postings",
+        "_postings_counts",
+    )
 
-    def __init__(self, lol_properties: dict):
+    def __init__(
+        self,
+        lol_properties: dict,
+        compact_index: bool = False,
+        cache_bytes: int = 0,
+    ):
+        """
+        :param lol_properties: The LOL dict-representation of the graph.
+        :param compact_index: A boolean flag for whether to replace the {node: LOL ID} dict
+        with a `NodeIndex` of sorted arrays, which takes a fraction of the memory. default is False.
+        :param cache_bytes: The size (in bytes) of a cache of the candidates of the classes and subclasses
+        that were searched lately (see `set_blocks_cache`). default is 0 (no cache).
+        """
         self._map_node_to_number = lol_properties["map_node_to_number"]
+        if compact_index and not isinstance(self._map_node_to_number, NodeIndex):
+            self._map_node_to_number = NodeIndex.from_map(
+                self._map_node_to_number, _layers_starts(lol_properties)
+            )
+
+        # graphs that were built with quantize_weights have uint16 fixed-point weights
+        weights_list = lol_properties["weights_list"]
+        quantized_weights_list = None
+        if np.asarray(weights_list).dtype == np.uint16:
+            weights_list, quantized_weights_list = np.zeros(0, np.float32), weights_list
 
         self._graph = LolGraph(
             index_list=lol_properties["index_list"],
             neighbors_list=lol_properties["neighbors_list"],
-            weights_list=lol_properties["weights_list"],
+            weights_list=weights_list,
+            quantized_weights_list=quantized_weights_list,
             map_number_to_num_node=lol_properties["map_number_to_num_node"],
             map_number_to_arr_node=lol_properties["map_number_to_arr_node"],
             arrays_start=lol_properties["arrays_start"],
@@ -31,6 +381,67 @@ class Graph(object):
             weighted=lol_properties["weighted"],
         )
 
+        # graphs that were built before the packed encoding use the decimal encoding
+        self._geno_to_int = KEY_ENCODINGS[lol_properties.get("key_encoding", "decimal")]
+
+        # precomputed per-donor arrays, if the graph was built with them
+        self._donors_summary = None
+        if all(name in lol_properties for name in DONORS_SUMMARY_ARRAYS):
+            self._donors_summary = {
+                name: lol_properties[name] for name in DONORS_SUMMARY_ARRAYS
+            }
+
+        # precomputed genotypes of each subclass, if the graph was built with them
+        self._subclasses_genotypes = None
+        if all(name in lol_properties for name in SUBCLASSES_GENOTYPES_ARRAYS):
+            self._subclasses_genotypes = (
+                lol_properties["subclasses_genotypes_index"],
+                lol_properties["subclasses_genotypes"],
+                lol_properties["map_number_to_arr_node"],
+            )
+
+        # the alleles' inverted index of the genotypes, computed on the first use if the graph has none
+        self._genotypes = lol_properties["map_number_to_arr_node"]
+        self._alleles_postings = None
+        if all(name in lol_properties for name in ALLELES_POSTINGS_ARRAYS):
+            self._alleles_postings = (
+                lol_properties["alleles_postings_index"],
+                lol_properties["alleles_postings"],
+            )
+        self._postings_counts: np.ndarray | None = None  # see `alleles_candidates`
+
+        self._blocks_cache: BlocksCache | None = None
+        self.set_blocks_cache(cache_bytes)
+
+        # the first LOL ID of each layer, and the number of nodes
+        self._layers_starts = _layers_starts(lol_properties) + [
+            len(lol_properties["index_list"]) - 1
+        ]
+        self._weight_bounds: np.ndarray | None = None  # see `weight_bounds`
+
+    def set_blocks_cache(self, max_bytes: int):
+        """
+        Cache the candidates blocks of the classes and subclasses (`class_neighbors` and `neighbors_2nd`),
+        so repeated searches of popular classes do not gather them again from the graph.
+        The cache keeps the most recently used blocks, up to a total size of max_bytes.
+        A max_bytes of 0 disables the cache. The cached arrays are read-only.
+        """
+        self._blocks_cache = BlocksCache(max_bytes) if max_bytes > 0 else None
+
+    def blocks_cache_info(self) -> dict | None:
+        """return the hits, misses and size of the blocks cache (None if there is no cache)"""
+        return self._blocks_cache.info() if self._blocks_cache is not None else None
+
+    def geno_to_int(self, geno) -> int:
+        """convert a genotype, class or subclass to its integer node in the graph"""
+        return self._geno_to_int(geno)
+
+    def genos_to_ints(self, genos: np.ndarray) -> list[int]:
+        """convert an (N, k) array of genotypes, classes or subclasses to their integer nodes in the graph"""
+        if self._geno_to_int is KEY_ENCODINGS["packed"]:
+            return words_to_ints(pack_genos(genos))
+        return [self._geno_to_int(geno) for geno in genos.tolist()]
+
     def in_nodes(self, node: NODES_TYPES) -> bool:
         """return True if the given node is in the graph and false otherwise"""
         return node in self._map_node_to_number
@@ -39,6 +450,14 @@ class Graph(object):
         """return True if the given node is in the graph and false otherwise"""
         return self._map_node_to_number.get(node, None)
 
+    def get_node_ids(self, nodes: Iterable[int]) -> np.ndarray:
+        """return an array of the LOL IDs of the given nodes, with -1 for nodes that are not in the graph"""
+        if isinstance(self._map_node_to_number, NodeIndex):
+            return self._map_node_to_number.get_node_ids(nodes)
+        return np.fromiter(
+            (self._map_node_to_number.get(node, -1) for node in nodes), dtype=np.int64
+        )
+
     def get_edge_data(
         self,
         node1: NODES_TYPES,
@@ -58,12 +477,18 @@ class Graph(object):
 
     def class_neighbors(self, node: NODES_TYPES | int, search_lol_id: bool = False):
         node_num = self._map_node_to_number[node] if not search_lol_id else node
-        neighbors_list = self._graph.neighbors_unweighted(node_num)
+        if self._blocks_cache is not None:
+            block = self._blocks_cache.get((0, node_num))
+            if block is not None:
+                return block
 
-        neighbors_list_values = np.ndarray([len(neighbors_list), 10], dtype=np.uint16)
-        for i, neighbor in enumerate(neighbors_list):
-            neighbors_list_values[i, :] = self._graph.arr_node_value_from_id(neighbor)
+        neighbors_list = self._graph.neighbors_unweighted_view(node_num)
+        neighbors_list_values = self._graph.arr_nodes_values_from_ids(neighbors_list)
 
+        if self._blocks_cache is not None:
+            self._blocks_cache.put(
+                (0, node_num), (neighbors_list, neighbors_list_values)
+            )
         return neighbors_list, neighbors_list_values
 
     def neighbors_unweighted(
@@ -76,7 +501,7 @@ class Graph(object):
         :return: tuple of lists: (neighbor's IDs, neighbor's values, weights)
         """
         node_num = self._map_node_to_number[node] if not search_lol_id else node
-        neighbors_list = self._graph.neighbors_unweighted(node_num)
+        neighbors_list = self._graph.neighbors_unweighted_view(node_num)
 
         neighbors_list_values = [0] * len(neighbors_list)
         for i, neighbor in enumerate(neighbors_list):
@@ -95,9 +520,9 @@ class Graph(object):
         """
         node_num = self._map_node_to_number[node] if not search_lol_id else node
         if self._graph.is_weighted():
-            neighbors_list, weights_list = self._graph.neighbors_weighted(node_num)
+            neighbors_list, weights_list = self._graph.neighbors_weighted_view(node_num)
         else:
-            neighbors_list = self._graph.neighbors_unweighted(node_num)
+            neighbors_list = self._graph.neighbors_unweighted_view(node_num)
 
         neighbors_list_values = [0] * len(neighbors_list)
         for i, neighbor in enumerate(neighbors_list):
@@ -109,8 +534,137 @@ class Graph(object):
 
     def neighbors_2nd(self, node):
         node_num = self._map_node_to_number[node]
-        r0, r1 = self._graph.neighbors_2nd(node_num)
-        return r0[:-1], r1
+        if self._blocks_cache is not None:
+            block = self._blocks_cache.get((1, node_num))
+            if block is not None:
+                return block
+
+        if self._subclasses_genotypes is not None:
+            block = self._subclass_genotypes(node_num)
+        else:
+            block = self._graph.neighbors_2nd(node_num)
+        if self._blocks_cache is not None:
+            self._blocks_cache.put((1, node_num), block)
+        return block
+
+    def _subclass_genotypes(self, node_num: int) -> tuple[np.ndarray, np.ndarray]:
+        """the second degree neighbors of a subclass, from the precomputed genotypes of the subclasses"""
+        index, genotypes, map_number_to_arr_node = self._subclasses_genotypes
+        subclass = node_num - self._layers_starts[1]
+        genotypes_ids = genotypes[index[subclass] : index[subclass + 1]]
+        return (
+            genotypes_ids,
+            map_number_to_arr_node[genotypes_ids - self._layers_starts[2]],
+        )
+
+    def alleles_candidates(
+        self, genotype: np.ndarray, min_matches: int = 7
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the genotypes with at least min_matches matching alleles to a genotype,
+        with the alleles' inverted index (computed on the first call if the graph was built without it).
+        :param genotype: A genotype - 10 alleles, sorted in each locus.
+        :param min_matches: The minimal number of matching alleles.
+        :return: The LOL IDs of the genotypes (sorted) and the number of matching alleles of each.
+        """
+        if self._alleles_postings is None:
+            postings = compute_alleles_postings(
+                {"map_number_to_arr_node": self._genotypes}
+            )
+            self._alleles_postings = (
+                postings["alleles_postings_index"],
+                postings["alleles_postings"],
+            )
+        if self._postings_counts is None:
+            self._postings_counts = np.zeros(len(self._genotypes), dtype=np.uint8)
+
+        index, postings = self._alleles_postings
+        genotypes, matches = count_postings(
+            index,
+            postings,
+            alleles_keys(np.asarray(genotype).reshape(1, 10))[0],
+            self._postings_counts,
+            min_matches,
+        )
+        return genotypes + self._layers_starts[2], matches
+
+    def genotype_donor_weights(
+        self, geno_ids: Sequence[int] | np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the donors of many genotypes and their weights in one call.
+        :param geno_ids: The LOL IDs of the genotypes.
+        :return: (offsets, donors_ids, weights) - the donors (LOL IDs) of geno_ids[i] and their weights
+        are donors_ids[offsets[i]:offsets[i + 1]] and weights[offsets[i]:offsets[i + 1]].
+        """
+        return self._graph.genotype_donor_weights(np.asarray(geno_ids, dtype=np.uint32))
+
+    def donors(self) -> np.ndarray:
+        """return the IDs of all the donors, ordered by their LOL IDs"""
+        return self._graph.num_nodes_values()
+
+    def donors_from_ids(self, donors_ids: np.ndarray) -> np.ndarray:
+        """convert an array of donors' LOL IDs to the donors' IDs"""
+        return self._graph.num_nodes_values_from_ids(donors_ids)
+
+    def weight_bounds(self, nodes_ids: np.ndarray) -> np.ndarray:
+        """
+        Get an upper bound of the total weight that a donor can get from the candidates of each node,
+        which bounds the score of a donor from the node's candidates (a patient's genotype probability times it).
+        - genotype: the maximal weight of its donors.
+        - class: the sum of the bounds of its genotypes.
+        - subclass: the sum of the bounds of its classes.
+        The bounds are computed once, on the first call.
+        :param nodes_ids: The LOL IDs of the nodes (-1 for missing nodes, which get 0).
+        """
+        _, subclasses_start, genos_start, classes_start, end = self._layers_starts
+        if self._weight_bounds is None:
+            genos = self._graph.max_weights(genos_start, classes_start)
+            classes = self._graph.neighbors_sums(classes_start, end, genos, genos_start)
+            subclasses = self._graph.neighbors_sums(
+                subclasses_start, genos_start, classes, classes_start
+            )
+            self._weight_bounds = np.concatenate([subclasses, genos, classes])
+
+        nodes_ids = np.asarray(nodes_ids, dtype=np.int64)
+        in_graph = nodes_ids >= subclasses_start
+        bounds = np.zeros(len(nodes_ids), dtype=np.float64)
+        bounds[in_graph] = self._weight_bounds[nodes_ids[in_graph] - subclasses_start]
+        return bounds
+
+    def has_donors_summary(self) -> bool:
+        """return True if the graph has the precomputed donors' summary (see `compute_donors_summary`)"""
+        return self._donors_summary is not None
+
+    def donors_most_common_genotypes(self, donors_ids: np.ndarray) -> np.ndarray:
+        """return an (N, 10) array of the most probable genotype of each donor (by LOL ID)"""
+        return self._donors_summary["donors_most_common"][donors_ids]
+
+    def donors_alleles_probabilities(
+        self, donors_ids: np.ndarray, alleles: np.ndarray
+    ) -> np.ndarray:
+        """
+        Get the probability that each donor has each of the given alleles.
+        :param donors_ids: N donors' LOL IDs.
+        :param alleles: An (N, k) array of alleles to check for each donor.
+        :return: An (N, k) float32 array - the sum of the probabilities of the donor's genotypes
+        that contain the allele (0 if none does).
+        """
+        index = self._donors_summary["donors_alleles_index"]
+        donors_alleles = self._donors_summary["donors_alleles"]
+        alleles_probs = self._donors_summary["donors_alleles_probs"]
+
+        alleles = np.asarray(alleles)
+        donors_ids = np.asarray(donors_ids, dtype=np.int64).reshape(-1, 1)
+        starts = np.broadcast_to(index[donors_ids], alleles.shape)
+        ends = np.broadcast_to(index[donors_ids + 1], alleles.shape)
+        positions = _search_segments(donors_alleles, starts, ends, alleles)
+
+        probabilities = np.zeros(alleles.shape, dtype=np.float32)
+        found = positions < ends
+        found[found] = donors_alleles[positions[found]] == alleles[found]
+        probabilities[found] = alleles_probs[positions[found]]
+        return probabilities
 
     def node_value_from_id(self, node_id: int) -> NODES_TYPES:
         """convert lol ID to node value"""
@@ -119,6 +673,288 @@ class Graph(object):
         return self._graph.arr_node_value_from_id(node_id)
 
     @classmethod
-    def from_pickle(cls, path: Union[str, PathLike]):
+    def from_pickle(cls, path: Union[str, PathLike], compact_index: bool = False):
         graph_dict = pickle.load(open(path, "rb"))
+        return cls(graph_dict, compact_index=compact_index)
+
+    @classmethod
+    def from_directory(cls, path: Union[str, PathLike], mmap: bool = True):
+        """
+        Load a graph saved with `save_lol_directory`.
+        :param path: A path to the graph's directory.
+        :param mmap: A boolean flag for whether to memory-map the arrays (read-only) instead of reading them.
+        Memory-mapped graphs load instantly, and processes that load the same graph share its memory.
+        """
+        graph_dict = load_lol_directory(path, mmap=mmap)
         return cls(graph_dict)
+
+
+class MergedGraph(object):
+    """
+    A donors' graph of a base graph and a delta segment (a small graph of added and updated donors),
+    merged at query time (see `UpdateMatchingGraph`). It has the methods of `Graph` that the matching uses.
+    - The nodes of the base graph keep their LOL IDs, and the nodes that are only in the delta segment
+    get their LOL ID in the delta segment plus the number of nodes in the base graph.
+    - The base donors keep their LOL IDs, and the delta donors get their LOL ID in the delta segment
+    plus the number of donors in the base graph.
+    - A genotype, class or subclass in both segments is one node, with the donors of both segments.
+    - The removed donors of the base graph (tombstones) are filtered out of the genotypes' donors.
+    """
+
+    __slots__ = (
+        "_base",
+        "_delta",
+        "_removed",
+        "_nodes_end",
+        "_donors_end",
+        "_delta_nodes",
+        "_shared",
+    )
+
+    def __init__(
+        self,
+        base_properties: dict,
+        delta_properties: dict,
+        removed_donors: Iterable[int] = (),
+    ):
+        """
+        :param base_properties: The LOL dict-representation of the base graph.
+        :param delta_properties: The LOL dict-representation of the delta segment.
+        Its weights and optional arrays should be like the base graph's.
+        :param removed_donors: The IDs of the base graph's donors that were removed or updated.
+        """
+        if base_properties.get("key_encoding", "decimal") != delta_properties.get(
+            "key_encoding", "decimal"
+        ):
+            raise ValueError(
+                "The base graph and the delta segment must have the same key encoding"
+            )
+
+        self._base = Graph(base_properties)
+        self._delta = Graph(delta_properties)
+        self._nodes_end = len(base_properties["index_list"]) - 1
+        self._donors_end = len(base_properties["map_number_to_num_node"])
+
+        removed = self._base.get_node_ids(list(removed_donors))
+        self._removed = np.unique(removed[removed >= 0])
+
+        # the merged LOL ID of each node of the delta segment (-1 for the donors),
+        # and the base and the delta LOL IDs of the nodes that are in both segments (sorted by the base ID)
+        delta_donors_end = len(delta_properties["map_number_to_num_node"])
+        nodes, delta_ids = [], []
+        for node, number in delta_properties["map_node_to_number"].items():
+            if number >= delta_donors_end:
+                nodes.append(node)
+                delta_ids.append(number)
+        delta_ids = np.array(delta_ids, dtype=np.int64)
+        base_ids = self._base.get_node_ids(nodes)
+        self._delta_nodes = np.full(
+            len(delta_properties["index_list"]) - 1, -1, dtype=np.int64
+        )
+        self._delta_nodes[delta_ids] = np.where(
+            base_ids >= 0, base_ids, delta_ids + self._nodes_end
+        )
+        shared = np.flatnonzero(base_ids >= 0)
+        order = np.argsort(base_ids[shared])
+        self._shared = (base_ids[shared][order], delta_ids[shared][order])
+
+    def _delta_ids(self, nodes_ids: np.ndarray) -> np.ndarray:
+        """the LOL IDs in the delta segment of merged LOL IDs (-1 for nodes that are not in the delta segment)"""
+        nodes_ids = np.asarray(nodes_ids, dtype=np.int64)
+        delta_ids = np.where(
+            nodes_ids >= self._nodes_end, nodes_ids - self._nodes_end, -1
+        )
+        shared_base, shared_delta = self._shared
+        if len(shared_base):
+            positions = np.minimum(
+                np.searchsorted(shared_base, nodes_ids), len(shared_base) - 1
+            )
+            shared = shared_base[positions] == nodes_ids
+            delta_ids[shared] = shared_delta[positions[shared]]
+        return delta_ids
+
+    def _merged_block(
+        self, base_block: tuple | None, delta_block: tuple | None
+    ) -> tuple:
+        """
+        Merge the blocks (LOL IDs, and values or counts) of a node from both segments.
+        The genotypes that are also in the base graph are dropped from the delta block,
+        since they are in the base block already.
+        """
+        if delta_block is None:
+            return base_block
+        ids = self._delta_nodes[np.asarray(delta_block[0], dtype=np.int64)]
+        only_delta = ids >= self._nodes_end
+        delta_block = (ids[only_delta].astype(np.uint32), delta_block[1][only_delta])
+        if base_block is None:
+            return delta_block
+        return tuple(
+            np.concatenate([base, delta])
+            for base, delta in zip(base_block, delta_block)
+        )
+
+    def geno_to_int(self, geno) -> int:
+        """convert a genotype, class or subclass to its integer node in the graph"""
+        return self._base.geno_to_int(geno)
+
+    def genos_to_ints(self, genos: np.ndarray) -> list[int]:
+        """convert an (N, k) array of genotypes, classes or subclasses to their integer nodes in the graph"""
+        return self._base.genos_to_ints(genos)
+
+    def in_nodes(self, node: NODES_TYPES) -> bool:
+        """return True if the given node is in the graph and false otherwise"""
+        return self._base.in_nodes(node) or self._delta.in_nodes(node)
+
+    def get_node_id(self, node: NODES_TYPES) -> int | None:
+        """return the merged LOL ID of a node (None if it is not in the graph)"""
+        node_id = self._base.get_node_id(node)
+        if node_id is None:
+            node_id = self._delta.get_node_id(node)
+            if node_id is not None:
+                node_id = int(self._delta_nodes[node_id])
+        return node_id
+
+    def get_node_ids(self, nodes: Iterable[int]) -> np.ndarray:
+        """return an array of the merged LOL IDs of the given nodes, with -1 for nodes that are not in the graph"""
+        nodes = list(nodes)
+        nodes_ids = self._base.get_node_ids(nodes)
+        missing = np.flatnonzero(nodes_ids < 0)
+        if len(missing):
+            delta_ids = self._delta.get_node_ids([nodes[i] for i in missing])
+            nodes_ids[missing] = np.where(
+                delta_ids >= 0, delta_ids + self._nodes_end, -1
+            )
+        return nodes_ids
+
+    def class_neighbors(self, node: NODES_TYPES):
+        """return the genotypes (merged LOL IDs and values) of a class"""
+        return self._merged_block(
+            self._base.class_neighbors(node) if self._base.in_nodes(node) else None,
+            self._delta.class_neighbors(node) if self._delta.in_nodes(node) else None,
+        )
+
+    def neighbors_2nd(self, node: NODES_TYPES):
+        """return the genotypes (merged LOL IDs and values) of a subclass"""
+        return self._merged_block(
+            self._base.neighbors_2nd(node) if self._base.in_nodes(node) else None,
+            self._delta.neighbors_2nd(node) if self._delta.in_nodes(node) else None,
+        )
+
+    def neighbors(self, node: NODES_TYPES) -> zip[tuple[int, float]] | list[int]:
+        """
+        Get a donor's genotypes and their weights
+        (from the delta segment for the added and the updated donors).
+        """
+        if self._delta.in_nodes(node):
+            return self._delta.neighbors(node)
+        return self._base.neighbors(node)
+
+    def alleles_candidates(
+        self, genotype: np.ndarray, min_matches: int = 7
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the genotypes with at least min_matches matching alleles to a genotype (see `Graph.alleles_candidates`).
+        :return: The merged LOL IDs of the genotypes (sorted) and the number of matching alleles of each.
+        """
+        return self._merged_block(
+            self._base.alleles_candidates(genotype, min_matches),
+            self._delta.alleles_candidates(genotype, min_matches),
+        )
+
+    def genotype_donor_weights(
+        self, geno_ids: Sequence[int] | np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Get the donors of many genotypes and their weights in one call (see `Graph.genotype_donor_weights`).
+        The donors of a genotype are its base donors that were not removed, and then its delta donors.
+        :param geno_ids: The merged LOL IDs of the genotypes.
+        :return: (offsets, donors_ids, weights) with the merged LOL IDs of the donors.
+        """
+        geno_ids = np.asarray(geno_ids, dtype=np.int64)
+        in_base = np.flatnonzero(geno_ids < self._nodes_end)
+        delta_ids = self._delta_ids(geno_ids)
+        in_delta = np.flatnonzero(delta_ids >= 0)
+
+        base_offsets, base_donors, base_weights = self._base.genotype_donor_weights(
+            geno_ids[in_base]
+        )
+        base_owners = np.repeat(in_base, np.diff(base_offsets))
+        kept = ~np.isin(base_donors, self._removed)
+        delta_offsets, delta_donors, delta_weights = self._delta.genotype_donor_weights(
+            delta_ids[in_delta]
+        )
+
+        owners = np.concatenate(
+            [base_owners[kept], np.repeat(in_delta, np.diff(delta_offsets))]
+        )
+        order = np.argsort(owners, kind="stable")
+        donors_ids = np.concatenate(
+            [
+                base_donors[kept].astype(np.int64),
+                delta_donors.astype(np.int64) + self._donors_end,
+            ]
+        )[order]
+        weights = np.concatenate([base_weights[kept], delta_weights])[order]
+        offsets = np.zeros(len(geno_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(owners, minlength=len(geno_ids)), out=offsets[1:])
+        return offsets, donors_ids.astype(np.uint32), weights
+
+    def weight_bounds(self, nodes_ids: np.ndarray) -> np.ndarray:
+        """
+        Get an upper bound of the total weight that a donor can get from the candidates of each node
+        (see `Graph.weight_bounds`) - the sum of the node's bounds in both segments.
+        :param nodes_ids: The merged LOL IDs of the nodes (-1 for missing nodes, which get 0).
+        """
+        nodes_ids = np.asarray(nodes_ids, dtype=np.int64)
+        bounds = np.zeros(len(nodes_ids), dtype=np.float64)
+        in_base = nodes_ids < self._nodes_end
+        bounds[in_base] = self._base.weight_bounds(nodes_ids[in_base])
+        delta_ids = self._delta_ids(nodes_ids)
+        in_delta = delta_ids >= 0
+        bounds[in_delta] += self._delta.weight_bounds(delta_ids[in_delta])
+        return bounds
+
+    def _donors_segments(self, method, donors_ids: np.ndarray, *arrays) -> np.ndarray:
+        """call a method of both segments' graphs with their donors (and rows of arrays), and merge the results"""
+        donors_ids = np.asarray(donors_ids, dtype=np.int64)
+        in_base = donors_ids < self._donors_end
+        base = method(
+            self._base,
+            donors_ids[in_base],
+            *(np.asarray(array)[in_base] for array in arrays),
+        )
+        delta = method(
+            self._delta,
+            donors_ids[~in_base] - self._donors_end,
+            *(np.asarray(array)[~in_base] for array in arrays),
+        )
+        merged = np.empty(
+            (len(donors_ids),) + base.shape[1:], dtype=np.result_type(base, delta)
+        )
+        merged[in_base] = base
+        merged[~in_base] = delta
+        return merged
+
+    def donors(self) -> np.ndarray:
+        """return the IDs of all the donors, ordered by their merged LOL IDs (the removed donors included)"""
+        return np.concatenate([self._base.donors(), self._delta.donors()])
+
+    def donors_from_ids(self, donors_ids: np.ndarray) -> np.ndarray:
+        """convert an array of donors' merged LOL IDs to the donors' IDs"""
+        return self._donors_segments(Graph.donors_from_ids, donors_ids)
+
+    def has_donors_summary(self) -> bool:
+        """return True if both segments have the precomputed donors' summary (see `compute_donors_summary`)"""
+        return self._base.has_donors_summary() and self._delta.has_donors_summary()
+
+    def donors_most_common_genotypes(self, donors_ids: np.ndarray) -> np.ndarray:
+        """return an (N, 10) array of the most probable genotype of each donor (by merged LOL ID)"""
+        return self._donors_segments(Graph.donors_most_common_genotypes, donors_ids)
+
+    def donors_alleles_probabilities(
+        self, donors_ids: np.ndarray, alleles: np.ndarray
+    ) -> np.ndarray:
+        """get the probability that each donor has each of the given alleles (see `Graph.donors_alleles_probabilities`)"""
+        return self._donors_segments(
+            Graph.donors_alleles_probabilities, donors_ids, alleles
+        )
@@ -10,27 +10,40 @@ ctypedef np.uint32_t UINT
 ctypedef np.uint16_t UINT16
 ctypedef np.float32_t FLOAT
 
+# the scale of uint16 fixed-point (quantized) weights, see `grma.utilities.utils.quantize_weights`
+cdef FLOAT WEIGHTS_QUANTIZATION_SCALE = 65535
+
 cdef class LolGraph:
     cdef:
-        UINT[:] _index_list
-        UINT[:] _neighbors_list
-        FLOAT[:] _weights_list
-        UINT[:] _map_number_to_num_node
-        UINT16[:, :] _map_number_to_arr_node
+        const UINT[:] _index_list
+        const UINT[:] _neighbors_list
+        const FLOAT[:] _weights_list
+        const UINT16[:] _quantized_weights_list
+        const UINT[:] _map_number_to_num_node
+        const UINT16[:, :] _map_number_to_arr_node
         UINT _arrays_start
         bint directed
         bint weighted
+        bint quantized
 
-    def __init__(self, UINT[:] index_list,
-                 UINT[:] neighbors_list,
-                 FLOAT[:] weights_list,
-                 UINT[:] map_number_to_num_node,
-                 UINT16[:, :] map_number_to_arr_node,
+    def __init__(self, const UINT[:] index_list,
+                 const UINT[:] neighbors_list,
+                 const FLOAT[:] weights_list,
+                 const UINT[:] map_number_to_num_node,
+                 const UINT16[:, :] map_number_to_arr_node,
                  UINT arrays_start,
-                 bint directed, bint weighted):
+                 bint directed, bint weighted,
+                 const UINT16[:] quantized_weights_list=None):
+        """
+        The weights are given as float32 weights_list,
+        or as uint16 fixed-point quantized_weights_list (and then weights_list is ignored).
+        """
         self._index_list = index_list
         self._neighbors_list = neighbors_list
         self._weights_list = weights_list
+        self.quantized = quantized_weights_list is not None
+        if self.quantized:
+            self._quantized_weights_list = quantized_weights_list
         self._map_number_to_num_node = map_number_to_num_node
         self._map_number_to_arr_node = map_number_to_arr_node
         self._arrays_start = arrays_start
@@ -47,9 +60,27 @@ cdef class LolGraph:
     cpdef bint is_weighted(self):
         return self.weighted
 
+    cpdef bint is_quantized(self):
+        return self.quantized
+
     @cython.boundscheck(False)
     @cython.wraparound(False)
-    cpdef UINT16[:] arr_node_value_from_id(self, UINT node_id):
+    cdef inline FLOAT weight(self, Py_ssize_t idx) noexcept nogil:
+        """the weight of the edge at idx of the neighbors list"""
+        if self.quantized:
+            return <FLOAT>self._quantized_weights_list[idx] / WEIGHTS_QUANTIZATION_SCALE
+        return self._weights_list[idx]
+
+    cdef np.ndarray weights_slice(self, Py_ssize_t start, Py_ssize_t end):
+        """the weights of the edges at start:end of the neighbors list (a read-only view for float32 weights)"""
+        if self.quantized:
+            return np.asarray(self._quantized_weights_list[start:end]).astype(np.float32) / np.float32(
+                WEIGHTS_QUANTIZATION_SCALE)
+        return np.asarray(self._weights_list[start:end])
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef const UINT16[:] arr_node_value_from_id(self, UINT node_id):
         return self._map_number_to_arr_node[node_id - self._arrays_start]
 
     @cython.boundscheck(False)
@@ -59,55 +90,140 @@ cdef class LolGraph:
 
     @cython.boundscheck(False)
     @cython.wraparound(False)
-    cdef INT binary_search(self, np.ndarray[UINT, ndim=1] arr, UINT x):
+    cdef INT binary_search(self, UINT start, UINT end, UINT x) nogil:
         """
         Iterative Binary Search Function
-        It returns index of x in given array arr if present,
+        It returns the index of x in the neighbors list between start and end (in place) if present,
         else returns -1
         """
 
-        cdef UINT low, high, mid
-        low = 0
-        high = len(arr) - 1
-        mid = 0
+        cdef long low, high, mid
+        low = start
+        high = <long>end - 1
 
         while low <= high:
             mid = (high + low) // 2
 
             # Check if x is present at mid
-            if arr[mid] < x:
+            if self._neighbors_list[mid] < x:
                 low = mid + 1
 
             # If x is greater, ignore left half
-            elif arr[mid] > x:
+            elif self._neighbors_list[mid] > x:
                 high = mid - 1
 
             # If x is smaller, ignore right half
             else:
-                return mid
+                return <INT>(mid - start)
 
         # If we reach here, then the element was not present
         return -1
 
     @cython.boundscheck(False)
     @cython.wraparound(False)
-    cpdef FLOAT get_edge_data(self, UINT node1, UINT node2) except -1:
+    cpdef FLOAT get_edge_data(self, UINT node1, UINT node2) except? -1:
         """return the weight between two edges"""
-        cdef UINT idx, idx_end, i
+        cdef UINT idx, idx_end
         cdef INT node2_index
-        cdef np.ndarray[UINT, ndim=1] node1_neighbors
         idx = self._index_list[node1]
         idx_end = self._index_list[node1 + 1]
 
-        node1_neighbors = np.zeros(idx_end - idx, dtype=np.uint32)
-        for i in range(idx, idx_end):
-            node1_neighbors[i - idx] = self._neighbors_list[i]
-
-        node2_index = self.binary_search(node1_neighbors, node2)
+        node2_index = self.binary_search(idx, idx_end, node2)
         if self.is_weighted() and node2_index != -1:
-            return self._weights_list[idx + node2_index]
+            return self.weight(idx + node2_index)
         return -1
 
+    cpdef np.ndarray neighbors_unweighted_view(self, UINT node):
+        """return the neighbors of a node as a read-only view of the neighbors list (no copy)"""
+        return np.asarray(self._neighbors_list[self._index_list[node]:self._index_list[node + 1]])
+
+    cpdef tuple neighbors_weighted_view(self, UINT node):
+        """return the neighbors and their weights as read-only views of the neighbors and weights lists (no copy)"""
+        cdef UINT idx, idx_end
+        idx = self._index_list[node]
+        idx_end = self._index_list[node + 1]
+        return np.asarray(self._neighbors_list[idx:idx_end]), self.weights_slice(idx, idx_end)
+
+    cpdef np.ndarray arr_nodes_values_from_ids(self, np.ndarray nodes_ids):
+        """return an (N, 10) array of the values of the given array nodes"""
+        return np.asarray(self._map_number_to_arr_node)[nodes_ids.astype(np.int64) - self._arrays_start]
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef np.ndarray max_weights(self, UINT start, UINT end):
+        """return the maximal weight of the edges of each node in start:end (0 for nodes without edges)"""
+        cdef np.ndarray[np.float64_t, ndim=1] ret = np.zeros(end - start, dtype=np.float64)
+        cdef np.float64_t[:] ret_view = ret
+        cdef UINT node
+        cdef long j
+        with nogil:
+            for node in range(start, end):
+                for j in range(self._index_list[node], self._index_list[node + 1]):
+                    if self.weight(j) > ret_view[node - start]:
+                        ret_view[node - start] = self.weight(j)
+        return ret
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef np.ndarray neighbors_sums(self, UINT start, UINT end, const double[:] values, UINT values_start):
+        """
+        return for each node in start:end the sum of values[neighbor - values_start] over its neighbors
+        (neighbors out of the values' range are not counted)
+        """
+        cdef np.ndarray[np.float64_t, ndim=1] ret = np.zeros(end - start, dtype=np.float64)
+        cdef np.float64_t[:] ret_view = ret
+        cdef UINT node, neighbor
+        cdef UINT values_end = values_start + <UINT>values.shape[0]
+        cdef long j
+        with nogil:
+            for node in range(start, end):
+                for j in range(self._index_list[node], self._index_list[node + 1]):
+                    neighbor = self._neighbors_list[j]
+                    if values_start <= neighbor < values_end:
+                        ret_view[node - start] += values[neighbor - values_start]
+        return ret
+
+    cpdef np.ndarray num_nodes_values(self):
+        """return the values of all the numeric (donors) nodes, ordered by their IDs"""
+        return np.asarray(self._map_number_to_num_node)
+
+    cpdef np.ndarray num_nodes_values_from_ids(self, np.ndarray nodes_ids):
+        """return an array of the values of the given numeric (donors) nodes"""
+        return np.asarray(self._map_number_to_num_node)[nodes_ids.astype(np.int64)]
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cpdef tuple genotype_donor_weights(self, const UINT[:] geno_ids):
+        """
+        return the neighbors (donors) and weights of many genotypes at once, read from the CSR.
+        the neighbors of geno_ids[i] are donors_ids[offsets[i]:offsets[i + 1]].
+        """
+        cdef Py_ssize_t i, num_of_genos = geno_ids.shape[0]
+        cdef long j, pointer, idx, idx_end
+        cdef np.ndarray[np.int64_t, ndim=1] offsets = np.zeros(num_of_genos + 1, dtype=np.int64)
+        cdef np.int64_t[:] offsets_view = offsets
+
+        for i in range(num_of_genos):
+            offsets_view[i + 1] = offsets_view[i] + \
+                self._index_list[geno_ids[i] + 1] - self._index_list[geno_ids[i]]
+
+        donors_ids = np.empty(offsets_view[num_of_genos], dtype=np.uint32)
+        weights = np.empty(offsets_view[num_of_genos], dtype=np.float32)
+        cdef UINT[:] donors_ids_view = donors_ids
+        cdef FLOAT[:] weights_view = weights
+
+        with nogil:
+            pointer = 0
+            for i in range(num_of_genos):
+                idx = self._index_list[geno_ids[i]]
+                idx_end = self._index_list[geno_ids[i] + 1]
+                for j in range(idx, idx_end):
+                    donors_ids_view[pointer] = self._neighbors_list[j]
+                    weights_view[pointer] = self.weight(j)
+                    pointer += 1
+
+        return offsets, donors_ids, weights
+
     # get neighbors of specific node n
     @cython.boundscheck(False)
     @cython.wraparound(False)
@@ -124,9 +240,7 @@ cdef class LolGraph:
         for i in range(idx, idx_end):
             neighbors_list_id[i - idx] = self._neighbors_list[i]
 
-        weights_list = np.zeros(idx_end - idx, dtype=np.float32)
-        for i in range(idx, idx_end):
-            weights_list[i - idx] = self._weights_list[i]
+        weights_list = self.weights_slice(idx, idx_end).copy()
 
         return neighbors_list_id, weights_list
 
@@ -149,27 +263,29 @@ cdef class LolGraph:
     @cython.boundscheck(False)
     @cython.wraparound(False)
     cpdef tuple neighbors_2nd(self, UINT node):
-        """return the second degree neighbors of a node - neighbors of neighbors."""
+        """
+        return the second degree neighbors of a node - neighbors of neighbors - and their values.
+        all of them are returned (the first versions dropped the last one).
+        """
         cdef UINT idx, idx_end, i, j, pointer, neighbor_1st, idx_1st_neigh, idx_end_1st_neigh, neighbor_id
-        cdef np.ndarray[UINT, ndim=1] neighbors_list_id, neighbors_id
-        cdef UINT16[:] arr
+        cdef np.ndarray[UINT, ndim=1] neighbors_id
         cdef np.ndarray[UINT16, ndim=2] neighbors_value
         cdef UINT num_of_neighbors_2nd
 
         idx = self._index_list[node]
         idx_end = self._index_list[node + 1]
 
-        neighbors_list_id = np.zeros(idx_end - idx, dtype=np.uint32)
+        # the number of the second degree neighbors is the sum of the neighbors' degrees
+        num_of_neighbors_2nd = 0
         for i in range(idx, idx_end):
-            neighbors_list_id[i - idx] = self._neighbors_list[i]
-
-        num_of_neighbors_2nd = <UINT>self._weights_list[idx]
+            neighbor_1st = self._neighbors_list[i]
+            num_of_neighbors_2nd += self._index_list[neighbor_1st + 1] - self._index_list[neighbor_1st]
 
         neighbors_id = np.zeros(int(num_of_neighbors_2nd), dtype=np.uint32)
         pointer = 0
 
-        for i in range(len(neighbors_list_id)):
-            neighbor_1st = neighbors_list_id[i]
+        for i in range(idx, idx_end):
+            neighbor_1st = self._neighbors_list[i]
             idx_1st_neigh = self._index_list[neighbor_1st]
             idx_end_1st_neigh = self._index_list[neighbor_1st + 1]
 
@@ -177,11 +293,10 @@ cdef class LolGraph:
                 neighbors_id[pointer] = self._neighbors_list[j]
                 pointer += 1
 
-        neighbors_value = np.zeros((num_of_neighbors_2nd - 1, 10), dtype=np.uint16)
-        for i in range(len(neighbors_id) - 1):
-            neighbor_id = neighbors_id[i]
-            arr = self.arr_node_value_from_id(neighbor_id)
+        neighbors_value = np.zeros((num_of_neighbors_2nd, 10), dtype=np.uint16)
+        for i in range(len(neighbors_id)):
+            neighbor_id = neighbors_id[i] - self._arrays_start
             for j in range(10):
-                neighbors_value[i, j] = arr[j]
+                neighbors_value[i, j] = self._map_number_to_arr_node[neighbor_id, j]
 
         return neighbors_id, neighbors_value
@@ -1,21 +1,29 @@
+import json
+import multiprocessing as mp
 import os
 import sys
 import time
-import json
+import warnings
 from os import PathLike
-from typing import Iterable, Union, Dict
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 
 import pandas as pd
 from grim import grim
 
 from grma.match import Graph as MatchingGraph
-from grma.match.donors_matching import DonorsMatching, _init_results_df
+from grma.match.donors_matching import DonorsMatching, _can_reach, _init_results
+from grma.match.matching_results import MatchingResults
 from grma.match.graph_wrapper import Graph
+from grma.utilities.cutils import set_num_threads
 from grma.utilities.utils import print_time, donor_mismatch_format
 
 GRIM_DEFAULT_OUTPUT_PATH = "./output/don.pmug"
 GRIM_RESULT_DIR_FIELD = "imuptation_out_path"
 GRIM_RESULT_GENO_FILE_FIELD = "imputation_out_umug_freq_filename"
+# the engines that generate the candidates with mismatches, see `search_in_levels`
+ENGINES = ("subclasses", "alleles")
+# the initial number of rows of a patient's results (the results grow by doubling)
+RESULTS_CAPACITY: int = 64
 
 
 def run_grim(config_file_path=""):
@@ -50,60 +58,168 @@ def run_grim(config_file_path=""):
 def search_in_levels(
     patient_id: int,
     g_m: DonorsMatching,
-    donors_info: Iterable,
+    results: MatchingResults,
     threshold: float,
     cutof: int,
     classes: Iterable,
     subclasses: Iterable,
+    engine: str = "subclasses",
 ):
     """ "
     This function gets the information about the patient and other settings, and search for donors in levels.
     First, it will search only for 10 matches donors (compare only genotypes). If there aren't enough donors,
-    the function will search for 9 matches donors (compare classes), and then 8-7 matches (subclasses)
+    the function will search for 9 matches donors (compare classes), and then 8-7 matches (subclasses).
+    With the "alleles" engine, all the 7-9 matches candidates are found at once with the alleles' inverted index
+    of the donors' graph, instead of the classes and the subclasses.
 
     :param patient_id: The id of the patient we want to search his/her matches.
     :param g_m: The patients graph with the info of the current patient (and maybe other patients).
-    :param donors_info: An iterable of fields from the database to include in the results. default is None.
+    :param results: The accumulator that the patient's matches are added to.
     :param threshold: Minimal score value for a valid match. default is 0.1.
     :param cutof: Maximum number of matches to return. default is 50.
     :param classes: An iterable with the all the possible classes of the patient.
     :param subclasses: An iterable with the all the possible subclasses of the patient.
-    :return: A pandas.DataFrame with the matches for this patient.
+    :param engine: The engine of the candidates with mismatches - "subclasses" or "alleles".
+    :return: The results accumulator, with the matches for this patient.
     """
 
     matched = set()  # set of donors ID that have already matched for this patient
-    results_df = _init_results_df(
-        donors_info
-    )  # initialize the df according to the given fields
 
     # We can give to this function the genotypes instead
     g_m.find_geno_candidates_by_genotypes(patient_id)
-    matched, count, results_df = g_m.score_matches(
-        0, results_df, donors_info, patient_id, threshold, cutof, matched
+    matched, count = g_m.score_matches(
+        0, results, patient_id, threshold, cutof, matched
     )
 
     if len(matched) >= cutof:
-        return results_df
-
-    g_m.find_geno_candidates_by_classes(classes)
-    matched, count, results_df = g_m.score_matches(
-        1, results_df, donors_info, patient_id, threshold, cutof, matched
+        return results
+
+    # skip the classes and subclasses if no donor with mismatches can reach the threshold
+    if threshold > 0 and not _can_reach(
+        g_m.subclasses_bound(patient_id, subclasses), threshold
+    ):
+        if g_m.verbose:
+            print_time("No donor with mismatches can reach the threshold")
+        return results
+
+    if engine == "alleles":
+        g_m.find_geno_candidates_by_alleles(patient_id)
+    else:
+        g_m.find_geno_candidates_by_classes(classes, patient_id)
+    matched, count = g_m.score_matches(
+        1, results, patient_id, threshold, cutof, matched
     )
 
     if len(matched) >= cutof:
-        return results_df
+        return results
 
-    g_m.find_geno_candidates_by_subclasses(subclasses)
+    if engine != "alleles":
+        g_m.find_geno_candidates_by_subclasses(subclasses, patient_id)
 
     # loop over possible mismatches: 2, 3.
     for mismatches in range(2, 4):
-        matched, count, results_df = g_m.score_matches(
-            mismatches, results_df, donors_info, patient_id, threshold, cutof, matched
+        matched, count = g_m.score_matches(
+            mismatches, results, patient_id, threshold, cutof, matched
         )
 
+    return results
+
+
+def _results_capacity(cutof: int) -> int:
+    """the initial number of rows of a patient's results (cutof may be infinite)"""
+    return int(min(cutof, RESULTS_CAPACITY))
+
+
+# the matching state of the worker processes, inherited from the parent process by fork
+_WORKER_STATE: tuple = ()
+
+
+def _search_patient(patient: int):
+    """search matches for a single patient in a worker process. returns the results' accumulator and the search time"""
+    (
+        g_m,
+        donors_info,
+        threshold,
+        cutof,
+        classes_by_patient,
+        subclasses_by_patient,
+        engine,
+    ) = _WORKER_STATE
+    if g_m.verbose:
+        print_time(f"Searching matches for {patient}")
+
+    start = time.time()
+    results = search_in_levels(
+        patient,
+        g_m,
+        _init_results(donors_info, _results_capacity(cutof)),
+        threshold,
+        cutof,
+        classes_by_patient[patient],
+        subclasses_by_patient[patient],
+        engine,
+    )
+    g_m.clear_candidates(patient)
+    return results, time.time() - start
+
+
+def _search_patients(
+    patients: list,
+    n_workers: int,
+    state: tuple,
+) -> Iterator[Tuple[MatchingResults, float]]:
+    """
+    Search matches for the patients, serially or in a pool of worker processes.
+    The workers are forked, so they share the donors' graph arrays with the parent (copy-on-write).
+    The results are yielded in the patients' order.
+    """
+    global _WORKER_STATE
+    _WORKER_STATE = state
+    try:
+        if n_workers <= 1 or len(patients) <= 1:
+            yield from map(_search_patient, patients)
+            return
+
+        if "fork" not in mp.get_all_start_methods():
+            warnings.warn("Parallel matching requires fork, searching serially.")
+            yield from map(_search_patient, patients)
+            return
+
+        chunksize = max(1, len(patients) // (4 * n_workers))
+        # a single kernel thread in each worker - the workers are the parallelism,
+        # and an OpenMP threads pool of the parent is not usable after fork
+        with mp.get_context("fork").Pool(
+            n_workers, initializer=set_num_threads, initargs=(1,)
+        ) as pool:
+            yield from pool.imap(_search_patient, patients, chunksize=chunksize)
+    finally:
+        _WORKER_STATE = ()
+
+
+def _check_engine(engine: str):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}.")
+
+
+def _patient_dataframe(
+    results: MatchingResults, g_m: DonorsMatching, patient: int
+) -> pd.DataFrame:
+    """create the results DataFrame of a patient, with the probability of its pruned genotypes (if pruned)"""
+    results_df = results.to_dataframe()
+    if patient in g_m.dropped_probabilities:
+        results_df.attrs["dropped_probability"] = g_m.dropped_probabilities[patient]
     return results_df
 
 
+def _print_dropped_probabilities(dropped_probabilities: Dict[int, float]):
+    pruned = [p for p in dropped_probabilities.values() if p > 0]
+    if pruned:
+        print_time(
+            f"Pruned the genotypes of {len(pruned)} patients, "
+            f"dropped probability: mean {sum(pruned) / len(pruned):.4f}, max {max(pruned):.4f}"
+        )
+
+
 def find_matches(
     imputation_filename: Union[str, PathLike],
     match_graph: Graph,
@@ -114,6 +230,12 @@ def find_matches(
     verbose: bool = False,
     save_to_csv: bool = False,
     calculate_time: bool = False,
+    n_workers: int = 1,
+    batch: bool = False,
+    combined: bool = False,
+    max_genotypes: int = 0,
+    genotypes_mass: float = 1.0,
+    engine: str = "subclasses",
 ):
     """
     The main function responsible for performing the matching.
@@ -132,8 +254,33 @@ def find_matches(
     If one wishes to save the results to csv files, a directory named 'Matching_Results_{searchId}' will be created in
     the working directory. If a directory by this name was already created, an error will be raised.
     Note: saving a pandas into a csv might take a couple of seconds
+    :param n_workers: The number of processes to search the patients in. default is 1 (no parallelism).
+    The workers are forked from the main process and share the donors' graph with it.
+    The results are the same as (and in the same order of) the serial search.
+    :param batch: A boolean flag for whether to scan each distinct class and subclass of the patients once,
+    for all the patients that hold it, before searching the patients. default is False.
+    It saves the repeated scans of the classes and subclasses that are shared by many patients,
+    but it scans all the subclasses, even of patients that have enough matches without them.
+    The results are the same as without it.
+    :param combined: A boolean flag for whether to return the results of all the patients as one pandas.DataFrame
+    (in the patients' order) instead of a DataFrame for each patient. default is False.
+    If calculate_time is True, a dictionary of the patients' matching times is returned with it.
+    :param max_genotypes: The maximal number of (most probable) genotypes of a patient to search with.
+    default is 0 (all of them).
+    :param genotypes_mass: Search with the most probable genotypes of a patient until their cumulative
+    probability reaches this mass. default is 1 (all of them).
+    When the genotypes are pruned, their probabilities are renormalized, and the dropped probability is reported
+    in the results' `attrs` - "dropped_probability" of each patient's DataFrame
+    (or "dropped_probabilities", a dictionary of all the patients, of the combined DataFrame).
+    :param engine: The engine that finds the candidates with mismatches (7-9 matches). default is "subclasses".
+    "subclasses" walks the classes and the subclasses of the patient's genotypes in the donors' graph.
+    "alleles" counts the hits of each of the patient's genotypes in an inverted index of the graph's genotypes
+    by their alleles (see `Graph.alleles_candidates`), which is built on the first search
+    if the graph was built without it. Both engines return the same results.
+    batch applies only to the "subclasses" engine.
     :return: A dictionary that maps each patient to its matching results formatted as a pandas.DataFrame
     """
+    _check_engine(engine)
     if save_to_csv:
         os.makedirs(f"Matching_Results_{search_id}", exist_ok=True)
 
@@ -145,46 +292,64 @@ def find_matches(
     # create patients graph and find all candidates
     start_build_graph = time.time()
     subclasses_by_patient, classes_by_patient = g_m.create_patients_graph(
-        imputation_filename
+        imputation_filename, max_genotypes, genotypes_mass
     )
     patients = list(g_m.patients.keys())
 
     if verbose:
         print_time("Created patients graph")
+        _print_dropped_probabilities(g_m.dropped_probabilities)
     end_build_graph = time.time()
 
+    if batch and engine == "subclasses":
+        # scan each distinct class and subclass once, for all the patients
+        g_m.scan_candidates(
+            dict.fromkeys(c for p in patients for c in classes_by_patient[p]),
+            dict.fromkeys(s for p in patients for s in subclasses_by_patient[p]),
+        )
+        if verbose:
+            print_time("Scanned the patients' classes and subclasses")
+
     # the returned dictionary. {patient ID: pd.DataFrame(matches + features)}
     patients_results = {patient: None for patient in patients}
+    # the results of all the patients, if combined
+    all_results = _init_results(donors_info)
 
     if patients:
         avg_build_time = (end_build_graph - start_build_graph) / len(patients)
     else:
         avg_build_time = 0
 
-    for patient in patients:
-        # For each patient we search matches in the donor graph.
-        # First we will look for perfect matches - only genotypes, then 9 matches - classes,
-        # and then 7-8 matches - subclasses.
-        if verbose:
-            print_time(f"Searching matches for {patient}")
-
-        start = time.time()
-
-        subclasses = subclasses_by_patient[patient]
-        classes = classes_by_patient[patient]
-        results_df = search_in_levels(
-            patient, g_m, donors_info, threshold, cutof, classes, subclasses
-        )
-
-        end = time.time()
-        patient_time = end - start + avg_build_time
-
-        if calculate_time:
-            patients_results[patient] = (results_df, patient_time)
+    # For each patient we search matches in the donor graph.
+    # First we will look for perfect matches - only genotypes, then 9 matches - classes,
+    # and then 7-8 matches - subclasses.
+    state = (
+        g_m,
+        donors_info,
+        threshold,
+        cutof,
+        classes_by_patient,
+        subclasses_by_patient,
+        engine,
+    )
+    for patient, (results, search_time) in zip(
+        patients, _search_patients(patients, n_workers, state)
+    ):
+        patient_time = search_time + avg_build_time
+
+        results_df = None
+        if combined:
+            all_results.extend(results)
+            patients_results[patient] = patient_time
         else:
-            patients_results[patient] = results_df
+            results_df = _patient_dataframe(results, g_m, patient)
+            patients_results[patient] = (
+                (results_df, patient_time) if calculate_time else results_df
+            )
 
         if save_to_csv:
+            if results_df is None:
+                results_df = results.to_dataframe()
             # save results to csv
             results_df.to_csv(
                 os.path.join(f"Matching_Results_{search_id}", f"Patient_{patient}.csv"),
@@ -197,9 +362,80 @@ def find_matches(
                     f"{os.path.join(f'Matching_Results_{search_id}', f'Patient_{patient}.csv')}"
                 )
 
+    g_m.clear_scanned_candidates()
+    if combined:
+        results_df = all_results.to_dataframe()
+        if max_genotypes or genotypes_mass < 1:
+            results_df.attrs["dropped_probabilities"] = g_m.dropped_probabilities
+        return (results_df, patients_results) if calculate_time else results_df
     return patients_results
 
 
+def _patients_blocks(lines: Iterable[str]) -> Iterator[List[str]]:
+    """group grimm's output lines by patient (index 0 marks a new patient). Blank lines are skipped."""
+    block = []
+    for line in lines:
+        if not line.strip():
+            continue
+        if block and int(line.rsplit(",", 1)[1]) == 0:
+            yield block
+            block = []
+        block.append(line)
+    if block:
+        yield block
+
+
+def iter_matches(
+    imputation_filename: Union[str, PathLike],
+    match_graph: Graph,
+    donors_info: Iterable[str] = [],
+    threshold: float = 0.1,
+    cutof: int = 50,
+    verbose: bool = False,
+    max_genotypes: int = 0,
+    genotypes_mass: float = 1.0,
+    engine: str = "subclasses",
+) -> Iterator[Tuple[int, pd.DataFrame]]:
+    """
+    A streaming version of `find_matches`.
+    The imputation file is read one patient at a time, and the state of each patient is dropped
+    once its results are yielded, so the memory does not grow with the number of patients.
+
+    :param imputation_filename: Path to the output file of the imputation made by grim.
+    :param match_graph: A Graph object from grma.match
+    :param donors_info: An iterable of fields from the database to include in the results. default is None.
+    :param threshold: Minimal score value for a valid match. default is 0.1.
+    :param cutof: Maximum number of matches to return. default is 50.
+    :param verbose: A boolean flag for whether to print the documentation. default is False
+    :param max_genotypes: The maximal number of genotypes of a patient to search with (see `find_matches`).
+    :param genotypes_mass: The probability mass of the genotypes of a patient to search with (see `find_matches`).
+    :param engine: The engine of the candidates with mismatches (see `find_matches`).
+    :return: A generator of (patient ID, matching results formatted as a pandas.DataFrame), in the file's order.
+    """
+    _check_engine(engine)
+    g_m = DonorsMatching(match_graph, verbose=verbose)
+
+    with open(imputation_filename) as lines:
+        for block in _patients_blocks(lines):
+            subclasses_by_patient, classes_by_patient = g_m.load_patients(
+                block, max_genotypes, genotypes_mass
+            )
+            for patient in g_m.patients:
+                if verbose:
+                    print_time(f"Searching matches for {patient}")
+                results = search_in_levels(
+                    patient,
+                    g_m,
+                    _init_results(donors_info, _results_capacity(cutof)),
+                    threshold,
+                    cutof,
+                    classes_by_patient[patient],
+                    subclasses_by_patient[patient],
+                    engine,
+                )
+                yield patient, _patient_dataframe(results, g_m, patient)
+
+
 def matching(
     match_graph: MatchingGraph,
     grim_config_file="",
@@ -210,6 +446,10 @@ def matching(
     cutof: int = 50,
     verbose: bool = False,
     save_to_csv: bool = False,
+    n_workers: int = 1,
+    max_genotypes: int = 0,
+    genotypes_mass: float = 1.0,
+    engine: str = "subclasses",
 ):
     """
     A function that performs the patients imputation with the matching.
@@ -231,6 +471,10 @@ def matching(
     If one wishes to save the results to csv files, a directory named 'Matching_Results_{searchId}' will be created in
     the working directory. If a directory by this name was already created, an error will be raised.
     Note: saving a pandas into a csv might take a couple of seconds
+    :param n_workers: The number of processes to search the patients in. default is 1 (no parallelism).
+    :param max_genotypes: The maximal number of genotypes of a patient to search with (see `find_matches`).
+    :param genotypes_mass: The probability mass of the genotypes of a patient to search with (see `find_matches`).
+    :param engine: The engine of the candidates with mismatches (see `find_matches`).
     :return: A dictionary that maps each patient to its matching results formatted as a pandas.DataFrame
     """
     if donors_info is None:
@@ -255,6 +499,10 @@ def matching(
         cutof,
         verbose,
         save_to_csv,
+        n_workers=n_workers,
+        max_genotypes=max_genotypes,
+        genotypes_mass=genotypes_mass,
+        engine=engine,
     )
 
     return all_matches
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+
+MATCH_PROBABILITY_FIELDS = (
+    "Match_Probability_A_1",
+    "Match_Probability_A_2",
+    "Match_Probability_B_1",
+    "Match_Probability_B_2",
+    "Match_Probability_C_1",
+    "Match_Probability_C_2",
+    "Match_Probability_DQB1_1",
+    "Match_Probability_DQB1_2",
+    "Match_Probability_DRB1_1",
+    "Match_Probability_DRB1_2",
+)
+MOST_COMMONS_FIELDS = (
+    "Match_Between_Most_Commons_A",
+    "Match_Between_Most_Commons_B",
+    "Match_Between_Most_Commons_C",
+    "Match_Between_Most_Commons_DQB",
+    "Match_Between_Most_Commons_DRB",
+)
+PERMISSIVE_FIELD = "Permissive/Non-Permissive"
+
+# {column: dtype}, in the order of the results' columns
+RESULTS_COLUMNS = {
+    "Patient_ID": np.int64,
+    "Donor_ID": np.int64,
+    "Number_Of_Mismatches": np.uint8,
+    "Matching_Probability": np.float64,
+    **{field: np.uint8 for field in MATCH_PROBABILITY_FIELDS},
+    PERMISSIVE_FIELD: object,
+    **{field: np.uint8 for field in MOST_COMMONS_FIELDS},
+}
+
+
+class MatchingResults(object):
+    """
+    A columnar accumulator of matching results.
+    The matches are written into preallocated typed NumPy columns (which grow by doubling),
+    and a pandas.DataFrame is created only once, at the end - as one DataFrame (`to_dataframe`)
+    or as an iterator of DataFrames of consecutive rows (`iter_batches`).
+    """
+
+    __slots__ = "_size", "_columns", "_donors_info", "_donors_info_dtypes"
+
+    def __init__(self, donors_info: Iterable[str] = (), capacity: int = 64):
+        """
+        :param donors_info: Fields from the donors' database that are added to the results.
+        :param capacity: The initial number of rows to allocate.
+        """
+        self._size: int = 0
+        self._donors_info = list(donors_info)
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.empty(capacity, dtype=dtype)
+            for name, dtype in RESULTS_COLUMNS.items()
+            if name != PERMISSIVE_FIELD
+        }
+        # the donors' fields are kept as objects, and converted to the dtypes of their values at the end
+        for field in self._donors_info:
+            self._columns[field] = np.empty(capacity, dtype=object)
+        self._donors_info_dtypes: Dict[str, object] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def donors_info(self) -> list:
+        return self._donors_info
+
+    def _reserve(self, count: int):
+        """make sure there is a place for `count` more rows"""
+        capacity = len(self._columns["Patient_ID"])
+        if self._size + count <= capacity:
+            return
+        capacity = max(2 * capacity, self._size + count)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[: self._size] = column[: self._size]
+            self._columns[name] = grown
+
+    def append(
+        self,
+        patient: int,
+        donors: Sequence[int],
+        mismatch: int,
+        probabilities: Sequence[float],
+        alleles_probabilities: np.ndarray,
+        most_commons_matches: np.ndarray,
+        donors_info: Dict[str, Sequence] | None = None,
+    ):
+        """
+        Add the matches of a patient with a number of mismatches.
+        :param patient: The patient's ID.
+        :param donors: N donors' IDs.
+        :param mismatch: The number of mismatches of the matches.
+        :param probabilities: The matching probability (in percents) of each donor.
+        :param alleles_probabilities: An (N, 10) array of the probability (in percents) of each patient's allele.
+        :param most_commons_matches: An (N, 5) array of the matches in each locus between the most common
+        genotypes of the patient and the donor.
+        :param donors_info: {field: N values} of the donors' database fields (arrays with a dtype).
+        """
+        count = len(donors)
+        if count == 0:
+            return
+        self._reserve(count)
+        rows = slice(self._size, self._size + count)
+        columns = self._columns
+
+        columns["Patient_ID"][rows] = patient
+        columns["Donor_ID"][rows] = donors
+        columns["Number_Of_Mismatches"][rows] = mismatch
+        columns["Matching_Probability"][rows] = probabilities
+        for i, field in enumerate(MATCH_PROBABILITY_FIELDS):
+            columns[field][rows] = alleles_probabilities[:, i]
+        for i, field in enumerate(MOST_COMMONS_FIELDS):
+            columns[field][rows] = most_commons_matches[:, i]
+        for field in self._donors_info:
+            values = donors_info[field]
+            self._donors_info_dtypes.setdefault(field, values.dtype)
+            columns[field][rows] = np.asarray(values, dtype=object)
+        self._size += count
+
+    def extend(self, other: MatchingResults):
+        """add the rows of another accumulator (with the same donors' fields)"""
+        count = len(other)
+        if count == 0:
+            return
+        self._reserve(count)
+        for name, column in self._columns.items():
+            column[self._size : self._size + count] = other._columns[name][:count]
+        for field, dtype in other._donors_info_dtypes.items():
+            self._donors_info_dtypes.setdefault(field, dtype)
+        self._size += count
+
+    def to_dataframe(self, start: int = 0, end: int | None = None) -> pd.DataFrame:
+        """create a DataFrame of the results (or of the rows start:end)"""
+        end = self._size if end is None else min(end, self._size)
+        start = min(start, end)
+        data = {}
+        for name in RESULTS_COLUMNS:
+            if name == PERMISSIVE_FIELD:
+                # TODO: add permissiveness algorithm
+                data[name] = np.full(end - start, "-", dtype=object)
+            else:
+                data[name] = self._columns[name][start:end]
+        for field in self._donors_info:
+            data[field] = pd.array(
+                self._columns[field][start:end],
+                dtype=self._donors_info_dtypes.get(field, object),
+            )
+        return pd.DataFrame(data, index=pd.RangeIndex(start, end))
+
+    def iter_batches(self, batch_size: int = 100_000) -> Iterator[pd.DataFrame]:
+        """yield the results as DataFrames of (at most) batch_size consecutive rows"""
+        for start in range(0, self._size, batch_size):
+            yield self.to_dataframe(start, start + batch_size)
@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from grma.utilities.geno_representation import HashableArray
+
+
+class PatientsIndex(object):
+    """
+    The patients' side of the matching, built of NumPy arrays.
+    It holds the patients' genotypes (with their probabilities and numbers in the imputation file),
+    the classes and subclasses of the genotypes, and the candidate genotypes of the donors' graph
+    that were found for each patient.
+    - patient -> genotypes: the genotypes of each patient, with their geno_num and probability.
+    - genotype -> patients: a CSR of the patients that have each genotype, with their geno_num and probability.
+    - class/subclass -> genotypes: a CSR of the patients' genotypes that hold each class/subclass.
+    - patient -> candidates: a buffer of (geno_candidate_id, geno_num, probability, similarity) chunks.
+    The index is filled with `add_genotype`, `add_patient`, `add_class` and `add_subclass`,
+    and then converted to arrays with `finalize`.
+    """
+
+    __slots__ = (
+        "_genotypes_ids",
+        "_genotypes",
+        "_patients_ids",
+        "_patients_genos",
+        "_classes_ids",
+        "_classes_num",
+        "_classes_genos",
+        "_subclasses_ids",
+        "_subclasses_genos",
+        "_geno_patients_index",
+        "_geno_patients",
+        "_geno_patients_nums",
+        "_geno_patients_probs",
+        "_classes_index",
+        "_classes_neighbors",
+        "_subclasses_index",
+        "_subclasses_neighbors",
+        "_candidates",
+    )
+
+    def __init__(self):
+        # build time structures
+        self._genotypes_ids: Dict[HashableArray, int] = {}
+        self._genotypes: List[np.ndarray] | np.ndarray = []
+        self._patients_ids: Dict[int, int] = {}
+        # {patient index: (genotypes indices, geno_nums, probabilities)}
+        self._patients_genos: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._classes_ids: Dict[int, int] = {}
+        self._classes_num: List[int] = []
+        self._classes_genos: List[Dict[int, None]] = []
+        self._subclasses_ids: Dict[int, int] = {}
+        self._subclasses_genos: List[Dict[int, None]] = []
+
+        # search time structures (CSR), created by `finalize`
+        self._geno_patients_index = np.zeros(1, dtype=np.int64)
+        self._geno_patients = np.zeros(0, dtype=np.int64)
+        self._geno_patients_nums = np.zeros(0, dtype=np.int64)
+        self._geno_patients_probs = np.zeros(0, dtype=np.float64)
+        self._classes_index = np.zeros(1, dtype=np.int64)
+        self._classes_neighbors = np.zeros(0, dtype=np.int64)
+        self._subclasses_index = np.zeros(1, dtype=np.int64)
+        self._subclasses_neighbors = np.zeros(0, dtype=np.int64)
+
+        # {patient index: [(candidates ids, geno_num, probability, similarities, reset)]}
+        self._candidates: List[list] = []
+
+    def __len__(self) -> int:
+        return len(self._patients_ids)
+
+    def add_genotype(self, genotype: HashableArray) -> int:
+        """add a patients' genotype (if it is new) and return its index"""
+        if genotype not in self._genotypes_ids:
+            self._genotypes_ids[genotype] = len(self._genotypes)
+            self._genotypes.append(genotype.np())
+        return self._genotypes_ids[genotype]
+
+    def add_patient(
+        self,
+        patient_id: int,
+        genos_idx: Sequence[int],
+        geno_nums: Sequence[int],
+        probabilities: Sequence[float],
+    ):
+        """
+        Add a patient and its genotypes.
+        :param patient_id: The patient's ID.
+        :param genos_idx: The indices of the patient's (distinct) genotypes, ordered by their first appearance.
+        :param geno_nums: The number of each genotype in the imputation file.
+        :param probabilities: The normalized probability of each genotype.
+        """
+        self._patients_ids[patient_id] = len(self._patients_genos)
+        self._patients_genos.append(
+            (
+                np.array(genos_idx, dtype=np.int64),
+                np.array(geno_nums, dtype=np.int64),
+                np.array(probabilities, dtype=np.float64),
+            )
+        )
+        self._candidates.append([])
+
+    def add_class(self, int_class: int, class_num: int, geno_idx: int):
+        """add a class (0 for class I, 1 for class II) of a patient's genotype"""
+        if int_class not in self._classes_ids:
+            self._classes_ids[int_class] = len(self._classes_genos)
+            self._classes_num.append(class_num)
+            self._classes_genos.append({})
+        class_idx = self._classes_ids[int_class]
+        self._classes_num[class_idx] = class_num
+        self._classes_genos[class_idx][geno_idx] = None
+
+    def add_subclass(self, subclass: int, geno_idx: int):
+        """add a subclass of a patient's genotype"""
+        if subclass not in self._subclasses_ids:
+            self._subclasses_ids[subclass] = len(self._subclasses_genos)
+            self._subclasses_genos.append({})
+        self._subclasses_genos[self._subclasses_ids[subclass]][geno_idx] = None
+
+    @staticmethod
+    def _to_csr(neighbors: List[Sequence[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        index = np.zeros(len(neighbors) + 1, dtype=np.int64)
+        np.cumsum([len(n) for n in neighbors], out=index[1:])
+        flat = np.fromiter(
+            (x for n in neighbors for x in n), dtype=np.int64, count=index[-1]
+        )
+        return index, flat
+
+    def finalize(self):
+        """convert the added patients to the search time arrays"""
+        self._genotypes = (
+            np.array(self._genotypes, dtype=np.uint16)
+            if len(self._genotypes)
+            else np.zeros((0, 10), dtype=np.uint16)
+        )
+
+        # genotype -> patients CSR, ordered by the patients' order
+        patients_genos = [genos for genos, _, _ in self._patients_genos]
+        genos = np.concatenate(patients_genos + [np.zeros(0, dtype=np.int64)])
+        patients = np.repeat(
+            np.arange(len(patients_genos)), [len(g) for g in patients_genos]
+        )
+        order = np.argsort(genos, kind="stable")
+        self._geno_patients_index = np.zeros(len(self._genotypes) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(genos, minlength=len(self._genotypes)),
+            out=self._geno_patients_index[1:],
+        )
+        self._geno_patients = patients[order]
+        self._geno_patients_nums = np.concatenate(
+            [nums for _, nums, _ in self._patients_genos] + [np.zeros(0, np.int64)]
+        )[order]
+        self._geno_patients_probs = np.concatenate(
+            [probs for _, _, probs in self._patients_genos] + [np.zeros(0)]
+        )[order]
+
+        self._classes_index, self._classes_neighbors = self._to_csr(self._classes_genos)
+        self._subclasses_index, self._subclasses_neighbors = self._to_csr(
+            self._subclasses_genos
+        )
+        self._classes_num = np.array(self._classes_num, dtype=np.uint8)
+        self._classes_genos, self._subclasses_genos = [], []
+
+    def genotype(self, geno_idx: int) -> np.ndarray:
+        """the alleles of a patients' genotype"""
+        return self._genotypes[geno_idx]
+
+    def patient_index(self, patient_id: int) -> int:
+        return self._patients_ids[patient_id]
+
+    def patient_genotypes(
+        self, patient_id: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """return the (genotypes indices, geno_nums, probabilities) of a patient"""
+        return self._patients_genos[self._patients_ids[patient_id]]
+
+    def genotype_patients(
+        self, geno_idx: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """return the (patients indices, geno_nums, probabilities) of the patients that have the genotype"""
+        start, end = self._geno_patients_index[geno_idx : geno_idx + 2]
+        return (
+            self._geno_patients[start:end],
+            self._geno_patients_nums[start:end],
+            self._geno_patients_probs[start:end],
+        )
+
+    def _of_patient(self, genos: np.ndarray, patient_id: int | None) -> np.ndarray:
+        if patient_id is None:
+            return genos
+        patient_genos = self._patients_genos[self._patients_ids[patient_id]][0]
+        return genos[np.isin(genos, patient_genos)]
+
+    def class_genotypes(
+        self, int_class: int, patient_id: int | None = None
+    ) -> np.ndarray:
+        """return the patients' genotypes (indices) that hold the class, or only the given patient's genotypes"""
+        class_idx = self._classes_ids[int_class]
+        return self._of_patient(
+            self._classes_neighbors[
+                self._classes_index[class_idx] : self._classes_index[class_idx + 1]
+            ],
+            patient_id,
+        )
+
+    def class_num(self, int_class: int) -> int:
+        """return 0 for a class I and 1 for a class II"""
+        return int(self._classes_num[self._classes_ids[int_class]])
+
+    def subclass_genotypes(
+        self, subclass: int, patient_id: int | None = None
+    ) -> np.ndarray:
+        """return the patients' genotypes (indices) that hold the subclass, or only the given patient's genotypes"""
+        sub_idx = self._subclasses_ids[subclass]
+        return self._of_patient(
+            self._subclasses_neighbors[
+                self._subclasses_index[sub_idx] : self._subclasses_index[sub_idx + 1]
+            ],
+            patient_id,
+        )
+
+    def add_candidates(
+        self,
+        patient_idx: int,
+        candidates_ids: np.ndarray,
+        geno_num: int,
+        probability: float,
+        similarities: np.ndarray,
+        reset: bool = False,
+    ):
+        """
+        Add candidate genotypes (LOL IDs in the donors' graph) for one of a patient's genotypes.
+        :param patient_idx: The patient's index (as returned by `genotype_patients`).
+        :param candidates_ids: The LOL IDs of the candidates.
+        :param geno_num: The number of the patient's genotype in the imputation file.
+        :param probability: The probability of the patient's genotype.
+        :param similarities: The number of matching alleles of each candidate.
+        :param reset: A boolean flag for whether to drop the previous entries of these candidates.
+        """
+        self._candidates[patient_idx].append(
+            (candidates_ids, geno_num, probability, similarities, reset)
+        )
+
+    def clear_candidates(self, patient_id: int):
+        """drop the candidates of a patient"""
+        self._candidates[self._patients_ids[patient_id]] = []
+
+    def candidates(self, patient_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the candidates of a patient, as (candidates ids, probabilities, similarities).
+        Each (candidate, geno_num) appears once, with its last added values
+        (after the last reset of the candidate).
+        The entries are ordered by the candidate and then by the geno_num, so they do not depend on the order
+        the candidates were added in.
+        """
+        chunks = self._candidates[self._patients_ids[patient_id]]
+        if not chunks:
+            return (
+                np.zeros(0, dtype=np.uint32),
+                np.zeros(0, dtype=np.float64),
+                np.zeros(0, dtype=np.uint32),
+            )
+
+        lengths = [len(chunk[0]) for chunk in chunks]
+        candidates = np.concatenate([chunk[0] for chunk in chunks])
+        similarities = np.concatenate([chunk[3] for chunk in chunks])
+        geno_nums = np.repeat([chunk[1] for chunk in chunks], lengths).astype(np.int64)
+        probabilities = np.repeat([chunk[2] for chunk in chunks], lengths)
+        resets = np.repeat([chunk[4] for chunk in chunks], lengths).astype(bool)
+        seq = np.arange(len(candidates))
+
+        unique_candidates, candidates_inverse = np.unique(
+            candidates, return_inverse=True
+        )
+
+        # drop the entries that were added before the last reset of their candidate
+        reset_seq = np.full(len(unique_candidates), -1, dtype=np.int64)
+        np.maximum.at(reset_seq, candidates_inverse[resets], seq[resets])
+        kept = np.flatnonzero(seq >= reset_seq[candidates_inverse])
+
+        # one entry for each (candidate, geno_num) - the last one.
+        # the unique pairs are sorted, by the candidate and then by the geno_num.
+        pairs = candidates_inverse[kept] * (int(geno_nums.max()) + 1) + geno_nums[kept]
+        unique_pairs, pairs_inverse = np.unique(pairs, return_inverse=True)
+        pairs_last = np.zeros(len(unique_pairs), dtype=np.int64)
+        np.maximum.at(pairs_last, pairs_inverse, np.arange(len(pairs)))
+
+        entries = kept[pairs_last]
+        return candidates[entries], probabilities[entries], similarities[entries]
@@ -1,6 +1,8 @@
 #cython: language_level=3
 
 import cython
+from cython.parallel cimport prange
+from libc.stdlib cimport strtod, strtoll
 import numpy as np
 cimport numpy as np
 
@@ -8,6 +10,9 @@ ctypedef np.uint8_t UINT8
 ctypedef np.int8_t INT8
 ctypedef np.uint16_t UINT16
 ctypedef np.uint32_t UINT32
+ctypedef np.int64_t INT64
+ctypedef np.float32_t FLOAT32
+ctypedef np.float64_t FLOAT64
 
 
 
@@ -91,6 +96,214 @@ cpdef np.ndarray[INT8, ndim=1] ccheck_similarity(np.ndarray[UINT16, ndim=1] pati
     return similarities
 
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline UINT8 locus_similarity(UINT16 p0, UINT16 p1, UINT16 d0, UINT16 d1) noexcept nogil:
+    """the number of matching alleles in a locus - the best of the straight and the crossed pairing"""
+    cdef UINT8 straight = (p0 == d0) + (p1 == d1)
+    cdef UINT8 crossed = (p0 == d1) + (p1 == d0)
+    return straight if straight >= crossed else crossed
+
+
+cdef inline void donor_similarities(const UINT16* patients_genos, Py_ssize_t num_of_patients,
+                                    const UINT16* donor_geno, Py_ssize_t geno_len,
+                                    const UINT8* allele_range, Py_ssize_t number_of_alleles,
+                                    UINT8 init_count_similar, INT8* similarities,
+                                    Py_ssize_t stride) noexcept nogil:
+    """set the similarities of a donor's genotype to all the patients' genotypes (-1 for less than 7)"""
+    cdef Py_ssize_t p, j
+    cdef UINT8 similar, allele_num
+    cdef const UINT16* patient_geno
+    for p in range(num_of_patients):
+        patient_geno = patients_genos + p * geno_len
+        similar = init_count_similar
+        for j in range(number_of_alleles):
+            allele_num = allele_range[j]
+            similar += locus_similarity(patient_geno[allele_num], patient_geno[allele_num + 1],
+                                        donor_geno[allele_num], donor_geno[allele_num + 1])
+        similarities[p * stride] = <INT8>similar if similar >= 7 else -1
+
+
+cdef int _num_threads = 0
+
+
+cpdef void set_num_threads(int num_threads):
+    """
+    Set the number of threads of the similarity kernel, when it is built with OpenMP.
+    0 (the default) uses the OpenMP default.
+    """
+    global _num_threads
+    _num_threads = num_threads
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef np.ndarray[UINT32, ndim=2] cmatch_genotypes(const UINT16[:, ::1] patients_genos,
+                                                  const UINT16[:, ::1] donors_genos,
+                                                  const UINT32[:] donors_ids,
+                                                  const UINT8[::1] allele_range,
+                                                  UINT8 init_count_similar):
+    """
+    Compare a block of candidate (donors') genotypes to several patients' genotypes at once.
+    The similarities are computed without the GIL, in parallel over the candidates when built with OpenMP,
+    and the candidates with at least 7 matches are written to the output in one pass.
+
+    :returns: An (M, 3) array of (candidate id, patient's genotype index, similarity) rows,
+    ordered by the patient's genotype and then by the candidate.
+    """
+    cdef:
+        Py_ssize_t num_of_patients = patients_genos.shape[0]
+        Py_ssize_t num_of_donors = donors_genos.shape[0]
+        Py_ssize_t geno_len = donors_genos.shape[1]
+        Py_ssize_t number_of_alleles = allele_range.shape[0]
+        Py_ssize_t i, p, count
+        np.ndarray[INT8, ndim=2] similarities = np.empty((num_of_patients, num_of_donors), dtype=np.int8)
+        INT8[:, ::1] similarities_view = similarities
+        np.ndarray[UINT32, ndim=2] ret
+        UINT32[:, :] ret_view
+
+    if num_of_donors == 0 or num_of_patients == 0:
+        return np.zeros((0, 3), dtype=np.uint32)
+
+    if _num_threads > 0:
+        for i in prange(num_of_donors, nogil=True, schedule="static", num_threads=_num_threads):
+            donor_similarities(&patients_genos[0, 0], num_of_patients, &donors_genos[i, 0], geno_len,
+                               &allele_range[0], number_of_alleles, init_count_similar,
+                               &similarities_view[0, i], num_of_donors)
+    else:
+        for i in prange(num_of_donors, nogil=True, schedule="static"):
+            donor_similarities(&patients_genos[0, 0], num_of_patients, &donors_genos[i, 0], geno_len,
+                               &allele_range[0], number_of_alleles, init_count_similar,
+                               &similarities_view[0, i], num_of_donors)
+
+    count = np.count_nonzero(similarities != -1)
+    ret = np.empty((count, 3), dtype=np.uint32)
+    ret_view = ret
+    count = 0
+    with nogil:
+        for p in range(num_of_patients):
+            for i in range(num_of_donors):
+                if similarities_view[p, i] != -1:
+                    ret_view[count, 0] = donors_ids[i]
+                    ret_view[count, 1] = <UINT32>p
+                    ret_view[count, 2] = <UINT32>similarities_view[p, i]
+                    count += 1
+    return ret
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef np.ndarray[UINT32, ndim=2] ccount_postings(const INT64[::1] postings_index,
+                                                 const UINT32[::1] postings,
+                                                 const INT64[::1] keys,
+                                                 UINT8[::1] counts,
+                                                 UINT8 min_count):
+    """
+    Count the number of the keys' postings lists that each posting (a genotype) appears in.
+    counts is a zeroed work array with an entry for each posting, and it is zeroed again before returning.
+
+    :returns: An (M, 2) array of (posting, count) rows of the postings with at least min_count hits,
+    ordered by their first hit.
+    """
+    cdef:
+        Py_ssize_t i, j, num_of_touched = 0, count = 0, total = 0
+        UINT32 posting
+        np.ndarray[UINT32, ndim=1] touched
+        UINT32[::1] touched_view
+        np.ndarray[UINT32, ndim=2] ret
+        UINT32[:, ::1] ret_view
+
+    for i in range(keys.shape[0]):
+        total += postings_index[keys[i] + 1] - postings_index[keys[i]]
+    touched = np.empty(total, dtype=np.uint32)
+    touched_view = touched
+
+    with nogil:
+        for i in range(keys.shape[0]):
+            for j in range(postings_index[keys[i]], postings_index[keys[i] + 1]):
+                posting = postings[j]
+                if counts[posting] == 0:
+                    touched_view[num_of_touched] = posting
+                    num_of_touched += 1
+                counts[posting] += 1
+
+        for i in range(num_of_touched):
+            if counts[touched_view[i]] >= min_count:
+                count += 1
+
+    ret = np.empty((count, 2), dtype=np.uint32)
+    ret_view = ret
+    count = 0
+    with nogil:
+        for i in range(num_of_touched):
+            posting = touched_view[i]
+            if counts[posting] >= min_count:
+                ret_view[count, 0] = posting
+                ret_view[count, 1] = counts[posting]
+                count += 1
+            counts[posting] = 0
+    return ret
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef void csort_rows(const UINT32[::1] index_list, UINT32[::1] neighbors_list, FLOAT32[::1] weights_list,
+                      Py_ssize_t first_row, Py_ssize_t last_row):
+    """
+    Sort each of the rows [first_row, last_row) of the LOL arrays by the neighbors, in place.
+    The rows are short, so they are sorted with an insertion sort (a long row is sorted with numpy).
+    """
+    cdef:
+        Py_ssize_t row, start, end, i, j
+        UINT32 neighbor
+        FLOAT32 weight
+
+    for row in range(first_row, last_row):
+        start = index_list[row]
+        end = index_list[row + 1]
+        if end - start > 64:
+            order = np.argsort(np.asarray(neighbors_list[start:end]), kind="stable")
+            np.asarray(neighbors_list[start:end])[:] = np.asarray(neighbors_list[start:end])[order]
+            np.asarray(weights_list[start:end])[:] = np.asarray(weights_list[start:end])[order]
+            continue
+
+        with nogil:
+            for i in range(start + 1, end):
+                neighbor = neighbors_list[i]
+                weight = weights_list[i]
+                j = i
+                while j > start and neighbors_list[j - 1] > neighbor:
+                    neighbors_list[j] = neighbors_list[j - 1]
+                    weights_list[j] = weights_list[j - 1]
+                    j -= 1
+                neighbors_list[j] = neighbor
+                weights_list[j] = weight
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef void cfill_transposed_rows(const UINT32[::1] index_list, UINT32[::1] neighbors_list,
+                                 FLOAT32[::1] weights_list, Py_ssize_t first_row, Py_ssize_t last_row,
+                                 Py_ssize_t first_target, Py_ssize_t last_target):
+    """
+    Fill the rows of the targets [first_target, last_target) of the LOL arrays with the reversed edges
+    of the rows [first_row, last_row), which all point to the targets. Each edge is written to the next
+    free place of its target's row, so the rows of the targets are ordered by their neighbors.
+    """
+    cdef:
+        Py_ssize_t row, i, target
+        np.ndarray[INT64, ndim=1] cursors = np.array(index_list[first_target:last_target], dtype=np.int64)
+        INT64[::1] cursors_view = cursors
+
+    with nogil:
+        for row in range(first_row, last_row):
+            for i in range(index_list[row], index_list[row + 1]):
+                target = neighbors_list[i] - first_target
+                neighbors_list[cursors_view[target]] = <UINT32>row
+                weights_list[cursors_view[target]] = weights_list[i]
+                cursors_view[target] += 1
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 cpdef UINT32 chash(np.ndarray[UINT16, ndim=1] arr):
@@ -99,3 +312,102 @@ cpdef UINT32 chash(np.ndarray[UINT16, ndim=1] arr):
     for i in range(len(arr)):
         h = h * 31 + arr[i]
     return h
+
+
+cdef inline bint is_allele_separator(char c) noexcept nogil:
+    return c == c'+' or c == c'^' or c == c'~'
+
+
+cdef inline const char* skip_spaces(const char* p, const char* end) noexcept nogil:
+    while p < end and (p[0] == c' ' or p[0] == c'\t' or p[0] == c'\r' or p[0] == c'\n'):
+        p += 1
+    return p
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef tuple cparse_gl_lines(bytes data):
+    """
+    Parse lines of `id,genotype,probability,index`, where the genotype is a GL string of 10 alleles
+    (like `gl_string_to_integers`, each allele is the first 4 digits after its '*', without the ':').
+    The alleles of each locus are sorted. Blank lines are skipped.
+
+    :returns: (ids, genotypes, probabilities, indices) - int64, (N, 10) uint16, float64 and int64 arrays.
+    """
+    cdef:
+        const char* text = data
+        const char* end = text + len(data)
+        const char* p = text
+        char* number_end
+        Py_ssize_t max_lines = data.count(b"\n") + 1
+        Py_ssize_t count = 0, num_of_alleles, digits
+        UINT16 allele, first
+        np.ndarray[INT64, ndim=1] ids = np.empty(max_lines, dtype=np.int64)
+        np.ndarray[UINT16, ndim=2] genotypes = np.empty((max_lines, 10), dtype=np.uint16)
+        np.ndarray[FLOAT64, ndim=1] probabilities = np.empty(max_lines, dtype=np.float64)
+        np.ndarray[INT64, ndim=1] indices = np.empty(max_lines, dtype=np.int64)
+
+    while True:
+        p = skip_spaces(p, end)
+        if p >= end:
+            break
+
+        ids[count] = strtoll(p, &number_end, 10)
+        if number_end == p or number_end[0] != c',':
+            raise ValueError(f"invalid ID in line {count + 1}")
+        p = number_end + 1
+
+        num_of_alleles = 0
+        while True:
+            while p < end and p[0] != c'*' and p[0] != c',' and p[0] != c'\n':
+                p += 1
+            if p >= end or p[0] != c'*' or num_of_alleles == 10:
+                raise ValueError(f"invalid genotype in line {count + 1}")
+            p += 1
+
+            # the first 4 digits of the allele, without the ':'
+            allele = 0
+            digits = 0
+            while p < end and p[0] != c',' and p[0] != c'\n' and not is_allele_separator(p[0]):
+                if p[0] != c':' and digits < 4:
+                    if p[0] < c'0' or p[0] > c'9':
+                        raise ValueError(f"invalid allele in line {count + 1}")
+                    allele = allele * 10 + (p[0] - c'0')
+                    digits += 1
+                p += 1
+            if digits == 0:
+                raise ValueError(f"invalid allele in line {count + 1}")
+            genotypes[count, num_of_alleles] = allele
+            num_of_alleles += 1
+
+            if p >= end or not is_allele_separator(p[0]):
+                break
+            p += 1
+
+        if num_of_alleles != 10 or p >= end or p[0] != c',':
+            raise ValueError(f"invalid genotype in line {count + 1}")
+        p += 1
+
+        probabilities[count] = strtod(p, &number_end)
+        if number_end == p or number_end[0] != c',':
+            raise ValueError(f"invalid probability in line {count + 1}")
+        p = number_end + 1
+
+        indices[count] = strtoll(p, &number_end, 10)
+        if number_end == p:
+            raise ValueError(f"invalid index in line {count + 1}")
+        p = number_end
+        while p < end and (p[0] == c' ' or p[0] == c'\t' or p[0] == c'\r'):
+            p += 1
+        if p < end and p[0] != c'\n':
+            raise ValueError(f"invalid index in line {count + 1}")
+
+        # sort the alleles of each locus
+        for num_of_alleles in range(0, 10, 2):
+            first = genotypes[count, num_of_alleles]
+            if first > genotypes[count, num_of_alleles + 1]:
+                genotypes[count, num_of_alleles] = genotypes[count, num_of_alleles + 1]
+                genotypes[count, num_of_alleles + 1] = first
+        count += 1
+
+    return ids[:count], genotypes[:count], probabilities[:count], indices[:count]
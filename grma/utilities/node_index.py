@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import os
+from typing import Dict, Iterable, Iterator, List, Mapping, Sequence, Tuple, Union
+
+import numpy as np
+
+WORD_BITS: int = 64
+WORD_MASK: int = (1 << WORD_BITS) - 1
+LAYERS: List[str] = ["ID", "SUBCLASS", "GENOTYPE", "CLASS"]
+
+
+def _words_dtype(num_of_words: int) -> np.dtype:
+    """
+    a dtype for keys of the given number of uint64 words.
+    keys wider than a single word are structured values, which numpy compares field by field.
+    """
+    if num_of_words == 1:
+        return np.dtype(np.uint64)
+    return np.dtype([(f"w{i}", np.uint64) for i in range(num_of_words)])
+
+
+def _num_of_words(keys: np.ndarray) -> int:
+    return 1 if keys.dtype.names is None else len(keys.dtype.names)
+
+
+def _split_to_words(key: int, num_of_words: int) -> tuple:
+    """split an integer key to uint64 words, the most significant word first"""
+    return tuple(
+        (key >> (WORD_BITS * (num_of_words - 1 - i))) & WORD_MASK
+        for i in range(num_of_words)
+    )
+
+
+class NodeIndex(object):
+    """
+    A read-only map from the donors' graph nodes to their LOL IDs, built of sorted NumPy arrays.
+    The nodes of each layer (IDs, subclasses, genotypes and classes) are kept as sorted keys
+    with their LOL IDs, and a lookup is a binary search in the layers.
+    Keys of up to 64 bits are kept as uint64, and wider keys are split into several uint64 words.
+    It takes 12 bytes for a node with a 64 bits key (20 bytes for a pair of words),
+    instead of the 100+ bytes of a dict entry of python integers.
+    Supports the dictionary operations the graph uses: `in`, `get`, `[]` and `items`,
+    and a batched lookup with `get_node_ids`.
+    """
+
+    __slots__ = "_keys", "_ids"
+
+    def __init__(self, keys: Dict[str, np.ndarray], ids: Dict[str, np.ndarray]):
+        """
+        :param keys: {layer: sorted array of the keys - uint64, or structured uint64 words}
+        :param ids: {layer: the LOL IDs of the keys, in the same order}
+        """
+        self._keys = keys
+        self._ids = ids
+
+    @classmethod
+    def from_map(
+        cls, map_node_to_number: Mapping[int, int], layers_starts: Sequence[int]
+    ) -> NodeIndex:
+        """
+        Create the index from a {node: LOL ID} map.
+        :param map_node_to_number: A map from the nodes (integers) to their LOL IDs.
+        :param layers_starts: The first LOL ID of each layer, ordered as `LAYERS`.
+        """
+        layers_keys = {layer: [] for layer in LAYERS}
+        layers_ids = {layer: [] for layer in LAYERS}
+        for node, number in map_node_to_number.items():
+            layer = LAYERS[int(np.searchsorted(layers_starts, number, "right")) - 1]
+            layers_keys[layer].append(int(node))
+            layers_ids[layer].append(number)
+
+        keys, ids = {}, {}
+        for layer in LAYERS:
+            max_key = max(layers_keys[layer], default=0)
+            num_of_words = max(1, -(-max_key.bit_length() // WORD_BITS))
+            if num_of_words == 1:
+                layer_keys = np.array(layers_keys[layer], dtype=np.uint64)
+            else:
+                layer_keys = np.array(
+                    [_split_to_words(key, num_of_words) for key in layers_keys[layer]],
+                    dtype=_words_dtype(num_of_words),
+                )
+            order = np.argsort(layer_keys, kind="stable")
+            keys[layer] = layer_keys[order]
+            ids[layer] = np.array(layers_ids[layer], dtype=np.uint32)[order]
+        return cls(keys, ids)
+
+    @classmethod
+    def from_arrays(
+        cls, layers_keys: Sequence[np.ndarray], layers_starts: Sequence[int]
+    ) -> NodeIndex:
+        """
+        Create the index from the keys of each layer's nodes, which are numbered consecutively.
+        :param layers_keys: The keys of each layer, ordered as `LAYERS` - (N, words) uint64 arrays
+            (the most significant word first, like `pack_genos`) in the order of the nodes' LOL IDs.
+        :param layers_starts: The first LOL ID of each layer, ordered as `LAYERS`.
+        """
+        keys, ids = {}, {}
+        for layer, layer_keys, start in zip(LAYERS, layers_keys, layers_starts):
+            num_of_words = layer_keys.shape[1]
+            layer_keys = np.ascontiguousarray(layer_keys, dtype=np.uint64)
+            layer_keys = layer_keys.view(_words_dtype(num_of_words)).reshape(-1)
+            order = np.argsort(layer_keys, kind="stable")
+            keys[layer] = layer_keys[order]
+            ids[layer] = (order + start).astype(np.uint32)
+        return cls(keys, ids)
+
+    def get(self, node, default=None):
+        """return the LOL ID of the node, or default if the node is not in the graph"""
+        if not isinstance(node, (int, np.integer)) or node < 0:
+            return default
+        node = int(node)
+        for layer in LAYERS:
+            layer_keys = self._keys[layer]
+            num_of_words = _num_of_words(layer_keys)
+            if node >> (WORD_BITS * num_of_words) or not len(layer_keys):
+                continue
+            if num_of_words == 1:
+                key = np.uint64(node)
+            else:
+                key = np.array(
+                    _split_to_words(node, num_of_words), dtype=layer_keys.dtype
+                )
+            position = np.searchsorted(layer_keys, key)
+            if position < len(layer_keys) and layer_keys[position] == key:
+                return int(self._ids[layer][position])
+        return default
+
+    def get_node_ids(self, nodes: Iterable[int]) -> np.ndarray:
+        """
+        Batched lookup of many nodes.
+        :param nodes: An iterable of nodes (integers).
+        :return: An int64 array with the LOL ID of each node, or -1 for nodes that are not in the graph.
+        """
+        nodes = [int(node) for node in nodes]
+        node_ids = np.full(len(nodes), -1, dtype=np.int64)
+        not_found = [i for i, node in enumerate(nodes) if node >= 0]
+        for layer in LAYERS:
+            layer_keys = self._keys[layer]
+            num_of_words = _num_of_words(layer_keys)
+            # only the nodes that were not found yet and fit in the layer's keys
+            positions = np.array(
+                [i for i in not_found if not nodes[i] >> (WORD_BITS * num_of_words)],
+                dtype=np.int64,
+            )
+            if not len(positions) or not len(layer_keys):
+                continue
+
+            keys = np.array(
+                (
+                    [_split_to_words(nodes[i], num_of_words) for i in positions]
+                    if num_of_words > 1
+                    else [nodes[i] for i in positions]
+                ),
+                dtype=layer_keys.dtype,
+            )
+            found = np.searchsorted(layer_keys, keys)
+            in_layer = found < len(layer_keys)
+            in_layer[in_layer] = layer_keys[found[in_layer]] == keys[in_layer]
+            node_ids[positions[in_layer]] = self._ids[layer][found[in_layer]]
+            not_found = [i for i in not_found if node_ids[i] == -1]
+        return node_ids
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        """generate the (node, LOL ID) pairs of all the layers"""
+        for layer in LAYERS:
+            layer_keys = self._keys[layer]
+            num_of_words = _num_of_words(layer_keys)
+            words = layer_keys.view(np.uint64).reshape(len(layer_keys), num_of_words)
+            for node_words, number in zip(words.tolist(), self._ids[layer].tolist()):
+                node = 0
+                for word in node_words:
+                    node = (node << WORD_BITS) | word
+                yield node, number
+
+    def __contains__(self, node) -> bool:
+        return self.get(node) is not None
+
+    def __getitem__(self, node) -> int:
+        number = self.get(node)
+        if number is None:
+            raise KeyError(node)
+        return number
+
+    def __len__(self) -> int:
+        return sum(len(layer_ids) for layer_ids in self._ids.values())
+
+    def save(self, path: Union[str, os.PathLike]):
+        """save the index's arrays as .npy files in the given directory"""
+        for layer in LAYERS:
+            np.save(os.path.join(path, f"node_keys_{layer}.npy"), self._keys[layer])
+            np.save(os.path.join(path, f"node_ids_{layer}.npy"), self._ids[layer])
+
+    @classmethod
+    def load(
+        cls, path: Union[str, os.PathLike], mmap_mode: Union[str, None] = "r"
+    ) -> NodeIndex:
+        """load an index saved with `NodeIndex.save`"""
+        keys, ids = {}, {}
+        for layer in LAYERS:
+            keys[layer] = np.load(
+                os.path.join(path, f"node_keys_{layer}.npy"), mmap_mode=mmap_mode
+            )
+            ids[layer] = np.load(
+                os.path.join(path, f"node_ids_{layer}.npy"), mmap_mode=mmap_mode
+            )
+        return cls(keys, ids)
@@ -1,13 +1,26 @@
 from __future__ import annotations
 
 from datetime import datetime
-from typing import Iterable
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
 
-from grma.utilities.cutils import cdrop_less_than_7_matches, ccheck_similarity
+import numpy as np
+
+from grma.utilities.cutils import (
+    cdrop_less_than_7_matches,
+    ccheck_similarity,
+    ccount_postings,
+    cfill_transposed_rows,
+    cmatch_genotypes,
+    cparse_gl_lines,
+    csort_rows,
+)
 
 from collections.abc import Sequence
 
 LENGTH_OF_NUMBERS_IN_ALLELE: int = 4
+BITS_IN_ALLELE: int = 14  # enough for the 4 digits of an allele (< 16384)
+BITS_IN_WORD: int = 64
 TO_SEROLOGY: dict[str, int] = {
     "A2": 1,
     "A203": 1,
@@ -231,6 +244,261 @@ def tuple_geno_to_int(tuple_geno: Iterable[int]):
     return int(string)
 
 
+def pack_geno(tuple_geno: Iterable[int]) -> int:
+    """
+    convert genotype from Iterable to integer, packing each allele in a fixed-width slot of 14 bits.
+    The first allele takes the most significant bits.
+    """
+    packed = 0
+    for allele in tuple_geno:
+        packed = (packed << BITS_IN_ALLELE) | int(allele)
+    return packed
+
+
+def pack_genos(genos: np.ndarray) -> np.ndarray:
+    """
+    Vectorized `pack_geno`.
+    Takes an (N, k) array of genotypes (or classes) and packs each row to ceil(14k / 64) uint64 words.
+    Returns an (N, words) uint64 array, with the most significant word first.
+    """
+    genos = np.asarray(genos, dtype=np.uint64)
+    num_of_alleles = genos.shape[1]
+    num_of_words = -(-num_of_alleles * BITS_IN_ALLELE // BITS_IN_WORD)
+    words = np.zeros((len(genos), num_of_words), dtype=np.uint64)
+
+    for i in range(num_of_alleles):
+        # the position of the allele's least significant bit, from the end of the packed integer
+        offset = BITS_IN_ALLELE * (num_of_alleles - 1 - i)
+        word = num_of_words - 1 - offset // BITS_IN_WORD
+        shift = offset % BITS_IN_WORD
+        words[:, word] |= genos[:, i] << np.uint64(shift)
+        if shift + BITS_IN_ALLELE > BITS_IN_WORD:
+            # the allele crosses the boundary of the word
+            words[:, word - 1] |= genos[:, i] >> np.uint64(BITS_IN_WORD - shift)
+    return words
+
+
+def words_to_ints(words: np.ndarray) -> List[int]:
+    """convert the (N, words) output of `pack_genos` to python integers"""
+    ints = [0] * len(words)
+    for column in words.T:
+        for i, word in enumerate(column.tolist()):
+            ints[i] = (ints[i] << BITS_IN_WORD) | word
+    return ints
+
+
+def subclasses_of_classes(classes: np.ndarray) -> np.ndarray:
+    """
+    Takes an (N, k) array of classes. Returns an (N, k, k) array of their subclasses.
+    Subclass i of a class is created by dropping its allele i.
+    The dropped allele is replaced with zero, and the remaining allele of the locus is shifted
+    to be the second allele in the locus.
+    """
+    num_of_alleles = classes.shape[1]
+    subclasses = np.repeat(classes[:, np.newaxis, :], num_of_alleles, axis=1)
+    for i in range(num_of_alleles):
+        locus = i - i % 2
+        subclasses[:, i, locus + 1] = classes[:, locus + 1 - i % 2]
+        subclasses[:, i, locus] = 0
+    return subclasses
+
+
+# the number of keys of the alleles' inverted index - (locus, allele) and (locus, homozygous allele) keys
+ALLELES_KEYS: int = 10 << BITS_IN_ALLELE
+
+
+def alleles_keys(genotypes: np.ndarray) -> np.ndarray:
+    """
+    The keys of the alleles' inverted index of genotypes, 2 for each locus:
+    the key of the first allele, and the key of the second allele
+    (or, for a homozygous locus, a homozygous key of the allele).
+    The number of keys that two genotypes share is the number of their matching alleles.
+    :param genotypes: An (N, 10) array of genotypes, with sorted alleles in each locus.
+    :return: An (N, 10) int64 array of the keys.
+    """
+    genotypes = np.asarray(genotypes, dtype=np.int64)
+    first, second = genotypes[:, 0::2], genotypes[:, 1::2]
+    loci = np.arange(0, 10, 2, dtype=np.int64)
+    keys = np.empty_like(genotypes)
+    keys[:, 0::2] = (loci << BITS_IN_ALLELE) | first
+    keys[:, 1::2] = np.where(
+        first == second,
+        ((loci + 1) << BITS_IN_ALLELE) | first,
+        (loci << BITS_IN_ALLELE) | second,
+    )
+    return keys
+
+
+def count_postings(
+    postings_index: np.ndarray,
+    postings: np.ndarray,
+    keys: np.ndarray,
+    counts: np.ndarray,
+    min_count: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the hits of the postings (genotypes) in the postings lists of the keys.
+    :param postings_index: The CSR index of the postings lists of all the keys.
+    :param postings: The postings lists (sorted).
+    :param keys: The keys to count.
+    :param counts: A zeroed uint8 work array with an entry for each posting (it is zeroed again).
+    :param min_count: The minimal number of hits.
+    :return: The postings with at least min_count hits (sorted) and their number of hits.
+    """
+    hits = ccount_postings(
+        postings_index,
+        postings,
+        np.ascontiguousarray(keys, dtype=np.int64),
+        counts,
+        min_count,
+    )
+    hits = hits[np.argsort(hits[:, 0])]
+    return hits[:, 0], hits[:, 1]
+
+
+# The integer representations of genotypes, classes and subclasses in the donors' graph.
+KEY_ENCODINGS = {"decimal": tuple_geno_to_int, "packed": pack_geno}
+DEFAULT_KEY_ENCODING = "packed"
+
+
+def sum_scores_by_donor(
+    donors_ids: np.ndarray, contributions: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum the scores' contributions of each donor.
+    :param donors_ids: An array of donors' IDs, with repetitions.
+    :param contributions: The contribution to the score of each entry of donors_ids.
+    :return: (donors, scores) - the unique donors (sorted) and their total scores.
+    """
+    donors, dense_ids = np.unique(donors_ids, return_inverse=True)
+    scores = np.bincount(dense_ids, weights=contributions, minlength=len(donors))
+    return donors, scores
+
+
+def top_k_scores(scores: np.ndarray, ties: np.ndarray, k: int) -> np.ndarray:
+    """
+    Find the k highest scores, without sorting all the scores.
+    Ties are broken by the ascending values of ties (e.g. the donors' IDs), so the result is deterministic.
+    :param k: The number of scores to find. It may be infinite.
+    :return: The indices of the top k scores, sorted by descending score.
+    """
+    if k <= 0 or not len(scores):
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        k = int(k)
+        # keep all the scores that tie with the k-th score, to break the ties by their values of ties
+        kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= kth_score)
+    else:
+        k = len(scores)
+        candidates = np.arange(len(scores))
+    order = np.lexsort((ties[candidates], -scores[candidates]))
+    return candidates[order[:k]]
+
+
+def prune_genotypes(
+    probabilities: np.ndarray,
+    max_genotypes: int = 0,
+    genotypes_mass: float = 1.0,
+    min_probability: float = 0.0,
+) -> np.ndarray:
+    """
+    Choose the most probable genotypes of a patient or a donor.
+    The most probable genotype is always kept.
+    :param probabilities: The normalized probabilities of the genotypes.
+    :param max_genotypes: Keep at most this number of genotypes. 0 keeps all of them.
+    :param genotypes_mass: Keep the genotypes only until their cumulative probability reaches this mass.
+    :param min_probability: Keep only the genotypes with at least this probability.
+    :return: The indices of the kept genotypes, in their original order.
+    """
+    order = np.argsort(-probabilities, kind="stable")
+    if max_genotypes:
+        order = order[:max_genotypes]
+    # the smallest prefix that reaches the mass
+    order = order[
+        : int(np.searchsorted(np.cumsum(probabilities[order]), genotypes_mass)) + 1
+    ]
+    order = order[
+        : max(1, int(np.count_nonzero(probabilities[order] >= min_probability)))
+    ]
+    return np.sort(order)
+
+
+# Quantized weights are stored as uint16 fixed-point numbers in [0, 1]
+WEIGHTS_QUANTIZATION_SCALE: int = 65535
+
+
+def quantize_weights(weights: np.ndarray) -> np.ndarray:
+    """convert weights in [0, 1] to uint16 fixed-point weights"""
+    weights = np.clip(np.asarray(weights, dtype=np.float64), 0, 1)
+    return np.round(weights * WEIGHTS_QUANTIZATION_SCALE).astype(np.uint16)
+
+
+def dequantize_weights(weights: np.ndarray) -> np.ndarray:
+    """convert uint16 fixed-point weights back to float32 weights (float32 arrays are returned as they are)"""
+    weights = np.asarray(weights)
+    if weights.dtype != np.uint16:
+        return weights.astype(np.float32, copy=False)
+    return weights.astype(np.float32) / np.float32(WEIGHTS_QUANTIZATION_SCALE)
+
+
+class GrowingArray(object):
+    """
+    A 1D array that is extended in place, by doubling its capacity when it is full.
+    """
+
+    __slots__ = "_array", "_size"
+
+    def __init__(self, dtype, capacity: int = 1024):
+        self._array = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def extend(self, values: Sequence):
+        end = self._size + len(values)
+        if end > len(self._array):
+            self._array.resize(max(end, 2 * len(self._array)), refcheck=False)
+        self._array[self._size : end] = values
+        self._size = end
+
+    def finish(self, size: int = None) -> np.ndarray:
+        """
+        Get the array, resized in place to its size (or to a bigger size, the new entries are zeros).
+        The array can't be extended afterwards.
+        """
+        array, self._array = self._array, None
+        array.resize(self._size if size is None else size, refcheck=False)
+        return array
+
+
+def sort_rows(
+    index_list: np.ndarray,
+    neighbors_list: np.ndarray,
+    weights_list: np.ndarray,
+    first_row: int,
+    last_row: int,
+):
+    """Sort each of the rows [first_row, last_row) of the LOL arrays by the neighbors, in place."""
+    csort_rows(index_list, neighbors_list, weights_list, first_row, last_row)
+
+
+def fill_transposed_rows(
+    index_list: np.ndarray,
+    neighbors_list: np.ndarray,
+    weights_list: np.ndarray,
+    rows: Tuple[int, int],
+    targets: Tuple[int, int],
+):
+    """
+    Fill the rows of the targets with the reversed edges of the rows, in place.
+    :param rows: The [first, last) rows, whose neighbors are all targets.
+    :param targets: The [first, last) targets, whose places in the neighbors list are free.
+    """
+    cfill_transposed_rows(index_list, neighbors_list, weights_list, *rows, *targets)
+
+
 def print_time(log: str):
     now = datetime.now()
     current_time = now.strftime("%H:%M:%S")
@@ -247,7 +515,57 @@ def check_similarity(patients_geno, donors_genos, allele_range, init_count_simil
     )
 
 
+def match_genotypes(
+    patients_genos, donors_genos, donors_ids, allele_range, init_count_similar
+):
+    """
+    Compare the candidates to several patients' genotypes at once.
+    :return: An (M, 3) array of (candidate id, patient's genotype index, similarity) rows
+    of the candidates with at least 7 matches, ordered by the patient's genotype and then by the candidate.
+    """
+    return cmatch_genotypes(
+        np.ascontiguousarray(patients_genos),
+        np.ascontiguousarray(donors_genos),
+        donors_ids,
+        np.ascontiguousarray(allele_range),
+        init_count_similar,
+    )
+
+
 def gl_string_to_integers(genotype: str) -> Sequence[int]:
     genotype = genotype.replace("+", "~").replace("^", "~").replace(":", "")
     genotype = [int(allele.split("*")[1][:4]) for allele in genotype.split("~")]
     return genotype
+
+
+GL_LINES_CHUNK: int = 100_000  # number of lines to parse at once
+
+
+def parse_gl_lines(
+    lines: Iterable[str],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse lines of `id,genotype,probability,index` (the format of the donors' and the patients' files) at once.
+    The genotypes are converted like `gl_string_to_integers`, and the alleles of each locus are sorted.
+    :return: (ids, genotypes, probabilities, indices) - int64, (N, 10) uint16, float64 and int64 arrays.
+    """
+    return cparse_gl_lines("\n".join(lines).encode())
+
+
+def iter_gl_lines(
+    lines: Iterable[str], chunk_size: int = GL_LINES_CHUNK
+) -> Iterator[Tuple[int, np.ndarray, float, int]]:
+    """
+    Parse lines of `id,genotype,probability,index` in chunks with `parse_gl_lines`.
+    :return: A generator of (id, genotype, probability, index) of each line.
+    The genotype is a uint16 array of 10 alleles, with sorted alleles in each locus.
+    """
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        ids, genotypes, probabilities, indices = parse_gl_lines(chunk)
+        yield from zip(
+            ids.tolist(), genotypes, probabilities.tolist(), indices.tolist()
+        )
@@ -1,7 +1,12 @@
+import os
+
 import numpy as np
 from setuptools import setup, Extension, find_packages
 from Cython.Build import cythonize
 
+# build the similarity kernel with OpenMP (GRMA_OPENMP=1) to compare the candidates in parallel
+OPENMP_ARGS = ["-fopenmp"] if os.environ.get("GRMA_OPENMP") == "1" else []
+
 with open("grma/README.md") as readme_file:
     readme = readme_file.read()
 
@@ -53,6 +58,8 @@ setup(
                 "grma.utilities.cutils",
                 ["grma/utilities/cutils.pyx"],
                 define_macros=[("NPY_NO_DEPRECATED_API", "NPY_1_7_API_VERSION")],
+                extra_compile_args=OPENMP_ARGS,
+                extra_link_args=OPENMP_ARGS,
             ),
             Extension(
                 "grma.match.lol_graph",
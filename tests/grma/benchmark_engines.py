@@ -0,0 +1,48 @@
+"""
+Compare the running times of the matching engines ("subclasses" and "alleles", see `find_matches`).
+usage: python benchmark_engines.py [donors directory] [patients file]
+(default is the test donors and patients)
+"""
+
+import sys
+import time
+
+import pandas as pd
+
+from grma.donorsgraph.build_donors_graph import BuildMatchingGraph
+from grma.match import find_matches
+from grma.match.match import ENGINES
+
+DONORS_DIR_PATH = sys.argv[1] if len(sys.argv) > 1 else "./data/test_donors"
+PATIENTS_FILE_PATH = sys.argv[2] if len(sys.argv) > 2 else "data/test_patients.txt"
+CUTOFS = (10, 50, 10_000)
+REPEATS = 3
+
+start = time.time()
+build_matching = BuildMatchingGraph(DONORS_DIR_PATH, alleles_postings=True)
+donors_graph = build_matching.graph
+print(f"Build (with the alleles' inverted index): {time.time() - start:.2f}s")
+
+for cutof in CUTOFS:
+    results = {}
+    for engine in ENGINES:
+        times = []
+        for _ in range(REPEATS):
+            start = time.time()
+            results[engine] = find_matches(
+                PATIENTS_FILE_PATH,
+                donors_graph,
+                threshold=0.0,
+                cutof=cutof,
+                combined=True,
+                engine=engine,
+            )
+            times.append(time.time() - start)
+        print(
+            f"cutof={cutof} engine={engine}: {min(times):.3f}s "
+            f"({len(results[engine])} matches)"
+        )
+
+    # the engines find the same matches
+    expected, actual = (results[engine] for engine in ENGINES)
+    pd.testing.assert_frame_equal(expected, actual)
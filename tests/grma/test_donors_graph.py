@@ -0,0 +1,342 @@
+import os
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from grma.donorsgraph.build_donors_graph import BuildMatchingGraph
+from grma.donorsgraph.update_donors_graph import UpdateMatchingGraph
+from grma.match import Graph, find_matches
+from grma.match.graph_wrapper import MergedGraph
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data")
+DONORS_DIR_PATH = os.path.join(DATA_PATH, "test_donors")
+PATIENTS_FILE_PATH = os.path.join(DATA_PATH, "test_patients.txt")
+LOL_ARRAYS = ["index_list", "neighbors_list", "weights_list", "map_number_to_num_node"]
+
+
+def test_streaming_build_equals_edgelist_build():
+    edgelist_graph = BuildMatchingGraph(DONORS_DIR_PATH)._graph
+    streaming_graph = BuildMatchingGraph(DONORS_DIR_PATH, streaming=True)._graph
+
+    # the streaming build numbers the donors and the genotypes in their order in the files
+    assert _graph_structure(streaming_graph) == _graph_structure(edgelist_graph)
+    assert edgelist_graph["arrays_start"] == streaming_graph["arrays_start"]
+    for key in ["index_list", "neighbors_list", "weights_list"]:
+        assert streaming_graph[key].nbytes == edgelist_graph[key].nbytes
+
+    graph = Graph(streaming_graph)
+    for node, number in streaming_graph["map_node_to_number"].items():
+        assert graph.get_node_id(node) == number
+        assert np.array_equal(
+            np.sort(graph.neighbors_unweighted(node)[0]),
+            graph.neighbors_unweighted(node)[0],
+        )
+
+
+def test_streaming_build_memory(tmp_path):
+    rng = np.random.default_rng(0)
+    with open(os.path.join(DONORS_DIR_PATH, "donors.txt")) as f:
+        loci = np.array([line.split(",")[1].split("^") for line in f if line.strip()])
+    with open(tmp_path / "donors.txt", "w") as f:
+        for donor_id in range(5000):
+            for index in range(rng.integers(1, 7)):
+                geno = "^".join(
+                    loci[rng.integers(len(loci)), locus] for locus in range(5)
+                )
+                f.write(f"{donor_id},{geno},{rng.random()},{index}\n")
+
+    tracemalloc.start()
+    # the memory of parsing the lines (a chunk of lines and its arrays) does not depend on the graph
+    build_matching = BuildMatchingGraph.__new__(BuildMatchingGraph)
+    build_matching._verbose = False
+    for _ in BuildMatchingGraph._iter_donors(
+        build_matching._iter_donors_lines(tmp_path)
+    ):
+        pass
+    parsing_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    graph = BuildMatchingGraph(tmp_path, streaming=True)._graph
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    node_index = graph["map_node_to_number"]
+    graph_size = sum(
+        array.nbytes
+        for array in [graph[key] for key in LOL_ARRAYS + ["map_number_to_arr_node"]]
+        + list(node_index._keys.values())
+        + list(node_index._ids.values())
+    )
+    # no edge-list or map of python objects is kept besides the graph's arrays
+    assert peak - parsing_peak < graph_size
+
+
+def test_directory_graph_equals_built_graph(tmp_path):
+    build_matching = BuildMatchingGraph(DONORS_DIR_PATH)
+    build_matching.to_directory(tmp_path)
+    graph = Graph.from_directory(tmp_path)
+
+    for node, number in build_matching._graph["map_node_to_number"].items():
+        assert graph.in_nodes(node)
+        assert graph.get_node_id(node) == number
+        assert np.array_equal(
+            graph.neighbors_unweighted(node)[0],
+            build_matching.graph.neighbors_unweighted(node)[0],
+        )
+
+
+def test_compact_index_lookups():
+    lol_properties = BuildMatchingGraph(DONORS_DIR_PATH)._graph
+    map_node_to_number = dict(lol_properties["map_node_to_number"])
+    graph = Graph(lol_properties, compact_index=True)
+
+    nodes = list(map_node_to_number.keys()) + [10**45, -1]
+    expected = [map_node_to_number[node] for node in nodes[:-2]] + [-1, -1]
+    assert graph.get_node_ids(nodes).tolist() == expected
+    for node, number in map_node_to_number.items():
+        assert graph.in_nodes(node)
+        assert graph.get_node_id(node) == number
+    assert not graph.in_nodes(10**45)
+
+
+def test_neighbors_views_and_edge_data():
+    lol_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph._graph
+
+    for node in range(len(lol_graph.neighbors_unweighted(0)) + 100):
+        neighbors, weights = lol_graph.neighbors_weighted(node)
+        neighbors_view, weights_view = lol_graph.neighbors_weighted_view(node)
+        assert np.array_equal(neighbors, neighbors_view)
+        assert np.array_equal(weights, weights_view)
+        assert np.array_equal(neighbors, lol_graph.neighbors_unweighted_view(node))
+
+        for neighbor, weight in zip(neighbors, weights):
+            assert lol_graph.get_edge_data(node, neighbor) == weight
+        assert lol_graph.get_edge_data(node, node) == -1
+
+
+def test_genotype_donor_weights():
+    graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    lol_graph = graph._graph
+    genos_ids = np.arange(lol_graph.array_start, lol_graph.array_start + 50)
+
+    offsets, donors_ids, weights = graph.genotype_donor_weights(genos_ids)
+    for i, geno_id in enumerate(genos_ids):
+        neighbors, neighbors_weights = lol_graph.neighbors_weighted(geno_id)
+        assert np.array_equal(donors_ids[offsets[i] : offsets[i + 1]], neighbors)
+        assert np.array_equal(weights[offsets[i] : offsets[i + 1]], neighbors_weights)
+
+
+def test_quantized_weights_build(tmp_path):
+    graph = BuildMatchingGraph(DONORS_DIR_PATH)._graph
+    build_matching = BuildMatchingGraph(DONORS_DIR_PATH, quantize_weights=True)
+    assert build_matching._graph["weights_list"].dtype == np.uint16
+
+    lol_graph = Graph(graph)._graph
+    quantized_lol_graph = build_matching.graph._graph
+    assert quantized_lol_graph.is_quantized()
+    num_of_donors = len(graph["map_number_to_num_node"])
+    # the subclasses' weights are not used
+    nodes = list(range(num_of_donors)) + list(
+        range(lol_graph.array_start, len(graph["index_list"]) - 1)
+    )
+    for node in nodes:
+        neighbors, weights = lol_graph.neighbors_weighted(node)
+        quantized_neighbors, quantized_weights = quantized_lol_graph.neighbors_weighted(
+            node
+        )
+        assert np.array_equal(neighbors, quantized_neighbors)
+        assert np.allclose(weights, quantized_weights, rtol=0, atol=1 / 65535)
+    for node in range(num_of_donors, lol_graph.array_start, 97):
+        assert np.array_equal(
+            lol_graph.neighbors_2nd(node)[0], quantized_lol_graph.neighbors_2nd(node)[0]
+        )
+
+    build_matching.to_directory(tmp_path)
+    assert Graph.from_directory(tmp_path)._graph.is_quantized()
+
+
+def test_donors_genotypes_pruning():
+    graph = BuildMatchingGraph(DONORS_DIR_PATH, min_genotype_probability=0.1).graph
+    full_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+
+    for donor in graph.donors()[:200]:
+        neighbors, weights = graph._graph.neighbors_weighted(graph.get_node_id(donor))
+        full_neighbors = full_graph._graph.neighbors_unweighted(
+            full_graph.get_node_id(donor)
+        )
+        assert 1 <= len(neighbors) <= len(full_neighbors)
+        assert np.isclose(weights.sum(), 1, atol=1e-5)
+        assert len(neighbors) == 1 or (weights >= 0.1).all()
+
+
+def test_donors_alleles_probabilities():
+    graph = BuildMatchingGraph(DONORS_DIR_PATH, donors_summary=True).graph
+    lol_graph = graph._graph
+    rng = np.random.default_rng(0)
+    donors_ids = rng.integers(len(graph.donors()), size=300)
+    alleles = lol_graph.arr_nodes_values_from_ids(
+        lol_graph.array_start + rng.integers(50, size=300)
+    )
+    alleles[:, 0] = rng.integers(
+        1, 10000, size=300
+    )  # mostly not in the donors' genotypes
+
+    probabilities = graph.donors_alleles_probabilities(donors_ids, alleles)
+    for i, donor_id in enumerate(donors_ids):
+        neighbors, weights = lol_graph.neighbors_weighted(donor_id)
+        genotypes = lol_graph.arr_nodes_values_from_ids(neighbors)
+        expected = [
+            weights[(genotypes == allele).any(axis=1)].sum() for allele in alleles[i]
+        ]
+        assert np.allclose(probabilities[i], expected, atol=1e-6)
+
+
+def _graph_structure(lol_properties):
+    """{node: sorted (neighbor, weight) pairs}, without the subclasses' weights"""
+    number_to_node = {
+        number: node for node, number in lol_properties["map_node_to_number"].items()
+    }
+    index_list = lol_properties["index_list"]
+    weights_list = np.array(lol_properties["weights_list"])
+    weights_list[
+        index_list[len(lol_properties["map_number_to_num_node"])] : index_list[
+            lol_properties["arrays_start"]
+        ]
+    ] = 0
+    return {
+        number_to_node[node]: sorted(
+            (number_to_node[int(neighbor)], float(weight))
+            for neighbor, weight in zip(
+                lol_properties["neighbors_list"][
+                    index_list[node] : index_list[node + 1]
+                ],
+                weights_list[index_list[node] : index_list[node + 1]],
+            )
+        )
+        for node in range(len(index_list) - 1)
+    }
+
+
+def test_update_equals_build(tmp_path):
+    with open(os.path.join(DONORS_DIR_PATH, "donors.txt")) as f:
+        lines = f.readlines()
+    starts = [i for i, line in enumerate(lines) if line.strip().endswith(",0")]
+    ids = [line.split(",")[0] for line in lines]
+
+    # the base misses the last 10 donors, one donor is removed and one is re-imputed
+    # with the genotypes of another donor
+    removed, updated, cut = starts[3], starts[5], starts[-10]
+    reimputed = [
+        ids[updated] + line[len(ids[line_number]) :]
+        for line_number, line in enumerate(lines)
+        if starts[-11] <= line_number < cut
+    ]
+    for directory, donors_lines in (
+        ("base", lines[:cut]),
+        (
+            "full",
+            lines[:removed]
+            + lines[starts[4] : updated]
+            + reimputed
+            + lines[starts[6] :],
+        ),
+    ):
+        os.makedirs(tmp_path / directory)
+        with open(tmp_path / directory / "donors.txt", "w") as f:
+            f.writelines(donors_lines)
+    with open(tmp_path / "delta_1.txt", "w") as f:
+        f.writelines([f"{ids[removed]}\n"] + lines[cut:])
+    with open(tmp_path / "delta_2.txt", "w") as f:
+        f.writelines(reimputed)
+
+    expected_graph = BuildMatchingGraph(tmp_path / "full")
+    for options in ({}, {"donors_summary": True}):
+        BuildMatchingGraph(tmp_path / "base", **options).to_directory(
+            tmp_path / "base_graph"
+        )
+        updated_graph = UpdateMatchingGraph(
+            tmp_path / "base_graph", tmp_path / "delta_1.txt"
+        )
+        updated_graph.update(tmp_path / "delta_2.txt")
+
+        # the delta segment has only the added and the updated donors
+        assert len(updated_graph._delta["map_number_to_num_node"]) == 11
+        merged_graph = updated_graph.graph
+        assert isinstance(merged_graph, MergedGraph)
+        assert merged_graph.has_donors_summary() == bool(options)
+        for engine in ("subclasses", "alleles"):
+            expected = find_matches(
+                PATIENTS_FILE_PATH,
+                expected_graph.graph,
+                threshold=0.0,
+                cutof=10,
+                engine=engine,
+            )
+            results = find_matches(
+                PATIENTS_FILE_PATH, merged_graph, threshold=0.0, cutof=10, engine=engine
+            )
+            assert list(results.keys()) == list(expected.keys())
+            for patient, results_df in expected.items():
+                pd.testing.assert_frame_equal(results[patient], results_df)
+
+        updated_graph.compact()
+        assert isinstance(updated_graph.graph, Graph)
+        assert _graph_structure(updated_graph._graph) == _graph_structure(
+            expected_graph._graph
+        )
+
+
+def test_parallel_build_equals_build(tmp_path):
+    with open(os.path.join(DONORS_DIR_PATH, "donors.txt")) as f:
+        lines = f.readlines()
+    starts = [i for i, line in enumerate(lines) if line.strip().endswith(",0")]
+    # shards that are split at the donors' boundaries
+    bounds = starts[::7] + [len(lines)]
+    for i, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        with open(tmp_path / f"donors_{i:02d}.txt", "w") as f:
+            f.writelines(lines[start:end])
+
+    expected_graph = BuildMatchingGraph(DONORS_DIR_PATH, min_genotype_probability=0.01)
+    parallel_graph = BuildMatchingGraph(
+        tmp_path, min_genotype_probability=0.01, n_workers=3
+    )
+    assert _graph_structure(parallel_graph._graph) == _graph_structure(
+        expected_graph._graph
+    )
+
+
+def test_neighbors_2nd_returns_all_the_genotypes():
+    lol_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph._graph
+    num_of_donors = len(lol_graph.num_nodes_values())
+
+    for node in range(num_of_donors, lol_graph.array_start):
+        genotypes_ids, genotypes_values = lol_graph.neighbors_2nd(node)
+        # the genotypes of the subclass's classes, including the last one
+        expected_ids = np.concatenate(
+            [
+                lol_graph.neighbors_unweighted(clss)
+                for clss in lol_graph.neighbors_unweighted(node)
+            ]
+        )
+        assert np.array_equal(genotypes_ids, expected_ids)
+        assert np.array_equal(
+            genotypes_values, lol_graph.arr_nodes_values_from_ids(expected_ids)
+        )
+
+
+def test_subclasses_genotypes_equal_neighbors_2nd(tmp_path):
+    build_matching = BuildMatchingGraph(DONORS_DIR_PATH, subclasses_genotypes=True)
+    build_matching.to_directory(tmp_path)
+    lol_graph = build_matching.graph._graph
+    num_of_donors = len(build_matching._graph["map_number_to_num_node"])
+
+    number_to_node = {
+        number: node
+        for node, number in build_matching._graph["map_node_to_number"].items()
+    }
+    for graph in (build_matching.graph, Graph.from_directory(tmp_path)):
+        for node in range(num_of_donors, lol_graph.array_start):
+            genotypes_ids, genotypes_values = graph.neighbors_2nd(number_to_node[node])
+            expected_ids, expected_values = lol_graph.neighbors_2nd(node)
+            assert np.array_equal(genotypes_ids, expected_ids)
+            assert np.array_equal(genotypes_values, expected_values)
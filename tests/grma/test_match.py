@@ -0,0 +1,251 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from grma.donorsgraph.build_donors_graph import BuildMatchingGraph
+from grma.match import Graph, find_matches, iter_matches, set_Database
+from grma.match import donors_matching, match as match_module
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data")
+DONORS_DIR_PATH = os.path.join(DATA_PATH, "test_donors")
+PATIENTS_FILE_PATH = os.path.join(DATA_PATH, "test_patients.txt")
+
+
+def test_parallel_and_batch_matching_equal_serial():
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    serial = find_matches(PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10)
+    for options in ({"n_workers": 2}, {"batch": True}):
+        parallel = find_matches(
+            PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10, **options
+        )
+
+        assert list(serial.keys()) == list(parallel.keys())
+        for patient, results_df in serial.items():
+            pd.testing.assert_frame_equal(results_df, parallel[patient])
+
+
+def test_donors_summary_matching_equals_neighbors(tmp_path):
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    build_matching = BuildMatchingGraph(DONORS_DIR_PATH, donors_summary=True)
+    build_matching.to_directory(tmp_path)
+    summary_graph = build_matching.graph
+    loaded_graph = Graph.from_directory(tmp_path)
+    assert summary_graph.has_donors_summary() and loaded_graph.has_donors_summary()
+
+    expected = find_matches(PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10)
+    for graph in (summary_graph, loaded_graph):
+        results = find_matches(PATIENTS_FILE_PATH, graph, threshold=0.0, cutof=10)
+        for patient, results_df in expected.items():
+            pd.testing.assert_frame_equal(results_df, results[patient])
+
+
+def test_combined_results_equal_patients_results():
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    patients_results = find_matches(
+        PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10
+    )
+    combined = find_matches(
+        PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10, combined=True
+    )
+
+    expected = pd.concat(list(patients_results.values()), ignore_index=True)
+    pd.testing.assert_frame_equal(combined, expected)
+    assert combined["Donor_ID"].dtype == "int64"
+
+
+def test_iter_matches_equals_find_matches():
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    expected = find_matches(PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10)
+    streamed = list(
+        iter_matches(PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10)
+    )
+
+    assert len(streamed) == len(expected)
+    for (patient, results_df), (expected_patient, expected_df) in zip(
+        streamed, expected.items()
+    ):
+        assert patient == expected_patient
+        pd.testing.assert_frame_equal(results_df, expected_df)
+
+
+def test_iter_matches_skips_blank_lines(tmp_path):
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    with open(PATIENTS_FILE_PATH) as f:
+        lines = f.read().splitlines()
+    patients_path = tmp_path / "patients.txt"
+    with open(patients_path, "w") as f:
+        f.write("\n".join(lines[:5] + ["", "  "] + lines[5:]) + "\n\n \n")
+
+    expected = find_matches(patients_path, donors_graph, threshold=0.0, cutof=10)
+    streamed = dict(iter_matches(patients_path, donors_graph, threshold=0.0, cutof=10))
+    assert list(streamed.keys()) == list(expected.keys())
+    for patient, results_df in expected.items():
+        pd.testing.assert_frame_equal(streamed[patient], results_df)
+
+
+def test_donors_info_taken_from_database():
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    donors = donors_graph.donors()[1:]  # the first donor is not in the database
+    donors_db = pd.DataFrame(
+        {"age": donors % 60, "center": [f"c{d % 7}" for d in donors]}, index=donors
+    )
+    # a duplicated donor gets the values of its first row
+    set_Database(pd.concat([donors_db, donors_db.iloc[:5].assign(age=-1)]))
+    try:
+        results = find_matches(
+            PATIENTS_FILE_PATH,
+            donors_graph,
+            donors_info=["age", "center", "unknown"],
+            threshold=0.0,
+            cutof=10,
+            combined=True,
+        )
+        # with all the donors in the database, the fields keep their dtypes
+        full_db = pd.DataFrame(
+            {"age": donors_graph.donors() % 60}, index=donors_graph.donors()
+        )
+        set_Database(full_db)
+        full_results = find_matches(
+            PATIENTS_FILE_PATH,
+            donors_graph,
+            donors_info=["age"],
+            threshold=0.0,
+            cutof=10,
+            combined=True,
+        )
+    finally:
+        set_Database()
+
+    assert full_results["age"].dtype == full_db["age"].dtype
+    assert (full_results["age"] == full_results["Donor_ID"] % 60).all()
+    assert "unknown" not in results.columns
+    for donor, age, center in zip(
+        results["Donor_ID"], results["age"], results["center"]
+    ):
+        if donor in donors_db.index:
+            assert (age, center) == tuple(donors_db.loc[donor, ["age", "center"]])
+        else:
+            assert pd.isna(age) and pd.isna(center)
+
+
+def test_blocks_cache():
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    expected = find_matches(PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10)
+
+    donors_graph.set_blocks_cache(10**8)
+    infos = []
+    for _ in range(2):
+        results = find_matches(
+            PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10
+        )
+        for patient, results_df in expected.items():
+            pd.testing.assert_frame_equal(results_df, results[patient])
+        infos.append(donors_graph.blocks_cache_info())
+    first_info, info = infos
+
+    # the second search finds all its blocks in the cache
+    assert info["misses"] == first_info["misses"] > 0
+    assert info["hits"] > first_info["hits"]
+    assert 0 < info["bytes"] <= info["max_bytes"]
+
+    # a small cache drops the least recently used blocks
+    donors_graph.set_blocks_cache(first_info["bytes"] // 2)
+    find_matches(PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10)
+    info = donors_graph.blocks_cache_info()
+    assert info["bytes"] <= info["max_bytes"] and info["blocks"] < first_info["blocks"]
+
+
+def test_bound_pruning_keeps_results(monkeypatch):
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    pruned = {
+        threshold: find_matches(
+            PATIENTS_FILE_PATH, donors_graph, threshold=threshold, combined=True
+        )
+        for threshold in (0.001, 0.01, 0.1)
+    }
+
+    for module in (match_module, donors_matching):
+        monkeypatch.setattr(module, "_can_reach", lambda bound, threshold: True)
+    for threshold, results in pruned.items():
+        expected = find_matches(
+            PATIENTS_FILE_PATH, donors_graph, threshold=threshold, combined=True
+        )
+        pd.testing.assert_frame_equal(results, expected)
+
+
+def test_patients_genotypes_pruning():
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    with open(PATIENTS_FILE_PATH) as f:
+        lines = [line for line in f if line.startswith("46764814,")]
+    probabilities = np.array([float(line.split(",")[2]) for line in lines])
+
+    g_m = donors_matching.DonorsMatching(donors_graph)
+    for max_genotypes, genotypes_mass in ((3, 1.0), (0, 0.5), (3, 0.5)):
+        g_m.load_patients(lines, max_genotypes, genotypes_mass)
+        _, _, kept_probabilities = g_m._patients_index.patient_genotypes(46764814)
+
+        expected = np.sort(probabilities)[::-1] / probabilities.sum()
+        if max_genotypes:
+            expected = expected[:max_genotypes]
+        expected = expected[: np.searchsorted(np.cumsum(expected), genotypes_mass) + 1]
+        assert np.isclose(g_m.dropped_probabilities[46764814], 1 - expected.sum())
+        assert np.allclose(np.sort(kept_probabilities)[::-1], expected / expected.sum())
+
+    results = find_matches(
+        PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10, max_genotypes=3
+    )
+    assert results[46764814].attrs["dropped_probability"] > 0
+
+
+def test_alleles_engine_equals_subclasses_engine(tmp_path):
+    build_matching = BuildMatchingGraph(DONORS_DIR_PATH, alleles_postings=True)
+    build_matching.to_directory(tmp_path)
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+
+    expected = find_matches(
+        PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=3, combined=True
+    )
+    # the inverted index is computed on the first search, or loaded with the graph
+    for graph in (donors_graph, Graph.from_directory(tmp_path)):
+        results = find_matches(
+            PATIENTS_FILE_PATH,
+            graph,
+            threshold=0.0,
+            cutof=3,
+            combined=True,
+            engine="alleles",
+        )
+        pd.testing.assert_frame_equal(results, expected)
+
+
+def test_equal_scores_ordered_by_donor_id():
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    results = find_matches(
+        PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10_000, combined=True
+    )
+
+    for _, level in results.groupby(["Patient_ID", "Number_Of_Mismatches"]):
+        expected = level.sort_values(
+            ["Matching_Probability", "Donor_ID"], ascending=[False, True]
+        )
+        assert level.index.tolist() == expected.index.tolist()
+
+
+def test_unbounded_cutof():
+    donors_graph = BuildMatchingGraph(DONORS_DIR_PATH).graph
+    expected = find_matches(
+        PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=10_000, combined=True
+    )
+    for cutof in (float("inf"), 10**10):
+        results = find_matches(
+            PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=cutof, combined=True
+        )
+        pd.testing.assert_frame_equal(results, expected)
+
+        streamed = iter_matches(
+            PATIENTS_FILE_PATH, donors_graph, threshold=0.0, cutof=cutof
+        )
+        pd.testing.assert_frame_equal(
+            pd.concat([df for _, df in streamed], ignore_index=True), expected
+        )
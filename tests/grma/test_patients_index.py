@@ -0,0 +1,32 @@
+import numpy as np
+
+from grma.match.patients_index import PatientsIndex
+from grma.utilities.geno_representation import HashableArray
+
+
+def test_patients_index_candidates():
+    patients_index = PatientsIndex()
+    geno = patients_index.add_genotype(HashableArray(range(10)))
+    patients_index.add_class(123, 0, geno)
+    patients_index.add_patient(7, [geno], [0], [1.0])
+    patients_index.add_patient(8, [geno], [2], [0.5])
+    patients_index.finalize()
+
+    assert patients_index.class_genotypes(123).tolist() == [geno]
+    assert patients_index.genotype_patients(geno)[0].tolist() == [0, 1]
+
+    def add(candidates, similarities, reset=False):
+        patients_index.add_candidates(
+            1, np.array(candidates), 2, 0.5, np.array(similarities), reset
+        )
+
+    add([30, 20], [8, 9])
+    add([10], [10], reset=True)
+    add([20, 10], [9, 10])
+    add([30], [7])
+
+    candidates, probabilities, similarities = patients_index.candidates(8)
+    assert candidates.tolist() == [10, 20, 30]
+    assert similarities.tolist() == [10, 9, 7]
+    assert probabilities.tolist() == [0.5, 0.5, 0.5]
+    assert len(patients_index.candidates(7)[0]) == 0
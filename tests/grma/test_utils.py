@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+from grma.utilities.utils import (
+    check_similarity,
+    drop_less_than_7_matches,
+    gl_string_to_integers,
+    match_genotypes,
+    pack_geno,
+    pack_genos,
+    parse_gl_lines,
+    subclasses_of_classes,
+    sum_scores_by_donor,
+    top_k_scores,
+    words_to_ints,
+)
+
+
+def test_pack_genos_equals_pack_geno():
+    genos = np.random.default_rng(0).integers(0, 10000, (100, 10), dtype=np.uint16)
+    for alleles in (genos, genos[:, :6], genos[:, 6:]):
+        assert words_to_ints(pack_genos(alleles)) == [
+            pack_geno(geno) for geno in alleles.tolist()
+        ]
+
+
+def test_subclasses_of_classes():
+    subclasses = subclasses_of_classes(np.array([[101, 201, 301, 302]]))
+    assert subclasses[0].tolist() == [
+        [0, 201, 301, 302],
+        [0, 101, 301, 302],
+        [101, 201, 0, 302],
+        [101, 201, 0, 301],
+    ]
+
+
+def test_sum_scores_and_top_k():
+    donors_ids = np.array([7, 3, 7, 5, 3, 9])
+    contributions = np.array([0.25, 0.5, 0.25, 0.5, 0.25, 0.1])
+    donors, scores = sum_scores_by_donor(donors_ids, contributions)
+    assert donors.tolist() == [3, 5, 7, 9]
+    assert scores.tolist() == [0.75, 0.5, 0.5, 0.1]
+
+    # 5 and 7 tie, so the lower donor's ID wins
+    best = top_k_scores(scores, donors, 2)
+    assert donors[best].tolist() == [3, 5]
+    assert donors[top_k_scores(scores, donors, 10)].tolist() == [3, 5, 7, 9]
+    assert donors[top_k_scores(scores, donors, float("inf"))].tolist() == [3, 5, 7, 9]
+
+
+def test_match_genotypes_equals_check_similarity():
+    rng = np.random.default_rng(1)
+    patients = np.sort(rng.integers(1, 4, (5, 5, 2), dtype=np.uint16), axis=2)
+    donors = np.sort(rng.integers(1, 4, (300, 5, 2), dtype=np.uint16), axis=2)
+    patients, donors = patients.reshape(5, 10), donors.reshape(300, 10)
+    donors_ids = np.arange(1000, 1300, dtype=np.uint32)
+    allele_range = np.array([0, 2, 4, 6, 8], dtype=np.uint8)
+
+    triples = match_genotypes(patients, donors, donors_ids, allele_range, 0)
+    for i, patient in enumerate(patients):
+        expected = drop_less_than_7_matches(
+            donors_ids, check_similarity(patient, donors, allele_range, 0)
+        )
+        assert np.array_equal(triples[triples[:, 1] == i][:, [0, 2]], expected)
+
+
+def test_parse_gl_lines_equals_gl_string_to_integers():
+    path = os.path.join(os.path.dirname(__file__), "data", "test_patients.txt")
+    with open(path) as f:
+        lines = f.readlines()
+    lines.append(
+        "7,A*02:01:01+A*01:101^B*07:02+B*08:01^C*07:01+C*07:02"
+        "^DQB1*02:01+DQB1*06:02^DRB1*03:01+DRB1*15:01N,1e-3,2\r\n"
+    )
+
+    ids, genotypes, probabilities, indices = parse_gl_lines(lines)
+    for i, line in enumerate(lines):
+        patient_id, geno, probability, index = line.strip().split(",")
+        geno = gl_string_to_integers(geno)
+        for x in range(0, 10, 2):
+            geno[x : x + 2] = sorted(geno[x : x + 2])
+        assert ids[i] == int(patient_id) and indices[i] == int(index)
+        assert probabilities[i] == float(probability)
+        assert genotypes[i].tolist() == geno
+
+    with pytest.raises(ValueError):
+        parse_gl_lines(["1,A*02:01+A*01:01^B*07:02,0.5,0"])